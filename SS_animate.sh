@@ -8,6 +8,10 @@
 # Do not run over a midnight boundary.
 # This variant for 3D ray tracing to establish sidescatter location and metric
 # Version 1.1 Gwyn Griffiths G3ZIL Sept-Dec 2025
+# An optional fourth argument YYYYMMDDHHMM gives the start time, otherwise it is the ut in the config file.
+# The UT of each frame is passed to the python scripts with --ut, the config file is not changed, so several
+# animations with the same config file can run at once
+# The frames are run by sweep.py with checkpoint and resume, see below, and --fresh may be added to start again
 #
 
 # Read the command line variables config file name, time span in minutes and frame interval
@@ -21,15 +25,21 @@ TIME_INTERVAL=$3  # must be 5, 10, 15, 20 or 30 minutes
 ITERATIONS=$(echo $((TIMESPAN / TIME_INTERVAL)))
 echo "Will run ${ITERATIONS} timesteps at interval ${TIME_INTERVAL} minutes with config prefix ${CONFIG_PREFIX}"
 
+if [ -n "$4" ]
+then                                # start time from the command line as YYYYMMDDHHMM, leading zeros removed
+  YEAR=${4:0:4}
+  MONTH=$((10#${4:4:2}))
+  DAY=$((10#${4:6:2}))
+  HOUR=$((10#${4:8:2}))
+  MINUTE=$((10#${4:10:2}))
+else
 # The time in the config file is as required by PyLap, this code splits out into its components
 YEAR=$(grep 'ut' <${CONFIG_FILE} | sed 's/ut = //' | tr -d "[" | tr -d "]" | awk -F, '{print$1}' | awk '{$1=$1};1')
 MONTH=$(grep 'ut' <${CONFIG_FILE} | sed 's/ut = //' | tr -d "[" | tr -d "]" | awk -F, '{print$2}' | awk '{$1=$1};1')
 DAY=$(grep 'ut' <${CONFIG_FILE} | sed 's/ut = //' | tr -d "[" | tr -d "]" | awk -F, '{print$3}' | awk '{$1=$1};1')
 HOUR=$(grep 'ut' <${CONFIG_FILE} | sed 's/ut = //' | tr -d "[" | tr -d "]" | awk -F, '{print$4}' | awk '{$1=$1};1')
 MINUTE=$(grep 'ut' <${CONFIG_FILE} | sed 's/ut = //' | tr -d "[" | tr -d "]" | awk -F, '{print$5}' | awk '{$1=$1};1')
-# keep a copy of the starting hour and minutes
-INIT_HOUR=${HOUR}
-INIT_MINUTE=${MINUTE}
+fi
 
 # form a datetime string for use in the csv filename as YYYmmddHHMM, padding mm,dd,HH,MM with 0 if needed
 FILETIME=${YEAR}
@@ -54,32 +64,9 @@ else
   FILETIME=${FILETIME}${MINUTE}
 fi
 
-# Now ready to loop in ${TIME_INTERVAL} minute intervals
-for ((i = 0 ; i < ${ITERATIONS} ; i++ ));
-do
-  if test -f ./output/csv/SS/${CONFIG_PREFIX}/${FILETIME}_ground_coords.csv; then     # Must start empty ground_coords file each time
-    rm ./output/csv/SS/${CONFIG_PREFIX}/${FILETIME}_ground_coords.csv
-  fi
-
-  echo "Running python SS_sidescatter prog at ${HOUR}:${MINUTE}"
-  python3 SS_sidescatter.py ${CONFIG_FILE} ${FILETIME}            # generates a csv file of ray landing spots using 3D ray tracing
-
-  echo "Running python SS_sidescatter_plot prog at ${HOUR}:${MINUTE}"
-  python3 SS_sidescatter_plot.py ${CONFIG_FILE} ${FILETIME} ${i}  # plots ray landing spots finds centroid and coincidence max_metric
-
-  MINUTE=$((MINUTE + TIME_INTERVAL))            # advance ut by ${TIME_INTERVAL}  mins for next run
-  if [ ${MINUTE} -gt  "55" ]        # posix compliant and using arithmetic context with -gt
-  then                              # new hour, so set minute to zero and increment hour
-     MINUTE=$((0))
-     HOUR=$((HOUR + 1))
-  fi
-  NEW_UT="ut = ["${YEAR}","${MONTH}","${DAY}","${HOUR}","${MINUTE}"]"
-  echo ${NEW_UT}
-  sed -i '/ut =/c\'"${NEW_UT}"'' ${CONFIG_FILE}     # next time into the config.ini file
-done
+# The loop over frames is in sweep.py, which records each completed frame in a manifest. Rerunning the same command
+# after a crash resumes with the missing frames, each failed frame is retried once
+python3 sweep.py sidescatter "$@"
 
 echo "Generating sidescatter metric animation as mp4"
-ffmpeg -framerate 15/1 -i ./output/plots/SS/${CONFIG_PREFIX}/2F_sidescatter_metric_%03d.png -c:v libx264 -vf fps=25 -pix_fmt yuv420p ./output/plots/SS/${CONFIG_PREFIX}/${FILETIME}_2F_sidescatter_animation.mp4
-
-INIT_UT="ut = ["${YEAR}","${MONTH}","${DAY}","${INIT_HOUR}","${INIT_MINUTE}"]"
-sed -i '/ut =/c\'"${INIT_UT}"'' ${CONFIG_FILE}      # reset time in config.ini file to what it was 
+ffmpeg -framerate 15/1 -i ./output/plots/SS/${CONFIG_PREFIX}/${FILETIME}_2F_sidescatter_metric_%03d.png -c:v libx264 -vf fps=25 -pix_fmt yuv420p ./output/plots/SS/${CONFIG_PREFIX}/${FILETIME}_2F_sidescatter_animation.mp4
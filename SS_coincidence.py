@@ -0,0 +1,91 @@
+# Module for the sidescatter coincidence metric between transmitter and pseudo transmitter (receiver) landing spots
+# The box metric in SS_sidescatter_plot.py multiplies counts in fixed 1˚ by 1˚ lat/lon boxes, so the result depends on
+# where the box edges fall and a box is narrower in km the further north it is. Here landing spots are projected to a
+# local azimuthal equidistant plane (km) about the middle of the tx-rx path and held in scipy cKDTree structures, so
+# neighbours within a radius in km are found quickly even for hundreds of thousands of spots from fine ray fans.
+# Two metrics, evaluated at any set of points (usually a regular lat lon grid):
+#   'pairs'   number of tx spots times number of rx spots within radius_km of the point, the box metric without boxes
+#   'kde'     product of Gaussian kernel density estimates of tx and rx spots, kernel sigma radius_km/2
+# find_peak returns the peak location with an uncertainty, the metric weighted spread of the points above half the peak.
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+earth_radius_km = 6371.0
+
+def project_aeqd(lat, lon, lat0, lon0):
+  """
+  Azimuthal equidistant projection on a sphere about (lat0, lon0). Returns x (east) and y (north) in km.
+  Distances and bearings from the centre are exact, and nearly so across a few thousand km.
+  """
+  phi = np.deg2rad(np.asarray(lat, dtype=float))
+  dlam = np.deg2rad(np.asarray(lon, dtype=float) - lon0)
+  phi0 = np.deg2rad(lat0)
+  cos_c = np.clip(np.sin(phi0)*np.sin(phi) + np.cos(phi0)*np.cos(phi)*np.cos(dlam), -1, 1)
+  c = np.arccos(cos_c)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    k = np.where(c > 1e-12, c/np.sin(c), 1.0)
+  x = earth_radius_km*k*np.cos(phi)*np.sin(dlam)
+  y = earth_radius_km*k*(np.cos(phi0)*np.sin(phi) - np.sin(phi0)*np.cos(phi)*np.cos(dlam))
+  return x, y
+
+class CoincidenceEngine(object):
+  def __init__(self, tx_lats, tx_lons, rx_lats, rx_lons, lat0, lon0):
+    """
+    tx_lats, tx_lons:   landing spots of rays from the transmitter
+    rx_lats, rx_lons:   landing spots of rays from the receiver as pseudo transmitter
+    lat0, lon0:         centre of the local projection, e.g. the mid point of the tx-rx path
+    """
+    self.lat0 = lat0
+    self.lon0 = lon0
+    self.tx_tree = cKDTree(np.column_stack(project_aeqd(tx_lats, tx_lons, lat0, lon0)))
+    self.rx_tree = cKDTree(np.column_stack(project_aeqd(rx_lats, rx_lons, lat0, lon0)))
+
+  def density(self, tree, points, radius_km, kind, max_pairs=2000000):
+    # Neighbour count within radius_km, or Gaussian kernel sum out to three sigma, at each point.
+    # The kernel sum takes the points in chunks holding at most about max_pairs point-spot pairs, so memory stays
+    # bounded however many spots and grid points there are
+    if kind == 'pairs':
+      return tree.query_ball_point(points, radius_km, return_length=True).astype(float)
+    sigma = radius_km/2.
+    counts = tree.query_ball_point(points, 3*sigma, return_length=True)
+    bounds = np.searchsorted(np.cumsum(counts), np.arange(max_pairs, counts.sum(), max_pairs), side='right')
+    bounds = np.unique(np.concatenate(([0], bounds, [len(points)])))
+    density = np.zeros(len(points))
+    for p0, p1 in zip(bounds[:-1], bounds[1:]):
+      if counts[p0:p1].sum() == 0:
+        continue
+      dist = cKDTree(points[p0:p1]).sparse_distance_matrix(tree, 3*sigma, output_type='coo_matrix')
+      weights = np.exp(-0.5*(dist.data/sigma)**2)
+      density[p0:p1] = np.bincount(dist.row, weights=weights, minlength=p1-p0)
+    return density/(2*np.pi*sigma**2)
+
+  def metric(self, lats, lons, radius_km=50., kind='pairs'):
+    """
+    Coincidence metric at points lats, lons (any matching shapes), returned with the same shape.
+    kind 'pairs' counts spots within radius_km, 'kde' uses Gaussian kernels of sigma radius_km/2 (spots per km^2).
+    """
+    lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+    points = np.column_stack(project_aeqd(lats.ravel(), lons.ravel(), self.lat0, self.lon0))
+    tx_density = self.density(self.tx_tree, points, radius_km, kind)
+    rx_density = self.density(self.rx_tree, points, radius_km, kind)
+    return (tx_density*rx_density).reshape(lats.shape)
+
+  def find_peak(self, lats, lons, metric):
+    """
+    Peak of a metric evaluated at lats, lons. Returns dict with 'lat', 'lon', 'value' at the maximum and
+    'sigma_km', the metric weighted rms distance from the peak of the points above half the peak value,
+    as an estimate of how well the hotspot is located (0 if only one point is above half).
+    """
+    lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+    metric = np.asarray(metric, dtype=float)
+    inx = np.argmax(metric)
+    peak = {'lat':lats.ravel()[inx], 'lon':lons.ravel()[inx], 'value':metric.ravel()[inx], 'sigma_km':np.nan}
+    if peak['value'] <= 0:
+      return peak
+    above = metric.ravel() >= 0.5*peak['value']
+    x, y = project_aeqd(lats.ravel()[above], lons.ravel()[above], self.lat0, self.lon0)
+    x0, y0 = project_aeqd(peak['lat'], peak['lon'], self.lat0, self.lon0)
+    w = metric.ravel()[above]
+    peak['sigma_km'] = float(np.sqrt(np.sum(w*((x-x0)**2 + (y-y0)**2))/np.sum(w)))
+    return peak
@@ -0,0 +1,77 @@
+# Module to find ray ground landing spots in PyLap raytrace_3d output for the sidescatter scripts
+# All rays of a raytrace_3d call are handled together: the per-ray path arrays are joined into one long array and the
+# first sample after launch below ground_ht is found for every ray with one mask and one np.unique, no Python loop
+# over samples. The landing position is then interpolated to the point where the path reaches the ground (0 km) between
+# that sample and the one before, when the crossing lies between them, rather than taking the coarse sample itself.
+#
+# Tables are numpy arrays with one row per landed ray and the columns of the _ground_coords.csv file:
+#   source (0=tx, 1=pseudo-tx at rx), ray bearing (˚), rayId, initial elevation (˚), apogee (km), PyLap Doppler (Hz),
+#   landing spot lat (˚), landing spot lon (˚)
+
+import numpy as np
+
+import stage_metrics               # module in this directory, stage timing and counters
+
+columns = ['source','bearing','rayId','initial_elev','apogee','pylap_doppler','lat','lon']
+csv_fmt = ['%d','%.3f','%d','%.3f','%.3f','%.3f','%.6f','%.6f']    # rounding as written by SS_sidescatter.py
+
+def extract_landings(ray_O, ray_data_O, ray_bears, flag, ground_ht=5.0, min_index=10):
+  """
+  Landing spots of one raytrace_3d call.
+
+  ray_O, ray_data_O:  ray path and ray data lists returned by raytrace_3d
+  ray_bears:          bearing of each ray (˚), scalar or one per ray
+  flag:               source column value, 0 for the tx fan and 1 for the receiver
+  ground_ht:          a path sample below this height (km) is taken as on the ground
+  min_index:          samples up to and including this index are ignored as being near the launch point
+
+  Returns a table of shape (n_landed, 8), see the columns at the top of this module.
+  """
+  n_rays = len(ray_O)
+  if n_rays == 0:
+    return np.empty((0,len(columns)))
+  lengths = np.array([len(ray['height']) for ray in ray_O])
+  starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+  height = np.concatenate([ray['height'] for ray in ray_O])
+  lat = np.concatenate([ray['lat'] for ray in ray_O])
+  lon = np.concatenate([ray['lon'] for ray in ray_O])
+  ray_of_sample = np.repeat(np.arange(n_rays), lengths)
+  sample_index = np.arange(len(height)) - starts[ray_of_sample]
+
+  on_ground = (height < ground_ht) & (sample_index > min_index)
+  landed, first = np.unique(ray_of_sample[on_ground], return_index=True)
+  k = np.flatnonzero(on_ground)[first]          # first ground sample of each landed ray in the joined arrays
+
+  # Fraction of the step from sample k-1 to k where height reaches 0, limited to the step itself
+  h0, h1 = height[k-1], height[k]
+  with np.errstate(invalid='ignore', divide='ignore'):
+    frac = np.clip(np.where(h0 > h1, h0/(h0-h1), 1.0), 0.0, 1.0)
+  land_lat = lat[k-1] + frac*(lat[k]-lat[k-1])
+  land_lon = lon[k-1] + frac*(lon[k]-lon[k-1])
+
+  table = np.empty((len(landed), len(columns)))
+  table[:,0] = flag
+  table[:,1] = np.broadcast_to(np.asarray(ray_bears, dtype=float), (n_rays,))[landed]
+  table[:,2] = landed
+  table[:,3] = [np.squeeze(ray_O[i]['initial_elev']) for i in landed]
+  table[:,4] = [ray_data_O[i]['apogee'][0] for i in landed]
+  table[:,5] = [ray_data_O[i]['Doppler_shift'][0] for i in landed]
+  table[:,6] = land_lat
+  table[:,7] = land_lon
+  return table
+
+def join_tables(tables):
+  """
+  Join a list of landing tables into one, empty tables allowed.
+  """
+  tables = [t for t in tables if len(t) > 0]
+  if len(tables) == 0:
+    return np.empty((0,len(columns)))
+  return np.concatenate(tables)
+
+def write_landings(fname, table):
+  """
+  Write a landing table in one go as the headerless _ground_coords.csv layout read by SS_sidescatter_plot.py.
+  """
+  np.savetxt(fname, table, fmt=csv_fmt, delimiter=',')
+  stage_metrics.count('rows_written', len(table))
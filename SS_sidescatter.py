@@ -4,6 +4,9 @@
 # %
 # % Purpose : Finds the locations of ray landing spots from transmitter, including receiver as a pseudo-transmitter
 #             where reciprocity is assumed. Reads config.ini file for tx and rx and other parameters.
+#             An optional --ut YYYYMMDDHHMM after the two command line arguments gives the UT in place of ut in the
+#             config file. The config file is only read: distance, bearing and refined peak go to the run record in
+#             ./output/runs, see run_spec.py
 #             Outputs ray parameters, elevation angle, PyLap Doppler (!), and lat and lon of ray landing spots
 #             Limitations: Northern hemisphere only. One hop out and one hop back. Full 360˚ in azimuth.
 #                          Azimuth step limited by comouter memory, 3˚ is OK with 8 GB
@@ -24,66 +27,36 @@
 # %   V2.1 PyLap coding by Devin Diehl, U Scranton with additions by Gwyn Griffiths G3ZIL
 #     V3.0 Version for use with HamSCI auto ident PSWS analysis Gwyn Griffiths Oct-Dec 2025
 
-import math
 import numpy as np  # py
-import time
 import ctypes as c
 import matplotlib.pyplot as plt
-import csv				#  This is to write out data
 import sys
-import configparser
-import ast
 import os
 import maidenhead as mh            # locators to lat lon, hence distance and bearing
 from geographiclib.geodesic import Geodesic 
-from pathlib import Path
 
-################################################################
-# add the paths for pylap as  we are likely in a protected environment 
-pylappath=str(os.environ['PYTHONPATH'])    # this requirement to add to path easy to do
-                                           # Not so easy for the directory pylap-0.1.0a0-py3.12-linux-x86_64.egg
-def find_dir_path(name, start_path='.'):
-    """Recursively finds the first directory matching a given name."""
-    start_dir = Path(start_path)
-    for path in start_dir.rglob(name):
-       if path.is_dir():
-            return path.resolve() # .resolve() returns the absolute path
-    return None
-
-userid=str(os.getlogin())
-pylapeggpath = str(find_dir_path('pylap-0.1.0a0-py3.12-linux-x86_64.egg','/home/'+userid+'/.local/'))
-if pylapeggpath is None:
-  print ("Cannot find pylap-0.1.0a0-py3.12-linux-x86*** path. Exiting")
-  sys.exit()
-
-print("PyLap main at: ",pylappath, "egg at", pylapeggpath)
-
-sys.path.insert(0,pylappath)   # these two additions to search path needed as in ext managed environment
-sys.path.insert(0, pylapeggpath)
-
-###################
-# The PyLap part
-###################
-from Ionosphere import gen_iono_grid_3d as gen_iono
-from pylap.raytrace_3d import raytrace_3d
-from pylap.igrf2016 import igrf2016
-from Maths import raz2latlon
-from Maths import latlon2raz
+import SS_landing                  # module in this directory, vectorised ray landing spot extraction
+import SS_trace                    # module in this directory, grids, ray fans and FF metric shared with SS_sidescatter_batch.py
+import raytrace_backend            # module in this directory, PyLap or its analytic stand-in
+import run_spec                    # module in this directory, read only config and per run output records
+import stage_metrics               # module in this directory, stage timing, counters and peak memory
 
 #------------------------------------------------------------------------------
 # Read in configuration from a *_config.ini  got from the first command line parameter
 #
 config_file = sys.argv[1]                  # filename from calling script is prefix_config.ini where prefix could be callsign   
-callsign=str(config_file.split('_')[0])    # extract callsign to use for subdirectory of output/csv csv, str to convery list item, here 1st, to string var
-callsign=callsign.split("/",2)[2]
+file_time=sys.argv[2]  # this is date time in form YYYYMMDDHHMM for prefix to csv file name
+stage_metrics.start('SS_sidescatter')      # stage times and counts to ./output/profiles at exit, the ray tracer's
+stage_metrics.mark('setup')                # iono and raytrace stages are timed in raytrace_backend.py
 
 # set up base directory, and the directory path for config file 
 base_directory='./'
 
-config = configparser.ConfigParser()
-config.read(config_file)           # the accompanying bash script will update this file for successive runs of this python script 
+config = run_spec.load(config_file, sys.argv, file_time)   # read only, UT from --ut if the bash script gives it
+callsign=config.callsign                   # callsign to use for subdirectory of output/csv
+tracer=raytrace_backend.from_config(config) # PyLap unless raytracer = analytic in [settings]
 
-UT=ast.literal_eval(config.get('settings','ut'))  # The parameters for PyLap, 'get' by itself returns text
+UT=list(config.ut)                         # The parameters for PyLap
 R12=config['settings'].getint('r12')
 freq=config['settings'].getfloat('freq')
 nhops=config['settings'].getint('nhops')          # This will be one for two hop sidescatter.
@@ -96,12 +69,13 @@ elev_stop=config['settings'].getfloat('elev_stop')
 
 ray_inc=config['3d_sidescatter'].getfloat('ray_inc')
 
-file_time=sys.argv[2]  # this is date time in form YYYYMMDDHHMM for prefix to csv file name
-
-# Constants
-speed_of_light = 2.99792458e8  	# in m/s
-origin_ht = 0.0  		# altitude of the start point of rays. What units are these?
-doppler_flag = 1                # interested in Doppler shift, but as of DEc 2025 PyLap Doppler has a bug
+# Optional two stage mode: refine = 1 in [3d_sidescatter] re-traces, at fine_ray_inc azimuth and fine_elev_inc elevation steps,
+# only the coarse rays whose landing spots fall within refine_radius degrees of the provisional FF metric peak
+refine_flag=config['3d_sidescatter'].getint('refine', fallback=0)
+fine_ray_inc=config['3d_sidescatter'].getfloat('fine_ray_inc', fallback=0.25)
+fine_elev_inc=config['3d_sidescatter'].getfloat('fine_elev_inc', fallback=0.25)
+refine_radius=config['3d_sidescatter'].getfloat('refine_radius', fallback=2.0)
+fine_box=config['3d_sidescatter'].getfloat('fine_box', fallback=0.25)     # box size in degrees for the refined metric
 
 # set directory for csv output file. Create if it does not exist
 output_dir=os.path.join(base_directory,'output','csv','SS',callsign)
@@ -110,9 +84,7 @@ if not os.path.exists(output_dir):
 
 ####################################################
 # Derivations from user variables above
-elevs = np.arange(elev_start, elev_stop, 1, dtype=float)   # hard coded elevation increment of 1 deg
-num_elevs = len(elevs)
-freqs = freq * np.ones(num_elevs, dtype=float) 
+elevs, freqs, array_of_bears = SS_trace.fan(config)   # 1˚ elevations, full 360˚ in azimuth at ray_inc
 
 origin_lat,origin_long=mh.to_location(tx_grid, center=True)   # convert 6 char Maidenhead to centre of box lat long
 rx_lat,rx_long=mh.to_location(rx_grid, center=True)
@@ -123,166 +95,91 @@ ray_bear=int(np.floor(path_object['azi1']))   # returns initial bearing clockwse
 recip_path_object=Geodesic.WGS84.Inverse(rx_lat, rx_long, origin_lat,origin_long)
 recip_ray_bear=int(np.floor(recip_path_object['azi1']))      # returns reciprocal initial bearing clockwse from North in degrees
 
-# update the config file with tx_to_rx distance and bearing 
-config.set('settings', 'distance', str(round(distance,3)))
-config.set('settings', 'bearing', str(round(ray_bear,1)))
-
-with open(config_file, 'w') as configfile:
-    config.write(configfile)
-
-# azimuthal bearing range is full 360 degrees. ray_inc is 3 deg (in config file) is 3 deg for 8 GB memory machine.
-min_bear=0
-max_bear=360
-array_of_bears = np.arange(min_bear, max_bear, ray_inc)
-
-# Derive lats and lons of bounding box for ionosphere, specific to tx/rx pair, as tight as possible to minimise compute time           #
-lat_inc = 1                                         # this is standard in PyLap
-lat_start = int(np.min([origin_lat,rx_lat])-32.0) # 32˚ is 3600 km, max one hop distance, so subtract from min of lats of tx and tx
-lat_stop = int(np.max([origin_lat,rx_lat])+32.0)  # apply to northernmost (remember only northern hemisphere for now)
-num_lat = int(lat_stop-lat_start)+1
-
-lon_inc = 1
-lon_start = int(np.min([origin_long,rx_long])-32/np.cos(np.rad2deg(np.min([origin_lat,rx_lat])))) # same 3600 km,but divide 32˚ by cos lat to scale properly 
-lon_stop = int(np.max([origin_long,rx_long])+32/np.cos(np.rad2deg(np.min([origin_lat,rx_lat]))))
-num_lon = int(lon_stop-lon_start)+1
-
-print("lat_start,num_lat,lon_start,num_lon: ", lat_start,num_lat,lon_start,num_lon)
+# record tx_to_rx distance and bearing for this run
+run_record={'distance':round(distance,3), 'bearing':round(ray_bear,1)}
+run_spec.write_record(config, 'sidescatter', run_record)
+
+################################
+# Functions for the refinement stage
+################################
+
+def fine_rays(coords, flag, peak_lat, peak_lon):
+  # Fine elevation and bearing grid covering each coarse ray (bearing +- ray_inc/2, elevation +- 0.5˚) of source flag
+  # whose landing spot is within refine_radius degrees of the provisional peak
+  near = (coords[:,0] == flag) & (np.abs(coords[:,6]-peak_lat) <= refine_radius) & \
+         (np.abs((coords[:,7]-peak_lon)*np.cos(np.deg2rad(peak_lat))) <= refine_radius)
+  cells = set((round(c[1],3), round(c[3],3)) for c in coords[near])     # (bearing, elevation) of coarse rays, no repeats
+  ray_elevs, ray_bears = [], []
+  for bear, elev in cells:
+    fine_b = np.arange(bear-ray_inc/2, bear+ray_inc/2, fine_ray_inc)
+    fine_e = np.arange(elev-0.5, elev+0.5, fine_elev_inc)
+    fine_e = fine_e[(fine_e >= elev_start) & (fine_e < elev_stop)]
+    bb, ee = np.meshgrid(fine_b, fine_e)
+    ray_bears.extend(np.mod(bb.ravel(), 360))
+    ray_elevs.extend(ee.ravel())
+  return np.array(ray_elevs, dtype=float), np.array(ray_bears, dtype=float)
+
+# Bounding box for the ionosphere, specific to tx/rx pair, as tight as possible to minimise compute time
+box = SS_trace.bounding_box([origin_lat,rx_lat], [origin_long,rx_long])
+print("lat_start,num_lat,lon_start,num_lon: ", box['lat_start'],box['num_lat'],box['lon_start'],box['num_lon'])
 
 # ###########################################################################
-# % Generate ionospheric, geomagnetic and irregularity grids
-# % These must cover the entire area of interest for both tx and pseudo tx, geometry-dependent limits calculated above
-# %
-# % User variables
-max_range = 3200  		# M maximum range for sampling the ionosphere (km) This is less than the grid to be sure we are inside
-num_range = 201  		# M number of ranges (must be < 2000)
-
-start_height = 80  		# M start height for ionospheric grid (km)
-height_inc = 2  		# M height increment (km)
-num_heights = 201  		# M number of  heights (must be < 2000). These values take up to 460 km
-ht_start = 80  			# % start height for ionospheric grid (km), i.e. within the D layer
-ht_inc = 2  			# % height increment (km)
-num_ht = 201
-
-# % Derivations from user variables
-range_inc = max_range / (num_range - 1)  # py
-
-iono_grid_parms = [lat_start, lat_inc, num_lat, lon_start, lon_inc, num_lon, ht_start, ht_inc, num_ht]
-
-#  Now the geomagnetic grid
-#  Variables copied from ionospheric grid, but lat lon inc set at 1 deg each
-B_ht_start = ht_start  		# % start height for geomagnetic grid (km)
-B_ht_inc = 10		  	# % height increment (km)
-B_lat_start = lat_start
-B_lat_inc = 1.0
-B_lon_start = lon_start
-B_lon_inc = 1.0
-
-# Derivations from user parameters
-B_num_ht = math.ceil(num_ht * ht_inc / B_ht_inc)
-B_num_lat = math.ceil(num_lat * lat_inc / B_lat_inc)
-B_num_lon = math.ceil(num_lon * lon_inc / B_lon_inc)
-
-geomag_grid_parms = [B_lat_start, B_lat_inc, B_num_lat, B_lon_start, B_lon_inc, B_num_lon, B_ht_start, B_ht_inc, B_num_ht]
-
-tic = time.time()
-
+# Generate ionospheric, geomagnetic and irregularity grids
+# These must cover the entire area of interest for both tx and pseudo tx, geometry-dependent limits calculated above
 print('\n 3D magneto-ionic numerical raytracing for 2F sidescatter study on WGS84 ellipsoidal Earth\n\n')
 print('Generating ionospheric and geomag grids... ')
 
-print (UT, R12, iono_grid_parms, geomag_grid_parms)
-
-[iono_pf_grid, iono_pf_grid_5, collision_freq, Bx, By, Bz] = \
-    gen_iono.gen_iono_grid_3d(UT, R12, iono_grid_parms, geomag_grid_parms, doppler_flag)  # all within range except collision_freq
-
-toc = time.time()
-# % convert plasma frequency grid to electron density in electrons/cm^3
-iono_en_grid = iono_pf_grid**2 / 80.6164e-6
-iono_en_grid_5 = iono_pf_grid_5**2 / 80.6164e-6
+stage_metrics.mark(None)         # the grid and trace calls are the iono and raytrace stages, so stage times add up to the total
+grids = SS_trace.gen_grids(tracer, UT, R12, box)
 
 #####################################################
 # call raytrace - have dropped no-mag field option
 # Ionosphere etc is same for tx->rx and rx->tx so code above only needed once
-# But separate ray trace runs, first tx->rx then rx->tx 
+# But separate ray trace runs, first tx->rx then rx->tx, 0 metadata for transmitter data, 1 for pseudo transmitter
+landings=[SS_trace.trace_fan(tracer, grids, origin_lat, origin_long, elevs, freqs, array_of_bears, nhops, 0),
+          SS_trace.trace_fan(tracer, grids, rx_lat, rx_long, elevs, freqs, array_of_bears, nhops, 1)]
 
-tol = [1e-7, 0.01, 25]  # % ODE solver tolerance and min max stepsizes
-
-with open(output_dir+'/'+file_time+'_ground_coords.csv', 'w', encoding='UTF8',) as out_file:     # open csv file to write tx rays 
-  writer=csv.writer(out_file)
- 
- # tx->rx run
-  for ray_bear in array_of_bears:
-    ray_bears = np.zeros(len(elevs)) + ray_bear
-    # % Generate the O mode rays
-    OX_mode = 1
-
-    print("\nGenerating ", num_elevs, " O-mode rays ...")
-    tic = time.time()
-    [ray_data_O, ray_O, ray_state_vec_O] = \
-        raytrace_3d(origin_lat, origin_long, origin_ht, elevs, ray_bears, freqs,
-                    OX_mode, nhops, tol, iono_en_grid, iono_en_grid_5,
-                    collision_freq, iono_grid_parms, Bx, By, Bz,
-                    geomag_grid_parms)
-    NRT_total_time = time.time()
-
-    for rayId in range(0, num_elevs):
-        num = len(ray_O[rayId]['lat'])
-        ground_range = np.zeros((2, num))
-        lat = ray_O[rayId]['lat']
-        lon = ray_O[rayId]['lon']
-        height = ray_O[rayId]['height']
-        initial_elev = ray_O[rayId]['initial_elev']
-        apogee = ray_data_O[rayId]['apogee']
-        pylap_doppler = ray_data_O[rayId]['Doppler_shift']
-
-        indices=np.array([i for i,v in enumerate(height < 5) if v])     # can't assume last element in height array is ground i.e. 0
- 									# use this enumerate approch for numpy array 'height'
-        gnd_index=[i for i in indices if i>10]	# line above resulted in a list of indicies of height <5 km
-						# use list comprehension approach to find indices > 10, i.e. not near launch
-        if len(gnd_index)>0:			# only interested if there is a ray grounding. Use 0 metadata for transmitter data
-           writer.writerow([0,ray_bears[0],rayId,round(initial_elev,3),round(apogee[0],3), round(pylap_doppler[0],3),\
-             round(lat[gnd_index[0]],6),round(lon[gnd_index[0]],6)])		# write out metadata and position
-        ground_range[0:num] = latlon2raz.latlon2raz(lat[0:num], lon[0:num], origin_lat,
-                                                    origin_long, 'wgs84') 
-        
-        ground_range = ground_range/1000.0  # % for result in km
-        ray_O[rayId]['ground_range'] = ground_range[0]
+stage_metrics.mark('write')
+coords=SS_landing.join_tables(landings)
+SS_landing.write_landings(output_dir+'/'+file_time+'_ground_coords.csv', coords)
+print("Landing spots tx ", np.count_nonzero(coords[:,0] == 0), " rx ", np.count_nonzero(coords[:,0] == 1))
 
 ############################################################
- # rx->tx run
-  for ray_bear in array_of_bears:
-    ray_bears = np.zeros(len(elevs)) + ray_bear
-    # % Generate the O mode rays
-    OX_mode = 1
-
-    print("\nGenerating ", num_elevs, " O-mode rays ...")
-    tic = time.time()
-    [ray_data_O, ray_O, ray_state_vec_O] = \
-        raytrace_3d(rx_lat, rx_long, origin_ht, elevs, ray_bears, freqs,
-                    OX_mode, nhops, tol, iono_en_grid, iono_en_grid_5,
-                    collision_freq, iono_grid_parms, Bx, By, Bz,
-                    geomag_grid_parms)
-    NRT_total_time = time.time()
-
-    for rayId in range(0, num_elevs):
-        num = len(ray_O[rayId]['lat'])
-        ground_range = np.zeros((2, num))
-        lat = ray_O[rayId]['lat']
-        lon = ray_O[rayId]['lon']
-        height = ray_O[rayId]['height']
-        initial_elev = ray_O[rayId]['initial_elev']
-        apogee = ray_data_O[rayId]['apogee']
-        pylap_doppler = ray_data_O[rayId]['Doppler_shift']
-
-        indices=np.array([i for i,v in enumerate(height < 5) if v])     # can't assume last element in height array is ground i.e. 0
- 									# use this enumerate approch for numpy array 'height'
-        gnd_index=[i for i in indices if i>10]	# line above resulted in a list of indicies of height <5 km
-						# use list comprehension approach to find indices > 10, i.e. not near launch
-#         print (gnd_index)
-        if len(gnd_index)>0:			# only interested if there is a ray grounding. Use 1 metadata for transmitter data
-           writer.writerow([1,ray_bears[0],rayId,round(initial_elev,3),round(apogee[0],3), round(pylap_doppler[0],3),\
-             round(lat[gnd_index[0]],6),round(lon[gnd_index[0]],6)])		# write out metadata and position
-        ground_range[0:num] = latlon2raz.latlon2raz(lat[0:num], lon[0:num], origin_lat,
-                                                    origin_long, 'wgs84') 
-        
-        ground_range = ground_range/1000.0  # % for result in km
-        ray_O[rayId]['ground_range'] = ground_range[0]
+# Optional refinement stage: provisional peak from the coarse landing spots, then fine re-trace of the bearing and
+# elevation sectors landing near it from both tx and rx, and the hotspot located on a fine_box grid
+if refine_flag:
+  stage_metrics.mark('refine')
+  lat_edges, lon_edges = SS_trace.box_edges(box)
+  coarse_metric=SS_trace.FF_metric(coords, lat_edges, lon_edges)
+  i,j,peak_lat,peak_lon=SS_trace.metric_peak(coarse_metric, lat_edges, lon_edges)
+  print("Provisional peak metric ", coarse_metric[i,j], " at lat ", peak_lat, " lon ", peak_lon)
+
+  tx_elevs, tx_bears = fine_rays(coords, 0, peak_lat, peak_lon)
+  rx_elevs, rx_bears = fine_rays(coords, 1, peak_lat, peak_lon)
+  n_uniform = 2*len(np.arange(0,360,fine_ray_inc))*len(np.arange(elev_start,elev_stop,fine_elev_inc))
+  print("Fine rays tx ", len(tx_elevs), " rx ", len(rx_elevs), " against ", n_uniform, " for a uniformly fine sweep")
+
+  stage_metrics.mark(None)
+  print("Generating ", len(tx_elevs)+len(rx_elevs), " fine O-mode rays ...")
+  fine = SS_landing.join_tables([SS_trace.trace_rays(tracer, grids, origin_lat, origin_long, tx_elevs, tx_bears, freq, nhops, 0),
+                                 SS_trace.trace_rays(tracer, grids, rx_lat, rx_long, rx_elevs, rx_bears, freq, nhops, 1)])
+  stage_metrics.mark('refine')
+  SS_landing.write_landings(output_dir+'/'+file_time+'_ground_coords_fine.csv', fine)    # same layout as coarse file
+
+  lat_edges=np.arange(peak_lat-refine_radius-1, peak_lat+refine_radius+1+fine_box/2, fine_box)
+  lon_edges=np.arange(peak_lon-refine_radius-1, peak_lon+refine_radius+1+fine_box/2, fine_box)
+  fine_metric=SS_trace.FF_metric(fine, lat_edges, lon_edges)
+  if np.max(fine_metric) > 0:
+    i,j,_,_=SS_trace.metric_peak(fine_metric, lat_edges, lon_edges)
+    i0,i1,j0,j1=max(i-1,0),i+2,max(j-1,0),j+2      # metric weighted centroid of the 3x3 boxes around the maximum
+    weights=fine_metric[i0:i1,j0:j1]
+    box_lats=lat_edges[i0:i1]+fine_box/2
+    box_lons=lon_edges[j0:j1]+fine_box/2
+    refined_lat=np.sum(weights*box_lats[:,None])/np.sum(weights)
+    refined_lon=np.sum(weights*box_lons[None,:])/np.sum(weights)
+    print("Refined peak at lat ", round(refined_lat,3), " lon ", round(refined_lon,3))
+    run_record['refined_max_lat']=round(refined_lat,3)
+    run_record['refined_max_lon']=round(refined_lon,3)
+    run_spec.write_record(config, 'sidescatter', run_record)
+  else:
+    print("No coincident fine landing spots near the provisional peak, refined location not updated")
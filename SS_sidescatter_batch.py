@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# % Name :
+# %   SS_sidescatter_batch.py
+# %
+# % Purpose : Batch form of SS_sidescatter.py for one transmitter and several receivers at the same UT.
+#             The 3D ionospheric and geomagnetic grids and the full 360˚ ray fan from the transmitter are identical for
+#             every receiver studying the same WWV/CHU transmitter, so they are generated and traced once. Each receiver
+#             (pseudo transmitter by reciprocity) fan is then traced once and all tx-rx sidescatter metrics are found from
+#             the saved landing spots.
+#             Command line arguments: time in form YYYYMMDDHHMM for file names, then the *_config.ini file of each receiver
+#               e.g. python3 SS_sidescatter_batch.py 202407260000 ./config/N8GA_config.ini ./config/W2NAF_config.ini
+#             An optional --ut YYYYMMDDHHMM gives the UT in place of ut in the config files, as for SS_sidescatter.py.
+#             The receiver config files must agree on tx_grid, ut, r12, freq, nhops, elevations, ray_inc and raytracer.
+#             Outputs, per receiver, the same *_ground_coords.csv as SS_sidescatter.py so SS_sidescatter_plot.py can be
+#             run unchanged, plus *_FF_metric.csv, and a summary *_batch_metrics.csv of peak metric and location per receiver
+#             in ./output/csv/SS/<tx>
+#             Limitations as SS_sidescatter.py: Northern hemisphere only, one hop out and one hop back.
+#             The ionosphere bounding box spans the union of the transmitter and all receivers.
+
+import numpy as np  # py
+import time
+import csv				#  This is to write out data
+import sys
+import os
+import maidenhead as mh            # locators to lat lon, hence distance and bearing
+
+import SS_landing                  # module in this directory, vectorised ray landing spot extraction
+import SS_trace                    # module in this directory, grids, ray fans and FF metric shared with SS_sidescatter.py
+import raytrace_backend            # module in this directory, PyLap or its analytic stand-in
+import run_spec                    # module in this directory, read only config and per run output records
+import stage_metrics               # module in this directory, stage timing, counters and peak memory
+
+#------------------------------------------------------------------------------
+# Read in the receiver configurations
+#
+if len(sys.argv) < 3:
+  print ("Rerun with time as YYYYMMDDHHMM and one or more receiver config files as command line arguments")
+  sys.exit()
+
+file_time=sys.argv[1]          # this is date time in form YYYYMMDDHHMM for prefix to csv file name
+ut=run_spec.ut_arg(sys.argv)   # UT from --ut in place of ut in every config file, when given
+config_files=[arg for arg in sys.argv[2:] if arg not in ('--ut', ut)]
+stage_metrics.start('SS_sidescatter_batch')   # stage times and counts to ./output/profiles at exit
+stage_metrics.mark('setup')
+
+base_directory='./'
+receivers=[]
+for config_file in config_files:
+  config = run_spec.load(config_file, sys.argv, file_time)   # read only, callsign from the file name for output/csv
+  shared=(config.ut, config['settings'].getint('r12'), config['settings'].getfloat('freq'),
+          config['settings'].getint('nhops'), config['settings'].get('tx_grid'), config['settings'].getfloat('elev_start'),
+          config['settings'].getfloat('elev_stop'), config['3d_sidescatter'].getfloat('ray_inc'),
+          config.get('settings','raytracer',fallback='pylap'))
+  receivers.append({'callsign':config.callsign, 'config_file':config_file, 'config':config, 'shared':shared,
+                    'rx_grid':config['settings'].get('rx_grid'), 'tx':config['metadata'].get('tx')})
+
+if len(set(rx['shared'] for rx in receivers)) != 1:
+  print ("Receiver config files differ in tx_grid, ut, r12, freq, nhops, elevations, ray_inc or raytracer. Exiting")
+  sys.exit()
+
+config=receivers[0]['config']
+tracer=raytrace_backend.from_config(config)   # PyLap unless raytracer = analytic in [settings]
+UT=list(config.ut)                            # The parameters for PyLap
+R12=config['settings'].getint('r12')
+nhops=config['settings'].getint('nhops')          # This will be one for two hop sidescatter.
+tx_grid=config['settings'].get('tx_grid')
+tx_name=receivers[0]['tx']
+
+####################################################
+# Derivations from user variables above
+elevs, freqs, array_of_bears = SS_trace.fan(config)   # as SS_sidescatter.py
+
+origin_lat,origin_long=mh.to_location(tx_grid, center=True)   # convert 6 char Maidenhead to centre of box lat long
+for rx in receivers:
+  rx['lat'],rx['lon']=mh.to_location(rx['rx_grid'], center=True)
+
+# Bounding box for the ionosphere covering the transmitter and every receiver
+box=SS_trace.bounding_box([origin_lat]+[rx['lat'] for rx in receivers], [origin_long]+[rx['lon'] for rx in receivers])
+lat_edges, lon_edges = SS_trace.box_edges(box)
+
+print("Batch of ",len(receivers)," receivers for tx ",tx_name)
+print("lat_start,num_lat,lon_start,num_lon: ", box['lat_start'],box['num_lat'],box['lon_start'],box['num_lon'])
+
+# ###########################################################################
+# Ionospheric and geomagnetic grids, once for all receivers
+print('Generating ionospheric and geomag grids... ')
+stage_metrics.mark(None)         # the grid and trace calls are the iono and raytrace stages, so stage times add up to the total
+tic = time.time()
+grids = SS_trace.gen_grids(tracer, UT, R12, box)
+print("Grids generated in ", round(time.time()-tic,1), " s")
+
+#####################################################
+# Transmitter fan, traced once and saved for reuse
+tx_dir=os.path.join(base_directory,'output','csv','SS',tx_name)
+if not os.path.exists(tx_dir):
+  os.makedirs(tx_dir)
+
+tic = time.time()
+tx_spots=SS_trace.trace_fan(tracer, grids, origin_lat, origin_long, elevs, freqs, array_of_bears, nhops, 0)
+print("tx fan: ", len(tx_spots), " landing spots in ", round(time.time()-tic,1), " s")
+with stage_metrics.stage('write'):
+  SS_landing.write_landings(tx_dir+'/'+file_time+'_tx_ground_coords.csv', tx_spots)
+
+#####################################################
+# Receiver fans, then tx-rx metrics from the landing spots
+summary=[]
+for rx in receivers:
+  tic = time.time()
+  rx_spots=SS_trace.trace_fan(tracer, grids, rx['lat'], rx['lon'], elevs, freqs, array_of_bears, nhops, 1)
+  print(rx['callsign'], " fan: ", len(rx_spots), " landing spots in ", round(time.time()-tic,1), " s")
+  stage_metrics.mark('metrics')
+
+  output_dir=os.path.join(base_directory,'output','csv','SS',rx['callsign'])
+  if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+  coords=SS_landing.join_tables([tx_spots, rx_spots])
+  SS_landing.write_landings(output_dir+'/'+file_time+'_ground_coords.csv', coords)
+
+  FF_metric=SS_trace.FF_metric(coords, lat_edges, lon_edges)
+  np.savetxt(output_dir + '/' + file_time + '_FF_metric.csv', FF_metric, fmt="%d", delimiter=',')
+  i,j,lat_peak,lon_peak=SS_trace.metric_peak(FF_metric, lat_edges, lon_edges)   # centre of the 1˚ box with the highest metric
+  print(rx['callsign'], " max metric ", FF_metric[i,j], " at lat ", lat_peak, " lon ", lon_peak)
+  summary.append([rx['callsign'], rx['rx_grid'], FF_metric[i,j], lat_peak, lon_peak, len(rx_spots)])
+  stage_metrics.mark(None)
+
+stage_metrics.mark('write')
+with open(tx_dir+'/'+file_time+'_batch_metrics.csv', 'w', encoding='UTF8',) as out_file:
+  writer=csv.writer(out_file)
+  writer.writerow(["rx, rx_grid, max_metric, metric_max_lat, metric_max_lon, rx_landing_spots"])
+  writer.writerows(summary)
+stage_metrics.count('rows_written', len(summary))
+print("Batch sidescatter metrics written for ", len(receivers), " receivers, tx landing spots ", len(tx_spots))
@@ -7,6 +7,8 @@
 #   and a pseudo transmitter at the receiver generated as a csv file from SS_pathfinder.py
 #   Prototype HamSCI integrated version for GitHub  
 #   Three command line arguments: config file path and name, time in YYYYMMDDHHMM as for the SS_Pathfinder.py, and frame number for animation
+#   then optionally --ut YYYYMMDDHHMM as given to SS_sidescatter.py. The config file is only read, the metric peaks are
+#   written to the run record in ./output/runs next to the one from SS_sidescatter.py, see run_spec.py
 
 #   Nov-Dec 2025 Gwyn Griffiths
 
@@ -21,12 +23,12 @@ import shapely as shapely
 import numpy as np
 import sys
 import os
-import configparser
-import ast
 import maidenhead as mh            # locators to lat lon, hence distance and bearing
 from geographiclib.geodesic import Geodesic 
 from pathlib import Path
 from numpy import genfromtxt         # for csv file in. order is tx lat,tx lon,rx lat,rx lon
+import SS_coincidence                # KD-tree coincidence metric in km, module in this directory
+import run_spec                      # read only config and per run output records, module in this directory
 
 ################################
 # Functions
@@ -107,16 +109,16 @@ def find_subgrid_peak(grid):
 # Read in configuration from a *_config.ini  got from the first command line parameter
 #
 config_file = sys.argv[1]                  # filename from calling script is prefix_config.ini where prefix could be callsign   
-callsign=str(config_file.split('_')[0])    # extract callsign to use for subdirectory of output/csv csv, str to convery list item, here 1st, to string var
-callsign=callsign.split("/",2)[2]
+file_time=sys.argv[2]         # this is date time in form YYYYMMDDHHMM for prefix to csv file name
+frame_number=int(sys.argv[3]) # this is for file name to create animation
 
 # set up base directory, and the directory path for config file 
 base_directory='./'
 
-config = configparser.ConfigParser()
-config.read(config_file)           # the accompanying bash script will update this file for successive runs of this python script 
+config = run_spec.load(config_file, sys.argv, file_time)   # read only, UT from --ut if the bash script gives it
+callsign=config.callsign                   # callsign to use for subdirectory of output/csv
 
-UT=ast.literal_eval(config.get('settings','ut'))  # The parameters for PyLap, 'get' by itself returns text
+UT=list(config.ut)                         # The parameters for PyLap
 # This is on-plot time label year mon day  hh:mm, zero padded to two digits
 plot_time=str(UT[0])+'-'+str(UT[1]).zfill(2)+'-'+str(UT[2]).zfill(2)+'  '+str(UT[3]).zfill(2)+':'+str(UT[4]).zfill(2)
 
@@ -136,9 +138,6 @@ rx_lat,rx_lon = mh.to_location(rx_grid, center=True)
 print("tx lat lon: ", np.round(tx_lat,3), np.round(tx_lon,3)) 
 print("rx lat lon: ", np.round(rx_lat,3), np.round(rx_lon,3)) 
 
-file_time=sys.argv[2]         # this is date time in form YYYYMMDDHHMM for prefix to csv file name
-frame_number=int(sys.argv[3]) # this is for file name to create animation
-
 # Read in the ground landing coordinates 
 coords=genfromtxt('./output/csv/SS/' + callsign + '/' + file_time + '_ground_coords.csv', delimiter=',')
 
@@ -190,7 +189,7 @@ for i in range (0,n_paths-1):
 output_dir=os.path.join('./','output','plots','SS',callsign)
 if not os.path.exists(output_dir):
   os.makedirs(output_dir)
-plt.savefig(output_dir + "/sidescatter.png", dpi=600)
+plt.savefig(output_dir + "/" + file_time + "_sidescatter.png", dpi=600)
 
 plt.show()
 print("Ray landing spot map generated. Next, the likelihood metric contour map")
@@ -245,13 +244,28 @@ lon_peak=lon_start+result['y']-0.5      # start lon, adds index offset from para
 lat_peak=lat_start+result['x']-0.5      # start lon, adds index offset from parabolic fit and adjusts from top right to centre
 print("Max linear FF_metric found at lon ", round(lon_peak,2)," and lat ", round(lat_peak,2))
 
-# update the config file with the max metric  and location
-config.set('3d_sidescatter', 'max_metric', str(round(result['value'],2)))
-config.set('3d_sidescatter', 'metric_max_lon',str(round(lon_peak,2)))
-config.set('3d_sidescatter', 'metric_max_lat',str(round(lat_peak,2)))
-
-with open(config_file, 'w') as configfile:
-    config.write(configfile)
+# Optional KD-tree coincidence metric: kd_metric = pairs or kde in [3d_sidescatter], radius kd_radius_km (default 50 km),
+# evaluated on a kd_grid_step (default 0.1˚) lat lon grid, independent of box alignment, with a peak uncertainty in km
+kd_metric=config['3d_sidescatter'].get('kd_metric', fallback='none')
+if kd_metric in ('pairs','kde'):
+  kd_radius_km=config['3d_sidescatter'].getfloat('kd_radius_km', fallback=50.)
+  kd_grid_step=config['3d_sidescatter'].getfloat('kd_grid_step', fallback=0.1)
+  tx_spots=coords[coords[:,0] == 0]
+  rx_spots=coords[coords[:,0] == 1]
+  engine=SS_coincidence.CoincidenceEngine(tx_spots[:,6],tx_spots[:,7],rx_spots[:,6],rx_spots[:,7],
+                                          (tx_lat+rx_lat)/2,(tx_lon+rx_lon)/2)
+  kd_lats,kd_lons=np.meshgrid(np.arange(lat_start,lat_stop,kd_grid_step),np.arange(lon_start,lon_stop,kd_grid_step),indexing='ij')
+  kd_peak=engine.find_peak(kd_lats,kd_lons,engine.metric(kd_lats,kd_lons,kd_radius_km,kd_metric))
+  print("KD-tree ",kd_metric," metric peak ",round(kd_peak['value'],3)," at lat ",round(kd_peak['lat'],2)," lon ",
+        round(kd_peak['lon'],2)," +- ",round(kd_peak['sigma_km'],1)," km")
+
+# record the max metric and location for this run
+run_record={'max_metric':round(float(result['value']),2), 'metric_max_lon':round(float(lon_peak),2),
+            'metric_max_lat':round(float(lat_peak),2)}
+if kd_metric in ('pairs','kde'):
+  run_record.update({'kd_max_lat':round(float(kd_peak['lat']),3), 'kd_max_lon':round(float(kd_peak['lon']),3),
+                     'kd_sigma_km':round(float(kd_peak['sigma_km']),1)})
+run_spec.write_record(config, 'sidescatter_plot', run_record)
 
 FF_metric=np.transpose(FF_metric)  
 
@@ -269,6 +283,10 @@ plt.rcParams['figure.dpi'] = 600
 plt.plot(tx_lon, tx_lat,'ko',markersize=3,transform=ccrs.PlateCarree())
 plt.plot(rx_lon,rx_lat,'bo',markersize=3,transform=ccrs.PlateCarree())
 plt.plot(lon_peak,lat_peak,'go',markersize=6,transform=ccrs.PlateCarree())
+ss_record=run_spec.read_record(config, 'sidescatter')
+if config['3d_sidescatter'].getint('refine', fallback=0) and ss_record is not None and 'refined_max_lat' in ss_record:
+  # sub-degree hotspot from the fine re-trace in SS_sidescatter.py two stage mode
+  plt.plot(ss_record['refined_max_lon'],ss_record['refined_max_lat'],'g+',markersize=10,transform=ccrs.PlateCarree())
 plt.text(tx_lon+1, tx_lat+1, tx, fontsize=9, color='k')
 plt.text(rx_lon+1, rx_lat+1, rx, fontsize=9, color='b')
 
@@ -288,7 +306,7 @@ plt.colorbar(img, fraction=0.035, pad=0.03) # from https://stackoverflow.com/que
 
 #img.ax.tick_params(labelsize=10)
 
-plt.savefig(output_dir + "/" +  "2F_sidescatter_metric_{:03d}.png".format(frame_number), dpi=600)
+plt.savefig(output_dir + "/" + file_time + "_2F_sidescatter_metric_{:03d}.png".format(frame_number), dpi=600)
 
 plt.show()
 print("Metric contour map plotted for frame: ", frame_number)
@@ -0,0 +1,136 @@
+# Module for the 3D ray tracing shared by SS_sidescatter.py and SS_sidescatter_batch.py
+# The coarse ray fan read from the config file, the ionosphere bounding box around the stations, the ionospheric and
+# geomagnetic grids, the tracing of a fan (or of any set of rays) against those grids to a landing spot table, and the
+# FF metric, the product of the counts of tx and rx landing spots in each lat lon box, are defined here once so the
+# single pair and batch scripts trace and score rays the same way.
+#
+# Grids are held in a dict as returned by gen_grids, landing spot tables are those of SS_landing.py.
+
+import math
+import numpy as np
+
+import SS_landing                  # module in this directory, vectorised ray landing spot extraction
+import stage_metrics               # module in this directory, stage timing, counters and peak memory
+
+# Constants
+origin_ht = 0.0                    # altitude of the start point of rays
+doppler_flag = 1                   # interested in Doppler shift, but as of Dec 2025 PyLap Doppler has a bug
+OX_mode = 1                        # O mode rays only
+tol = [1e-7, 0.01, 25]             # ODE solver tolerance and min max stepsizes
+hop_deg = 32.0                     # 32˚ is 3600 km, max one hop distance, the margin of the grid around the stations
+max_grid_lat = 89.0                # keep the grid off the pole
+max_margin_lat = 80.0              # latitude cap for scaling the longitude margin, so cos stays sensible
+
+# Ionospheric grid heights, i.e. from within the D layer to 480 km, and the coarser geomagnetic grid
+ht_start = 80                      # start height for ionospheric grid (km)
+ht_inc = 2                         # height increment (km)
+num_ht = 201                       # number of heights (must be < 2000)
+B_ht_inc = 10                      # height increment of the geomagnetic grid (km)
+
+def fan(spec):
+  """
+  The coarse ray fan of a run: elevations at a hard coded 1˚ step from elev_start up to elev_stop, the frequency of
+  each ray, and bearings over the full 360˚ at ray_inc (3˚ in the config file is OK for an 8 GB memory machine).
+  Returns elevs, freqs, bears.
+  """
+  elevs = np.arange(spec['settings'].getfloat('elev_start'), spec['settings'].getfloat('elev_stop'), 1, dtype=float)
+  freqs = spec['settings'].getfloat('freq')*np.ones(len(elevs), dtype=float)
+  bears = np.arange(0, 360, spec['3d_sidescatter'].getfloat('ray_inc'))
+  return elevs, freqs, bears
+
+def bounding_box(lats, lons):
+  """
+  Ionosphere grid limits covering all the stations at lats, lons with one hop (hop_deg) to spare, as tight as possible
+  to minimise compute time. The top edge is kept off the pole and the longitude span to no more than the globe.
+  Returns a dict of lat_start, lat_stop, num_lat, lon_start, lon_stop and num_lon, in whole degrees.
+  """
+  margin_lat = min(np.max(lats)+hop_deg, max_margin_lat)
+  lon_margin = hop_deg/np.cos(np.deg2rad(margin_lat))     # degrees of longitude for 3600 km at the poleward edge
+  lat_start = int(np.min(lats)-hop_deg)
+  lat_stop = int(min(np.max(lats)+hop_deg, max_grid_lat))
+  lon_start = int(np.min(lons)-lon_margin)
+  lon_stop = int(np.max(lons)+lon_margin)
+  if lon_stop-lon_start >= 360:                           # no wider than the globe, centred on the stations
+    lon_start = int(np.round((np.min(lons)+np.max(lons))/2.0))-180
+    lon_stop = lon_start+359
+  return {'lat_start':lat_start, 'lat_stop':lat_stop, 'num_lat':lat_stop-lat_start+1,
+          'lon_start':lon_start, 'lon_stop':lon_stop, 'num_lon':lon_stop-lon_start+1}
+
+def grid_parms(box):
+  """
+  PyLap iono_grid_parms and geomag_grid_parms for the bounding box, 1˚ in lat and lon.
+  """
+  lat_inc = 1                      # this is standard in PyLap
+  lon_inc = 1
+  iono_grid_parms = [box['lat_start'], lat_inc, box['num_lat'], box['lon_start'], lon_inc, box['num_lon'],
+                     ht_start, ht_inc, num_ht]
+  B_num_ht = math.ceil(num_ht * ht_inc / B_ht_inc)
+  geomag_grid_parms = [box['lat_start'], 1.0, box['num_lat'], box['lon_start'], 1.0, box['num_lon'],   # 1˚ as well
+                       ht_start, B_ht_inc, B_num_ht]
+  return iono_grid_parms, geomag_grid_parms
+
+def gen_grids(tracer, UT, R12, box):
+  """
+  Ionospheric and geomagnetic grids over the bounding box at UT, and at UT+5 min for the Doppler.
+  Returns a dict of iono_en_grid, iono_en_grid_5 (electrons/cm^3), collision_freq, Bx, By, Bz and the grid parms.
+  """
+  iono_grid_parms, geomag_grid_parms = grid_parms(box)
+  print (UT, R12, iono_grid_parms, geomag_grid_parms)
+  [iono_pf_grid, iono_pf_grid_5, collision_freq, Bx, By, Bz] = \
+      tracer.gen_iono_grid_3d(UT, R12, iono_grid_parms, geomag_grid_parms, doppler_flag)
+  # convert plasma frequency grid to electron density in electrons/cm^3
+  return {'iono_en_grid':iono_pf_grid**2 / 80.6164e-6, 'iono_en_grid_5':iono_pf_grid_5**2 / 80.6164e-6,
+          'collision_freq':collision_freq, 'Bx':Bx, 'By':By, 'Bz':Bz,
+          'iono_grid_parms':iono_grid_parms, 'geomag_grid_parms':geomag_grid_parms}
+
+def trace_rays(tracer, grids, start_lat, start_lon, elevs, bears, freqs, nhops, flag, chunk=2000):
+  """
+  Trace any set of O mode rays, elevation, bearing and frequency each, from start_lat, start_lon in raytrace_3d calls
+  of at most chunk rays, to bound memory. Returns the landing table, source column flag, 0 tx and 1 receiver.
+  """
+  bears = np.broadcast_to(np.asarray(bears, dtype=float), np.shape(elevs))
+  freqs = np.broadcast_to(np.asarray(freqs, dtype=float), np.shape(elevs))
+  tables=[]
+  for c0 in range(0, len(elevs), chunk):
+    [ray_data_O, ray_O, ray_state_vec_O] = \
+        tracer.raytrace_3d(start_lat, start_lon, origin_ht, elevs[c0:c0+chunk], bears[c0:c0+chunk], freqs[c0:c0+chunk],
+                    OX_mode, nhops, tol, grids['iono_en_grid'], grids['iono_en_grid_5'],
+                    grids['collision_freq'], grids['iono_grid_parms'], grids['Bx'], grids['By'], grids['Bz'],
+                    grids['geomag_grid_parms'])
+    with stage_metrics.stage('landings'):
+      tables.append(SS_landing.extract_landings(ray_O, ray_data_O, bears[c0:c0+chunk], flag))
+  return SS_landing.join_tables(tables)
+
+def trace_fan(tracer, grids, start_lat, start_lon, elevs, freqs, bears, nhops, flag):
+  """
+  Trace the fan of every elevation at each bearing in turn from start_lat, start_lon. Returns the landing table.
+  """
+  tables=[]
+  for ray_bear in bears:
+    print("Generating ", len(elevs), " O-mode rays at bearing ", ray_bear)
+    tables.append(trace_rays(tracer, grids, start_lat, start_lon, elevs, ray_bear, freqs, nhops, flag))
+  return SS_landing.join_tables(tables)
+
+def box_edges(box, step=1):
+  """
+  Lat and lon edges of the metric boxes over the bounding box, step degrees on a side.
+  """
+  return np.arange(box['lat_start'], box['lat_stop']+1, step), np.arange(box['lon_start'], box['lon_stop']+1, step)
+
+def FF_metric(coords, lat_edges, lon_edges):
+  """
+  FF metric of a landing table holding both sources: the product of the counts of tx (source 0) and rx (source 1)
+  landing spots in each lat_edges by lon_edges box, as in SS_sidescatter_plot.py. Returns the (n_lat, n_lon) metric.
+  """
+  tx = coords[:,0] == 0
+  rx = coords[:,0] == 1
+  count_tx,_,_=np.histogram2d(coords[tx,6], coords[tx,7], bins=(lat_edges,lon_edges))
+  count_rx,_,_=np.histogram2d(coords[rx,6], coords[rx,7], bins=(lat_edges,lon_edges))
+  return count_tx*count_rx
+
+def metric_peak(metric, lat_edges, lon_edges):
+  """
+  Index and box centre of the maximum of the metric. Returns i, j, lat, lon.
+  """
+  i,j=np.unravel_index(np.argmax(metric), metric.shape)
+  return i, j, (lat_edges[i]+lat_edges[i+1])/2, (lon_edges[j]+lon_edges[j+1])/2
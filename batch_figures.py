@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# Batch Grape Doppler figures for many stations and days from a JSON manifest.
+#
+#   python3 batch_figures.py manifest.json [n_procs] [--force]
+#
+# Manifest:
+#   {
+#    "defaults": {"cfreqs": [20,15,10,5], "overlaySolarElevation": true, "overlayEclipse": false},
+#    "jobs": [
+#       {"station": "w2naf", "sDate": "2024-04-08", "eDate": "2024-04-09"},
+#       {"stations": ["w2naf","n8ga"], "sDate": "2024-03-01", "eDate": "2024-06-01", "daily": true}
+#    ]
+#   }
+# Job keys (any may go in defaults):
+#   station or stations     station directories under data/psws_grapeDRF
+#   sDate, eDate            YYYY-MM-DD[THH:MM]; with "daily": true the span is split into one figure per day
+#   cfreqs                  center frequencies in MHz, one panel each
+#   overlaySolarElevation, overlayEclipse, solar_lat, solar_lon
+#                           as GrapeDRF.plot_ax; solar_lat/lon default to the station metadata
+#   precision               IQ storage, see load_grape_iq.py
+#   output_dir              default output/batch/<station>
+#
+# Jobs sharing a station and time span are run in the same worker so the IQ is loaded and each
+# spectrogram computed once for all their figures. Groups are spread over a process pool.
+# A figure is skipped when its PNG is newer than the station data and was made from the same job
+# settings (kept in a .json next to the PNG); --force regenerates everything.
+
+import os
+import sys
+import json
+import datetime
+import multiprocessing
+
+import matplotlib as mpl
+mpl.use('Agg')
+from matplotlib import pyplot as plt
+
+import grapeDRF
+import load_metadata2
+
+letters = 'abcdefghijklmnopqrztuvwxyz'
+
+job_defaults = {'cfreqs':[20,15,10,5],'overlaySolarElevation':True,'overlayEclipse':False,
+                'solar_lat':None,'solar_lon':None,'precision':'complex128','output_dir':None}
+
+def parse_date(date_str):
+    return datetime.datetime.fromisoformat(date_str)
+
+def expand_manifest(manifest):
+    """
+    Turn a manifest into a flat list of single station, single figure jobs with all keys filled in.
+    """
+    defaults    = dict(job_defaults)
+    defaults.update(manifest.get('defaults',{}))
+
+    jobs        = []
+    for entry in manifest['jobs']:
+        spec        = dict(defaults)
+        spec.update(entry)
+        stations    = spec.pop('stations',None) or [spec.pop('station')]
+        spec.pop('station',None)
+        daily       = spec.pop('daily',False)
+
+        sDate       = parse_date(spec['sDate'])
+        eDate       = parse_date(spec['eDate'])
+        spans       = []
+        if daily:
+            day = sDate
+            while day < eDate:
+                spans.append((day,min(day+datetime.timedelta(days=1),eDate)))
+                day = day + datetime.timedelta(days=1)
+        else:
+            spans.append((sDate,eDate))
+
+        for station in stations:
+            for span_s, span_e in spans:
+                job             = dict(spec)
+                job['station']  = station
+                job['sDate']    = span_s.isoformat()
+                job['eDate']    = span_e.isoformat()
+                if job['output_dir'] is None:
+                    job['output_dir'] = os.path.join('output','batch',station)
+                job['png_fpath'] = os.path.join(job['output_dir'],png_fname(job))
+                jobs.append(job)
+    return jobs
+
+def png_fname(job):
+    png_    = []
+    png_.append(parse_date(job['sDate']).strftime('%Y%m%d.%H%M'))
+    png_.append(parse_date(job['eDate']).strftime('%Y%m%d.%H%M'))
+    png_.append(job['station'])
+    png_.append('WDgrape')
+    png_    = png_ + ['{!s}'.format(x) for x in job['cfreqs']]
+    return '_'.join(png_)+'.png'
+
+def data_mtime(data_dir):
+    """
+    Latest modification time of the station's channel directories and the hourly directories in them.
+    New digital RF files change the mtime of the directory they are written to.
+    """
+    mtime   = 0.
+    if not os.path.isdir(data_dir):
+        return mtime
+    for chan in os.scandir(data_dir):
+        if not chan.is_dir():
+            continue
+        mtime   = max(mtime,chan.stat().st_mtime)
+        for sub in os.scandir(chan.path):
+            if sub.is_dir():
+                mtime   = max(mtime,sub.stat().st_mtime)
+    return mtime
+
+def is_up_to_date(job):
+    png_fpath   = job['png_fpath']
+    json_fpath  = png_fpath+'.json'
+    if not (os.path.exists(png_fpath) and os.path.exists(json_fpath)):
+        return False
+    with open(json_fpath,'r') as fl:
+        if json.load(fl) != job:
+            return False
+    data_dir    = os.path.join('data','psws_grapeDRF',job['station'])
+    return os.path.getmtime(png_fpath) >= data_mtime(data_dir)
+
+def render_job(gDRF,job,station_lat=None,station_lon=None):
+    """
+    Draw one figure, one panel per center frequency, with the GrapeDRF object shared by its group.
+    station_lat, station_lon are used for the solar overlays when the job gives no solar_lat, solar_lon.
+    """
+    sDate   = gDRF.sDate
+    eDate   = gDRF.eDate
+    cfreqs  = job['cfreqs']
+
+    figd = {}
+    figd['solar_lat']               = station_lat if job['solar_lat'] is None else job['solar_lat']
+    figd['solar_lon']               = station_lon if job['solar_lon'] is None else job['solar_lon']
+    figd['overlaySolarElevation']   = job['overlaySolarElevation']
+    figd['overlayEclipse']          = job['overlayEclipse']
+    figd['xlim']                    = (sDate,eDate)
+    figd['raster']                  = True
+
+    nrows           = len(cfreqs)
+    fig             = plt.figure(figsize=(22,nrows*5))
+    letter_fdict    = {'size':32}
+    for ax_inx,cfreq in enumerate(cfreqs):
+        ax  = fig.add_subplot(nrows,1,ax_inx+1)
+        gDRF.plot_ax(cfreq,ax,**figd)
+        ax.set_title('({!s})'.format(letters[ax_inx]),loc='left',fontdict=letter_fdict)
+        ax.set_title('{!s} MHz Receiver'.format(cfreq))
+        ax.set_xlim(sDate,eDate)
+        if ax_inx != nrows-1:
+            ax.set_xlabel('')
+            ax.set_xticklabels([])
+
+    txt = []
+    txt.append(job['station'].upper())
+    txt.append(sDate.strftime('%d %b %Y'))
+    fontdict    = {'size':42,'weight':'bold'}
+    fig.text(0.5,1.,'\n'.join(txt),fontdict=fontdict,ha='center',va='bottom')
+
+    if not os.path.exists(job['output_dir']):
+        os.makedirs(job['output_dir'],exist_ok=True)
+    fig.tight_layout()
+    fig.savefig(job['png_fpath'],bbox_inches='tight')
+    plt.close(fig)
+    with open(job['png_fpath']+'.json','w') as fl:
+        json.dump(job,fl,indent=1)
+
+def run_group(args):
+    """
+    Run all jobs of one (station, sDate, eDate, precision) group in a worker process.
+    Returns a list of (png_fpath, status) with status 'done', 'skipped' or the error message.
+    """
+    jobs, force = args
+    status      = []
+    todo        = []
+    for job in jobs:
+        if not force and is_up_to_date(job):
+            status.append((job['png_fpath'],'skipped'))
+        else:
+            todo.append(job)
+    if len(todo) == 0:
+        return status
+
+    job0    = todo[0]
+    try:
+        sDate   = parse_date(job0['sDate'])
+        eDate   = parse_date(job0['eDate'])
+        gDRF    = grapeDRF.GrapeDRF(sDate,eDate,job0['station'],precision=job0['precision'])
+        station_lat = station_lon = None
+        if any(job['solar_lat'] is None or job['solar_lon'] is None for job in todo):
+            meta        = load_metadata2.load_grape_drf_metadata(gDRF.data_dir,'metadata')
+            station_lat = meta[7]
+            station_lon = meta[8]
+    except Exception as err:
+        return status + [(job['png_fpath'],'load failed: {!s}'.format(err)) for job in todo]
+
+    for job in todo:
+        try:
+            render_job(gDRF,job,station_lat,station_lon)
+            status.append((job['png_fpath'],'done'))
+        except Exception as err:
+            status.append((job['png_fpath'],'failed: {!s}'.format(err)))
+    return status
+
+def run_manifest(manifest,n_procs=None,force=False):
+    """
+    Run every figure in a manifest (dict, or path to a JSON file) over a pool of n_procs processes
+    (default: number of CPUs). Returns the (png_fpath, status) list.
+    """
+    if not isinstance(manifest,dict):
+        with open(manifest,'r') as fl:
+            manifest = json.load(fl)
+
+    groups  = {}
+    for job in expand_manifest(manifest):
+        key = (job['station'],job['sDate'],job['eDate'],job['precision'])
+        groups.setdefault(key,[]).append(job)
+    print('{!s} figures in {!s} station/time groups'.format(sum(len(x) for x in groups.values()),len(groups)))
+
+    tasks   = [(jobs,force) for jobs in groups.values()]
+    results = []
+    if n_procs == 1:
+        statuses    = map(run_group,tasks)
+    else:
+        pool        = multiprocessing.Pool(n_procs)
+        statuses    = pool.imap_unordered(run_group,tasks)
+    for status in statuses:
+        for png_fpath,stat in status:
+            print('{!s}: {!s}'.format(stat,png_fpath))
+        results.extend(status)
+    if n_procs != 1:
+        pool.close()
+        pool.join()
+    return results
+
+if __name__ == '__main__':
+    args    = [x for x in sys.argv[1:] if x != '--force']
+    force   = '--force' in sys.argv
+    if len(args) < 1:
+        print("Rerun with a manifest file, optionally the number of processes and --force")
+        sys.exit()
+
+    n_procs = int(args[1]) if len(args) > 1 else None
+    results = run_manifest(args[0],n_procs,force)
+    n_done  = sum(1 for x in results if x[1] == 'done')
+    n_skip  = sum(1 for x in results if x[1] == 'skipped')
+    print('{!s} made, {!s} up to date, {!s} failed'.format(n_done,n_skip,len(results)-n_done-n_skip))
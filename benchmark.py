@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# Benchmarks of the processing stages on synthetic Grape data, to see whether a change makes things faster or slower.
+#
+#   python3 benchmark.py [--stages load,stft,acf,inst_acf,inst_zoom,cwt,prophet,modes] [--scales 1h,1d,1w] [--freqs 1,9] [--repeat n]
+#   python3 benchmark.py --compare OLD NEW
+#
+# Stages, each run on the same code the scripts use:
+#   load        load_grape_iq.read_grape_drf_masked of all subchannels, as grapeDRF.load_grape_drf     samples/s
+#   stft        doppler_kernels.fft_spectrogram per subchannel, as grape_fft_spectrogram.py              samples/s
+#   acf         doppler_kernels.acf_doppler per minute and subchannel, as grape_acf_doppler_spread.py    samples/s
+#   inst_acf    doppler_kernels.sliding_acf_doppler, 10 s windows every 1 s, as grape_doppler_series.py          samples/s
+#   inst_zoom   doppler_kernels.zoom_fft_doppler, the same windows, as grape_doppler_series.py method=zoomfft    samples/s
+#   cwt         CWT peak search, local peak and interpolation per minute, as grape_fft_CWT_tracking_prophet.py  rows/s
+#   prophet     one step ahead Prophet prediction of the same script, at most prophet_fits per subchannel  rows/s
+#   modes       mode_heuristics.classify_modes on a synthetic pathfinder table, 5 minute steps           rows/s
+# Scales are the span of data, 1h, 1d or 1w, and freqs the number of subchannels (1 is 10 MHz, 9 the Grape set).
+#
+# The IQ comes from synth_grape_drf.py, built once per scale and number of subchannels under
+# output/benchmarks/fixtures and reused. Each case runs in its own python process so the peak RSS reported
+# (ru_maxrss) is that of the one case; the time is the best of --repeat runs (default 3) after one untimed warm-up
+# run, not counting the data set up.
+# Results are stored per commit in output/benchmarks/results/<commit>.json (<commit>-dirty with uncommitted
+# changes), and --compare prints the ratio of the times of two of those files.
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+
+import numpy as np
+
+bench_dir   = os.path.join('output','benchmarks')
+all_stages  = ['load','stft','acf','inst_acf','inst_zoom','cwt','prophet','modes']
+iq_stages   = ['load','stft','acf','inst_acf','inst_zoom','cwt','prophet']
+scale_days  = {'1h':1/24.,'1d':1.,'1w':7.}
+start_date  = '2024-04-08'
+prophet_fits = 20                  # Prophet fits take about a second each, so only this many per subchannel
+
+def fixture_freqs(n_freqs):
+    import synth_grape_drf
+    if n_freqs == 1:
+        return [10.]
+    return synth_grape_drf.grape_frequencies[:n_freqs]
+
+def fixture_dir(scale,n_freqs):
+    return os.path.join(bench_dir,'fixtures','{!s}_{!s}f'.format(scale,n_freqs))
+
+def make_fixture(scale,n_freqs):
+    """
+    Build the synthetic data set for a case unless it is already there.
+    """
+    import synth_grape_drf         # module in this directory, synthetic Grape Digital RF data
+    out_dir = fixture_dir(scale,n_freqs)
+    if os.path.exists(os.path.join(out_dir,'truth.npz')):
+        return out_dir
+    t0      = time.time()
+    synth_grape_drf.make_dataset(out_dir,start_date,scale_days[scale],freqs=fixture_freqs(n_freqs),seed=1)
+    print('Fixture {!s} built in {:.1f} s'.format(out_dir,time.time()-t0))
+    return out_dir
+
+def commit_id():
+    try:
+        head    = subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,check=True).stdout.strip()
+        dirty   = subprocess.run(['git','status','--porcelain','-uno'],capture_output=True,text=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return 'nogit'
+    return head + ('-dirty' if dirty else '')
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.      # kB on Linux
+
+def load_iq(data_dir):
+    import digital_rf as drf
+    import load_grape_iq
+    do          = drf.DigitalRFReader(data_dir)
+    s0, s1      = do.get_bounds('ch0')
+    fs          = int(do.get_properties('ch0')['samples_per_second'])
+    m_samples   = 60*fs
+    length      = int((s1-s0)//m_samples) - 1          # whole minutes, leaving the one lag sample of the ACF
+    n_samples   = length*m_samples + 1
+    iq, valid   = load_grape_iq.read_grape_drf_masked(do,'ch0',s0,n_samples,precision='complex64',max_samples=None)
+    if iq.ndim == 1:
+        iq  = iq[np.newaxis,:]
+    return do, s0, n_samples, iq, valid, m_samples, length
+
+def synthetic_pathfinder(scale,n_freqs,seed=1):
+    """
+    A pathfinder table of rays at every 5 minute step, 6 rays per step and frequency: hops, initial elevation,
+    virtual height, apogee, 2nd hop apogee. E and F, low and high rays in the proportions of a typical day.
+    """
+    rng     = np.random.default_rng(seed)
+    n_steps = int(scale_days[scale]*288)*n_freqs
+    n_rays  = 6
+    hops    = np.tile([1,1,1,2,2,2],n_steps)
+    apogee  = np.where(rng.random(n_steps*n_rays) < 0.3,rng.uniform(95,140,n_steps*n_rays),rng.uniform(180,350,n_steps*n_rays))
+    elev    = np.sort(rng.uniform(3,45,(n_steps,n_rays)),axis=1).ravel()
+    path_data       = np.zeros((n_steps*n_rays,9))
+    path_data[:,0]  = hops
+    path_data[:,1]  = elev
+    path_data[:,2]  = apogee*1.2
+    path_data[:,3]  = apogee
+    path_data[:,4]  = np.where(hops == 2,apogee,0)
+    time_str        = np.repeat(['step{:06d}'.format(i) for i in range(n_steps)],n_rays)
+    return path_data, time_str
+
+def run_case(stage,scale,n_freqs,repeat):
+    """
+    Time one stage. Returns a dict of seconds (best of repeat), items, unit, throughput and RSS in MB.
+    """
+    import load_grape_iq
+    import doppler_kernels
+    from scipy.fft import fftfreq, fftshift
+
+    if stage == 'modes':
+        import mode_heuristics
+        heuristics  = mode_heuristics.read_heuristics(os.path.join('config','heuristics.ini'))
+        path_data, time_str = synthetic_pathfinder(scale,n_freqs)
+        def work():
+            mode_heuristics.classify_modes(path_data,time_str,heuristics)
+        items, unit = len(time_str), 'rows/s'
+    else:
+        data_dir    = fixture_dir(scale,n_freqs)
+        do, s0, n_samples, iq, valid, m_samples, length = load_iq(data_dir)
+        n_sub       = iq.shape[0]
+        window_ok   = load_grape_iq.window_valid(valid,m_samples,n_windows=length)
+        x           = fftshift(fftfreq(m_samples,1/10.))
+        if stage == 'load':
+            del iq
+            def work():
+                load_grape_iq.read_grape_drf_masked(do,'ch0',s0,n_samples,precision='complex64',max_samples=None)
+            items, unit = n_samples*n_sub, 'samples/s'
+        elif stage == 'stft':
+            def work():
+                for i in range(n_sub):
+                    doppler_kernels.fft_spectrogram(iq[i],window_ok,m_samples,length,np.complex64)
+            items, unit = n_samples*n_sub, 'samples/s'
+        elif stage == 'acf':
+            acf_ok  = load_grape_iq.window_valid(valid,m_samples+1,m_samples,length)
+            def work():
+                for i in range(n_sub):
+                    for j in range(length):
+                        if acf_ok[j]:
+                            k   = j*m_samples
+                            doppler_kernels.acf_doppler(iq[i,k:k+m_samples+1],m_samples)
+            items, unit = n_samples*n_sub, 'samples/s'
+        elif stage in ('inst_acf','inst_zoom'):
+            kernel  = doppler_kernels.sliding_acf_doppler if stage == 'inst_acf' else doppler_kernels.zoom_fft_doppler
+            def work():
+                for i in range(n_sub):
+                    kernel(iq[i],valid,10,100,10)
+            items, unit = n_samples*n_sub, 'samples/s'
+        elif stage == 'cwt':
+            def work():
+                for i in range(n_sub):
+                    for j in range(length):
+                        k   = j*m_samples
+                        yf  = doppler_kernels.minute_spectrum(iq[i,k:k+m_samples].astype(np.complex128))
+                        if not np.all(np.isfinite(yf)):                     # gap, zero fill
+                            continue
+                        peaks   = doppler_kernels.cwt_peaks(yf,x,np.arange(2,4))
+                        i1      = doppler_kernels.findLocalPeak(peaks[0],1,yf)
+                        i2      = doppler_kernels.findLocalPeak(peaks[3],2,yf)
+                        doppler_kernels.freqInterpolate(i1,2,x,yf)
+                        doppler_kernels.freqInterpolate(i2,2,x,yf)
+            items, unit = length*n_sub, 'rows/s'
+        elif stage == 'prophet':
+            n_fits  = min(prophet_fits,length-10)
+            t_hours = np.arange(length)/60.
+            rng     = np.random.default_rng(0)
+            freq_1st = 0.1*np.sin(2*np.pi*t_hours/2) + 0.01*rng.standard_normal(length)
+            level   = np.full(length,60.)
+            def work():
+                for i in range(n_sub):
+                    for j in range(10,10+n_fits):
+                        training,median,count = doppler_kernels.trainingQc(freq_1st[j-10:j].copy(),level[j-10:j],50)
+                        doppler_kernels.prophet_predict(t_hours[j-10:j],training)
+            items, unit = n_fits*n_sub, 'rows/s'
+        else:
+            raise ValueError('unknown stage {!s}'.format(stage))
+
+    setup_rss   = peak_rss_mb()
+    work()                                            # warm-up, untimed: imports, FFT plans and first touch of the pages
+    times       = []
+    for r in range(repeat):
+        t0  = time.perf_counter()
+        work()
+        times.append(time.perf_counter()-t0)
+    seconds = min(times)
+    return {'seconds':seconds,'items':int(items),'unit':unit,'throughput':items/seconds if seconds > 0 else None,
+            'peak_rss_mb':round(peak_rss_mb(),1),'setup_rss_mb':round(setup_rss,1),'repeat':repeat}
+
+def case_name(stage,scale,n_freqs):
+    return '{!s}/{!s}/{!s}f'.format(stage,scale,n_freqs)
+
+def run_suite(stages,scales,freqs,repeat=3):
+    """
+    Run every stage, scale and number of subchannels, each case in a new process. Returns the results file name.
+    """
+    for scale in scales:
+        for n_freqs in freqs:
+            if any(stage in iq_stages for stage in stages):
+                make_fixture(scale,n_freqs)
+
+    commit      = commit_id()
+    results_dir = os.path.join(bench_dir,'results')
+    os.makedirs(results_dir,exist_ok=True)
+    fname       = os.path.join(results_dir,commit+'.json')
+    results     = {'commit':commit,'python':platform.python_version(),'numpy':np.__version__,
+                   'machine':platform.machine(),'node':platform.node(),'cases':{}}
+    if os.path.exists(fname):                         # add to or replace cases of an earlier run at this commit
+        with open(fname,'r') as in_file:
+            results['cases'] = json.load(in_file).get('cases',{})
+
+    for stage in stages:
+        for scale in scales:
+            for n_freqs in freqs:
+                name    = case_name(stage,scale,n_freqs)
+                proc    = subprocess.run([sys.executable,__file__,'--case',stage,scale,str(n_freqs),str(repeat)],
+                            capture_output=True,text=True,env=dict(os.environ,MPLBACKEND='Agg'))
+                if proc.returncode != 0:
+                    print('{:24s} failed: {!s}'.format(name,proc.stderr.strip().splitlines()[-1:]))
+                    results['cases'][name] = {'error':proc.stderr.strip()[-500:]}
+                    continue
+                case    = json.loads(proc.stdout.strip().splitlines()[-1])
+                results['cases'][name] = case
+                print('{:24s} {:10.3f} s {:14.4g} {:10s} peak RSS {:8.1f} MB'.format(
+                    name,case['seconds'],case['throughput'],case['unit'],case['peak_rss_mb']))
+                with open(fname,'w') as out_file:     # written after every case so an interrupted run keeps its results
+                    json.dump(results,out_file,indent=1,sort_keys=True)
+    print('Results in {!s}'.format(fname))
+    return fname
+
+def compare(old,new):
+    """
+    Print new/old time and RSS ratios for the cases in both results files, commit ids or file names.
+    """
+    def read(name):
+        if not os.path.exists(name):
+            name    = os.path.join(bench_dir,'results',name+'.json')
+        with open(name,'r') as in_file:
+            return json.load(in_file)
+    a, b    = read(old), read(new)
+    print('{:24s} {:>10s} {:>10s} {:>8s} {:>8s}'.format('case',a['commit'],b['commit'],'time','RSS'))
+    for name in sorted(set(a['cases']) & set(b['cases'])):
+        ca, cb  = a['cases'][name], b['cases'][name]
+        if 'error' in ca or 'error' in cb:
+            continue
+        ratio   = cb['seconds']/ca['seconds'] if ca['seconds'] > 0 else float('nan')
+        flag    = '  slower' if ratio > 1.1 else ('  faster' if ratio < 0.9 else '')
+        print('{:24s} {:10.3f} {:10.3f} {:8.2f} {:8.2f}{!s}'.format(name,ca['seconds'],cb['seconds'],ratio,
+            cb['peak_rss_mb']/ca['peak_rss_mb'],flag))
+
+def option(args,name,default):
+    if name in args:
+        value   = args[args.index(name)+1]
+        del args[args.index(name):args.index(name)+2]
+        return value
+    return default
+
+if __name__ == '__main__':
+    args    = sys.argv[1:]
+    if len(args) > 0 and args[0] == '--case':          # a single case, in the process started by run_suite
+        stage, scale, n_freqs, repeat = args[1], args[2], int(args[3]), int(args[4])
+        print(json.dumps(run_case(stage,scale,n_freqs,repeat)))
+        sys.exit()
+    if len(args) > 0 and args[0] == '--compare':
+        if len(args) < 3:
+            print("Rerun with --compare and two commit ids or results files")
+            sys.exit()
+        compare(args[1],args[2])
+        sys.exit()
+
+    stages  = option(args,'--stages',','.join(all_stages)).split(',')
+    scales  = option(args,'--scales','1h,1d,1w').split(',')
+    freqs   = [int(f) for f in option(args,'--freqs','1,9').split(',')]
+    repeat  = int(option(args,'--repeat','3'))
+    unknown = [s for s in stages if s not in all_stages] + [s for s in scales if s not in scale_days]
+    if len(unknown) > 0 or len(args) > 0:
+        print("Unknown stage, scale or argument {!s}, stages are {!s} and scales {!s}".format(
+            unknown+args,','.join(all_stages),','.join(scale_days)))
+        sys.exit()
+    run_suite(stages,scales,freqs,repeat)
@@ -0,0 +1,236 @@
+# Module with the per-minute processing of the G3ZIL Doppler scripts, so the scripts and benchmark.py run the same code
+#   fft_spectrogram         one minute FFT columns of grape_fft_spectrogram.py
+#   acf_doppler             zero and one lag autocorrelation estimates of grape_acf_doppler_spread.py
+#   cwt_peaks, findLocalPeak, freqInterpolate, trainingQc, prophet_predict
+#                           peak finding and one step ahead prediction of grape_fft_CWT_tracking_prophet.py
+#   sliding_acf_doppler, zoom_fft_doppler
+#                           instantaneous Doppler of sliding windows at any hop, e.g. 1 s, of grape_doppler_series.py
+#   write_doppler_series, read_doppler_series
+#                           the binary (.npz) files of those series
+# Gwyn Griffiths G3ZIL, functions taken unchanged from the scripts except where noted
+
+import numpy as np
+from scipy.fft import fft, fftshift
+
+import load_grape_iq              # this is a module in this directory to read IQ data across data gaps
+import stage_metrics              # this is a module in this directory for stage timing and counters
+
+Hann_factor=1.63                  # Energy correction factor # https://community.sw.siemens.com/s/article/window-correction-factors
+
+def fft_spectrogram(data, window_ok, m_samples, length, work_dtype=np.complex64):
+  """
+  Spectrogram as in grape_fft_spectrogram.py: one Hann windowed FFT of m_samples per column, zero frequency centred.
+  Columns whose window spans a data gap are nan. Returns zf of shape (m_samples, length), the first column nan
+  as it holds no data (it was the uninitialised start of the np.column_stack in the script).
+  """
+  from scipy import signal          # scipy.signal is slow to import and the ACF does not need it
+  window = signal.windows.hann(m_samples).astype(np.finfo(work_dtype).dtype)   # float32 window keeps complex64 FFTs
+  zf=np.full((m_samples, length), np.nan)     # preallocated rather than column_stack, which copied zf every minute
+  for j in range (0,length-1):
+    k=int(j*m_samples)
+    if window_ok[j]:
+      segment=load_grape_iq.iq_to_complex(data[k:k+m_samples],work_dtype)   # int16 pairs converted one window at a time
+      yt=fft(segment*window,norm="forward",overwrite_x=False)*Hann_factor     # do the FFT
+      zf[:,j+1]=fftshift(np.abs(yt))   # shift zero frequency to centre
+  stage_metrics.count('fft_windows',np.count_nonzero(window_ok[:length-1]))
+  return zf
+
+def acf_doppler(segment, m_samples, fs=10):
+  """
+  Doppler (Hz), spread (mHz) and S+N level (dB) of one window of m_samples+1 samples from the zero and one lag
+  autocorrelation, rounded as written to the grape_acf_doppler_spread.py csv file.
+  """
+  # Convert just this window (plus the one-lag sample) to complex128 so the ACF sums accumulate in double
+  # precision whatever the storage precision, at negligible cost for 601 samples
+  segment=load_grape_iq.iq_to_complex(segment,np.complex128)
+  R_T0=np.sum(segment[:m_samples]*np.conjugate(segment[:m_samples]))    # ACF function at zero lag
+  R_Ts=np.sum(segment[:m_samples]*np.conjugate(segment[1:m_samples+1])) # ACF function at one lag
+  real=np.real(segment[:m_samples])
+  freq=round(-(fs/(2*np.pi))*np.angle(R_Ts),5)     # round for csv file, 0.01 mHz resolution is OTT but useful for WW0WWV
+  level=np.std(real)+np.average(real)              # matches expected from 20*log10(65535) as 16 bit full scale
+                                                   # with very small freq shifts have to add 'DC' component
+  dB_level=round(20*np.log10(level),2)             # round for csv, 2 decimal places is sensible
+  spread=(1.414*fs/(2*np.pi))*np.sqrt(np.abs(np.log((R_T0/np.abs(R_Ts)))))*1000    # spread in milliHertz
+  spread=round(spread,0)                           # round for csv file, 1 mHz resolution is sensible
+  return freq, spread, dB_level
+
+# local peak search: takes array index of CWF identified peak, does local search n bins either side for a true peak, returns index
+def findLocalPeak (index, radius,level):
+  # This method finds if the true local peak is to one side or other of CWF peak, and if so returns its index
+  if index < 5 or index >594:
+     return index                     # This is special case at either end near -5 and +5 Hz where we cannot search. Should not happen
+  cwf_peak=level[index]
+  for i in range (index-radius,index+radius+1):
+     if level[i] > cwf_peak:
+       index=i
+       cwf_peak=level[i]
+  return index
+
+# Interpolate between frequency bins based on the weighted linear signal level at peak and either side
+def freqInterpolate (index, radius, x, level):
+  # This method interpolates in frequency space around true local peak returning an amplitude-weighted frequency
+  if index < 5 or index >594:
+     return x[index]                      # This is special case at either end near -5 and +5 Hz where we cannot search. Should not happen
+  sum=0
+  sum_weights=0
+  for i in range (index-radius,index+radius+1):
+      sum=sum+x[i]*10**(level[i]/20)      # Convert dB level to linear
+      sum_weights=sum_weights+10**(level[i]/20)
+  freq_interp=sum/sum_weights           # Interpolated peak frequency
+  return freq_interp
+
+# QC the frequency training set
+def trainingQc (freq,level,threshold):
+  # The frequency array may have outliers, especially if the level is under parameter: level_threshold dB.
+  # This function looks for levels under the threshold, replaces with NaN, finds the median, replaces NaNs with the median
+  # and returns a frequency array QC'd in this form
+  len_in=len(freq)
+  for n in range (0,len_in):
+      if level[n] <= threshold:
+         freq[n]=np.nan
+  raw_median=np.nanmedian(freq)
+  count=np.count_nonzero(np.isnan(freq))
+  if count < 8:
+      for n in range (0,len_in):
+        if np.isnan(freq[n]):
+          freq[n]=raw_median
+  median=np.median(freq)
+  return freq,median,count
+
+def minute_spectrum(data):
+  # dB spectrum of one minute of IQ as the tracking script does it, no window, zero frequency centred
+  yf=fftshift(fft(data,norm="forward",overwrite_x=False)*Hann_factor)     # do the FFT and fftshift moves 0 Hz to centre
+  return 20*np.log10(np.abs(yf))                                          # convert to dB
+
+def cwt_peaks(yf, x, widths):
+  """
+  Highest and second highest peaks of a dB spectrum yf found by scipy find_peaks_cwt with the given widths,
+  e.g. np.arange(2,4). Returns index_max_1st, freq_max_1st, level_max_1st, index_max_2nd, freq_max_2nd, level_max_2nd.
+  """
+  # https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.find_peaks_cwt.html
+  from scipy import signal
+  peakind = signal.find_peaks_cwt(yf, widths=widths)
+  # find the index at maximum level
+  max=np.argmax(yf[peakind])                                    # This is easy
+  index_max_1st=peakind[max]
+  freq_max_1st=x[index_max_1st]
+  level_max_1st=yf[index_max_1st]
+
+  level_max_2nd=-999
+  for k in peakind:
+    level=yf[k]
+    if level>level_max_2nd:
+      if level < level_max_1st:
+        level_max_2nd=level
+
+  index_max_2nd = [i for i, value in enumerate(yf) if abs(value - level_max_2nd) < 0.02]   # an enumerate approach for a neat, pythonic solution
+  index_max_2nd=index_max_2nd[0]                                                           # returns an array i.e. list kjust need 1st element
+  freq_max_2nd=x[index_max_2nd]
+  return index_max_1st, freq_max_1st, level_max_1st, index_max_2nd, freq_max_2nd, level_max_2nd
+
+def prophet_predict(time, training, minutes_ahead=3):
+  """
+  Facebook Prophet fitted to training against time (hours), predicting minutes_ahead past the last time.
+  Returns yhat, yhat_lower, yhat_upper.
+  """
+  from prophet import Prophet      # slow to import, so only when tracking
+  from pandas import DataFrame, to_datetime, Timedelta
+  df = DataFrame({'ds': time*3600*1e9, 'y': training})
+  df['ds']= to_datetime(df['ds'])
+  prediction_time=df['ds'].iloc[-1] + Timedelta(minutes=minutes_ahead)  # Prophet looks lagged, so three slots rather than one
+
+  model = Prophet()
+  model.fit(df)
+
+  future = DataFrame({'ds': to_datetime([prediction_time])})
+  forecast = model.predict(future)
+  return forecast['yhat'].iloc[-1], forecast['yhat_lower'].iloc[-1], forecast['yhat_upper'].iloc[-1]
+
+def sliding_acf_doppler(iq, valid, fs=10, window_samples=100, hop_samples=10):
+  """
+  Doppler (Hz), spread (mHz) and power (dB) of sliding windows of window_samples, one every hop_samples, from the zero
+  and one lag autocorrelation as acf_doppler (the phase difference of successive samples averaged over the window).
+  All windows are computed at once from running sums of the lag products, so the cost does not depend on the overlap.
+  Windows spanning a data gap are nan. Returns doppler, spread, power_db and the window centres in samples from the
+  start of iq, each of length n_windows.
+  """
+  x=load_grape_iq.iq_to_complex(iq,np.complex128)       # running sums accumulate in double precision
+  n_windows=max(0,(len(x)-window_samples-1)//hop_samples+1)   # one lag needs one sample beyond the window
+  starts=np.arange(n_windows)*hop_samples
+  stops=starts+window_samples
+  lag0=np.concatenate(([0.],np.cumsum(np.abs(x[:-1])**2)))            # running sums of x[k]x*[k] and x[k+1]x*[k]
+  lag1=np.concatenate(([0.],np.cumsum(x[1:]*np.conjugate(x[:-1]))))
+  R_T0=lag0[stops]-lag0[starts]
+  R_Ts=lag1[stops]-lag1[starts]
+  with np.errstate(divide='ignore', invalid='ignore'):   # all zero windows are gaps, set to nan below
+    doppler=(fs/(2*np.pi))*np.angle(R_Ts)
+    spread=(1.414*fs/(2*np.pi))*np.sqrt(np.abs(np.log(R_T0/np.abs(R_Ts))))*1000
+    power_db=10*np.log10(R_T0/window_samples)
+  window_ok=load_grape_iq.window_valid(valid,window_samples+1,hop_samples,n_windows)
+  for values in (doppler,spread,power_db):
+    values[~window_ok]=np.nan
+  stage_metrics.count('acf_windows',np.count_nonzero(window_ok))
+  return doppler, spread, power_db, starts+window_samples/2.
+
+def zoom_fft_doppler(iq, valid, fs=10, window_samples=100, hop_samples=10, f_span=2., n_bins=400, chunk_windows=8192):
+  """
+  Doppler (Hz) and peak power (dB) of sliding Hann windows of window_samples, one every hop_samples, as the peak of a
+  zoom FFT of n_bins over +-f_span Hz, refined by parabolic interpolation of the dB spectrum around the peak bin.
+  Finer than the FFT bin spacing of a short window, and picks the strongest mode where the ACF gives a power weighted
+  mean of all of them. Windows are transformed chunk_windows at a time. Windows spanning a data gap are nan.
+  Returns doppler, spread (all nan, for the same layout as sliding_acf_doppler), power_db and the window centres in
+  samples from the start of iq.
+  """
+  from scipy import signal
+  x=load_grape_iq.iq_to_complex(iq,np.complex64)
+  n_windows=max(0,(len(x)-window_samples)//hop_samples+1)
+  window=signal.windows.hann(window_samples).astype(np.float32)
+  zoom=signal.ZoomFFT(window_samples,[-f_span,f_span],m=n_bins,fs=fs,endpoint=True)
+  bins=np.linspace(-f_span,f_span,n_bins)
+  bin_width=bins[1]-bins[0]
+  windows=np.lib.stride_tricks.sliding_window_view(x,window_samples)[::hop_samples][:n_windows]
+  window_ok=load_grape_iq.window_valid(valid,window_samples,hop_samples,n_windows)
+
+  doppler=np.full(n_windows,np.nan)
+  power_db=np.full(n_windows,np.nan)
+  for c0 in range(0,n_windows,chunk_windows):
+    ok=window_ok[c0:c0+chunk_windows]
+    if not ok.any():
+      continue
+    rows=np.nonzero(ok)[0]+c0
+    level=20*np.log10(np.abs(zoom(windows[rows]*window,axis=-1))/window.sum()+1e-12)   # dB of the tone amplitude
+    peak=np.clip(np.argmax(level,axis=-1),1,n_bins-2)                  # parabola through the peak bin and its neighbours
+    l0,l1,l2=[np.take_along_axis(level,(peak+k)[:,None],axis=-1)[:,0] for k in (-1,0,1)]
+    curve=l0-2*l1+l2
+    with np.errstate(divide='ignore', invalid='ignore'):
+      offset=np.where(curve < 0, 0.5*(l0-l2)/curve, 0.)
+    doppler[rows]=bins[peak]+offset*bin_width
+    power_db[rows]=l1-0.25*(l0-l2)*offset
+  stage_metrics.count('fft_windows',np.count_nonzero(window_ok))
+  return doppler, np.full(n_windows,np.nan), power_db, np.arange(n_windows)*hop_samples+window_samples/2.
+
+def write_doppler_series(fname, t0, hop_s, window_s, method, freqs, doppler, spread, power_db, callsign='', grid=''):
+  """
+  Save Doppler series of one or more subchannels as an uncompressed .npz of float32 arrays of shape
+  (n_subchannels, n_windows): 4 bytes a value rather than about 20 for a csv line. Times are not stored per value,
+  window i is centred at t0 + i*hop_s seconds since the epoch.
+  """
+  np.savez(fname, t0=np.float64(t0), hop_s=np.float64(hop_s), window_s=np.float64(window_s), method=str(method),
+           freqs=np.asarray(freqs,dtype=np.float64), callsign=str(callsign), grid=str(grid),
+           doppler=np.atleast_2d(doppler).astype(np.float32), spread=np.atleast_2d(spread).astype(np.float32),
+           power_db=np.atleast_2d(power_db).astype(np.float32))
+  return fname
+
+def read_doppler_series(fname):
+  """
+  Read a file from write_doppler_series. Returns a dict of its arrays plus time, the window centres as
+  numpy datetime64[ms] (UTC).
+  """
+  with np.load(fname) as npz:
+    series={key:npz[key] for key in npz.files}
+  for key in ('method','callsign','grid'):
+    series[key]=str(series[key])
+  n_windows=series['doppler'].shape[-1]
+  t_ms=np.round((series['t0']+np.arange(n_windows)*series['hop_s'])*1000).astype(np.int64)
+  series['time']=t_ms.astype('datetime64[ms]')
+  return series
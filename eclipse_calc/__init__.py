@@ -1,8 +1,25 @@
-from .eclipse_calc import calculate_obscuration
-from .calcSun import calculate_solarAzEl
-from . import locator
-from . import maps
-from . import gen_lib
-from . import geopack
-from . import solarContext
-from . import rayTracePaths
+"""
+Eclipse, solar and map helpers. The submodules are imported on first use rather than with the package, so
+`from eclipse_calc import gen_lib` does not pull in astropy (eclipse_calc), cartopy (maps) or pandas.
+"""
+import importlib
+
+_submodules = ('eclipse_calc','calcSun','locator','maps','gen_lib','geopack','geodesy','solarContext','rayTracePaths',
+               'obscuration_grid')
+_functions  = {'calculate_obscuration':'eclipse_calc','calculate_solarAzEl':'calcSun'}
+
+__all__ = list(_functions) + [name for name in _submodules if name not in ('eclipse_calc','calcSun')]
+
+def __getattr__(name):
+    # Import a submodule, or the submodule holding a package level function, the first time it is asked for
+    if name in _functions:
+        value   = getattr(importlib.import_module('.'+_functions[name],__name__),name)
+    elif name in _submodules:
+        value   = importlib.import_module('.'+name,__name__)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__,name))
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
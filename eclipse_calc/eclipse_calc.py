@@ -7,7 +7,7 @@ from matplotlib import pyplot as plt
 #import astropy
 from astropy import units as u
 from astropy.time import Time
-from astropy.coordinates import EarthLocation, AltAz, get_body
+from astropy.coordinates import EarthLocation, AltAz, ITRS, get_body
 from astropy import constants
 
 def array(val):
@@ -171,6 +171,79 @@ def calculate_obscuration(date_time,lat=None,lon=None,height=0.,loc=None,return_
     else:
         return obs
 
+# Sun and Moon Earth-fixed positions by time, shared by every obscuration_at() call of the process.
+_ephemeris_cache = {}
+
+def ephemeris_itrs(date_times):
+    """
+    Geocentric ITRS (Earth-fixed) positions in km of the Sun and Moon at each time, as arrays of shape (N,3).
+    Positions are cached by time, and those not yet cached are computed in one astropy call.
+    """
+    date_times  = [np.datetime64(x,'us') for x in np.ravel(array(date_times))]
+    todo        = sorted(set(date_times) - set(_ephemeris_cache))
+    if todo:
+        time_t  = Time(np.array(todo))
+        frame   = ITRS(obstime=time_t)
+        sun     = get_body('sun',time_t).transform_to(frame).cartesian.xyz.to(u.km).value.T
+        moon    = get_body('moon',time_t).transform_to(frame).cartesian.xyz.to(u.km).value.T
+        for inx,date_time in enumerate(todo):
+            _ephemeris_cache[date_time] = (sun[inx],moon[inx])
+    sun_xyz     = np.array([_ephemeris_cache[x][0] for x in date_times]).reshape(-1,3)
+    moon_xyz    = np.array([_ephemeris_cache[x][1] for x in date_times]).reshape(-1,3)
+    return sun_xyz, moon_xyz
+
+def obscuration_at(date_times,lats,lons,heights_km=0.,min_solar_elev_deg=0):
+    """
+    Eclipse obscuration and solar zenith angle at many (time, location) pairs, element by element after numpy
+    broadcasting of the inputs. Unlike calculate_obscuration, which takes one time for a vector of locations,
+    every point may have its own time, e.g. the rows of a ray path table.
+
+    The ephemerides come from ephemeris_itrs() once per distinct time; the topocentric geometry is then plain
+    numpy (no refraction, as calculate_obscuration), so a day of 5 minute steps over any number of points costs
+    the astropy calls for 288 times.
+
+    date_times: datetime.datetime or numpy.datetime64 values
+    lats, lons: degrees +N / +E
+    heights_km: height above the WGS84 ellipsoid, km
+
+    returns: dict of arrays obsc, solar_elev_deg, solar_zenith_deg and sun_moon_sep_deg, with obsc 0
+             where the solar elevation is below min_solar_elev_deg.
+    """
+    date_times, lats, lons, heights_km = np.broadcast_arrays(np.asarray(date_times,dtype='datetime64[us]'),
+            np.asarray(lats,dtype=float),np.asarray(lons,dtype=float),np.asarray(heights_km,dtype=float))
+    shape       = lats.shape
+    times, t_inx = np.unique(date_times.ravel(),return_inverse=True)
+    sun_xyz, moon_xyz = ephemeris_itrs(times)
+    sun_xyz, moon_xyz = sun_xyz[t_inx], moon_xyz[t_inx]
+
+    # Observer position on the WGS84 ellipsoid and local vertical, Earth-fixed.
+    a_km        = 6378.137
+    f           = 1/298.257223563
+    e2          = f*(2-f)
+    lat_r       = np.deg2rad(lats.ravel())
+    lon_r       = np.deg2rad(lons.ravel())
+    up          = np.stack((np.cos(lat_r)*np.cos(lon_r),np.cos(lat_r)*np.sin(lon_r),np.sin(lat_r)),axis=-1)
+    N           = a_km/np.sqrt(1-e2*np.sin(lat_r)**2)
+    h_km        = heights_km.ravel()
+    obs_xyz     = np.stack(((N+h_km)*up[:,0],(N+h_km)*up[:,1],(N*(1-e2)+h_km)*up[:,2]),axis=-1)
+
+    to_sun      = sun_xyz - obs_xyz
+    to_moon     = moon_xyz - obs_xyz
+    d_sun       = np.linalg.norm(to_sun,axis=-1)
+    d_moon      = np.linalg.norm(to_moon,axis=-1)
+    cos_sep     = np.sum(to_sun*to_moon,axis=-1)/(d_sun*d_moon)
+    sep_deg     = np.rad2deg(np.arccos(np.clip(cos_sep,-1,1)))
+    solar_elev  = np.rad2deg(np.arcsin(np.clip(np.sum(to_sun*up,axis=-1)/d_sun,-1,1)))
+
+    r_sun_deg   = np.rad2deg(constants.R_sun.to(u.km).value/d_sun)
+    r_moon_deg  = np.rad2deg(1737.1/d_moon)
+    A           = area_intersect(r_sun_deg,r_moon_deg,sep_deg)
+    obs         = A/(np.pi*r_sun_deg**2)
+    obs[solar_elev < min_solar_elev_deg] = 0
+
+    return {'obsc':obs.reshape(shape),'solar_elev_deg':solar_elev.reshape(shape),
+            'solar_zenith_deg':90.-solar_elev.reshape(shape),'sun_moon_sep_deg':sep_deg.reshape(shape)}
+
 if __name__ == '__main__':
     # UACNJ Jenny Jump - Hope, NJ
     # http://xjubier.free.fr/en/site_pages/solar_eclipses/TSE_2017_GoogleMapFull.html?Lat=40.90743&Lng=-74.92505&Elv=-1.0&Zoom=4&LC=1
@@ -1,4 +1,5 @@
 import shutil,os
+import collections
 
 def make_dir(path,clear=False,php=False):
     prep_output({0:path},clear=clear,php=php)
@@ -41,3 +42,42 @@ def prep_output(output_dirs={0:'output'},clear=False,width_100=False,img_extra='
                 file_obj.write(show_all_txt)
             with open(os.path.join(value,'0000-show_all_breaks.php'),'w') as file_obj:
                 file_obj.write(show_all_txt_breaks)
+
+class LRUCache(object):
+    def __init__(self,maxsize=8):
+        """
+        Small least-recently-used cache for expensive intermediate results.
+
+        maxsize: maximum number of entries held. Adding beyond this drops the entry used longest ago,
+                 so memory is bounded by maxsize times the size of the largest entry.
+        """
+        self.maxsize    = maxsize
+        self.data       = collections.OrderedDict()
+        self.hits       = 0
+        self.misses     = 0
+
+    def get(self,key,compute):
+        """
+        Return the value cached under key. On a miss, call compute() and cache its result.
+        key must be hashable.
+        """
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits  += 1
+            return self.data[key]
+
+        self.misses    += 1
+        value           = compute()
+        self.data[key]  = value
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.data.clear()
+
+    def __contains__(self,key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
@@ -1,12 +1,33 @@
+"""
+Maidenhead locator (grid square) conversions on numpy arrays. Locators are handled as arrays of ASCII codes,
+one row per locator, and decoded and encoded with lookup tables indexed by character code, so there is no
+Python loop over locators and millions of rows convert in a fraction of a second.
+"""
 import string
 import numpy as np
-import pandas as pd
 
 # Create string lookup lists for each of the codes.
 alpha_upper = np.char.array([x for x in string.ascii_uppercase])
 alpha_lower = np.char.array([x for x in string.ascii_lowercase])
 nr_str      = np.char.array(['{!s}'.format(x) for x in range(10)])
 
+# Lookup tables indexed by ASCII code: the value of a character in a locator (-1 if none), and whether it is a letter
+# or a digit. Letters are case insensitive.
+char_value  = np.full(256,-1,dtype=np.int16)
+char_value[np.frombuffer(string.ascii_uppercase.encode(),dtype=np.uint8)] = np.arange(26)
+char_value[np.frombuffer(string.ascii_lowercase.encode(),dtype=np.uint8)] = np.arange(26)
+char_value[np.frombuffer(string.digits.encode(),dtype=np.uint8)]          = np.arange(10)
+char_alpha  = np.zeros(256,dtype=bool)
+char_alpha[np.frombuffer(string.ascii_letters.encode(),dtype=np.uint8)]   = True
+char_digit  = np.zeros(256,dtype=bool)
+char_digit[np.frombuffer(string.digits.encode(),dtype=np.uint8)]          = True
+
+# Characters written for each code index, by pair: field (base 18) upper case, then alternately digits (base 10)
+# and subsquare letters (base 24) lower case.
+field_chars = np.frombuffer(string.ascii_uppercase[:18].encode(),dtype=np.uint8)
+digit_chars = np.frombuffer(string.digits.encode(),dtype=np.uint8)
+sub_chars   = np.frombuffer(string.ascii_lowercase[:24].encode(),dtype=np.uint8)
+
 def inx_alpha(inx):
     """
     Determine if a string position should be alpha in
@@ -20,34 +41,62 @@ def inx_alpha(inx):
     alpha   = not bool((inx/2) % 2)
     return alpha
 
-def __grid_valid(grid):
+def pair_base(pair):
     """
-    Determine if a gridsquare is valid.
+    Base of the character pair at pair index (0 for the first two characters): 18, then 10 and 24 alternately.
     """
-    try:
-        gs_len      = len(grid)
-    except:
-        return False
-
-    # Test length not zero...
-    if gs_len == 0:
-        return False
-
-    # Make sure an even number
-    if gs_len % 2:
-        return False
+    if pair == 0:
+        return 18
+    return 10 if pair % 2 else 24
 
-    # Check that alphas and numerics are in the right places.
-    for inx,char in enumerate(grid):
-        should_be_alpha = inx_alpha(inx)
-        valid   = not should_be_alpha ^ char.isalpha()
-        if not valid:
-            return False
-
-    # If you pass all of the tests, return True!
-    return True
+def grid_codes(gridsquare):
+    """
+    Locators as a (N, width) uint8 array of ASCII codes (0 past the end of shorter ones, 255 for
+    non-ASCII characters) and their lengths. Accepts a string, sequence or numpy array of str or
+    bytes of any shape; it is flattened. Non-string items are taken as ''.
+    """
+    gs  = np.asarray(gridsquare)
+    if gs.dtype.kind not in 'US':
+        gs  = np.array([x if isinstance(x,(str,bytes)) else '' for x in gs.ravel()],dtype=str)
+    gs      = np.ascontiguousarray(gs.ravel())
+    if gs.size == 0 or gs.dtype.itemsize == 0:
+        return np.zeros((gs.size,0),dtype=np.uint8), np.zeros(gs.size,dtype=int)
+
+    # A str array is UCS4, so its characters are read directly as 32 bit codes without encoding.
+    char_type   = np.uint32 if gs.dtype.kind == 'U' else np.uint8
+    raw         = gs.view(char_type).reshape(gs.size,-1)
+    lengths     = np.count_nonzero(raw,axis=1)
+    codes       = np.minimum(raw,255).astype(np.uint8)
+    return codes, lengths
+
+def codes_valid(codes,lengths,check_range=False):
+    # Letters and digits in the right places, even and non-zero length, and with check_range each character
+    # within its base (field A-R, subsquare a-x).
+    valid   = (lengths > 0) & (lengths % 2 == 0)
+    for pos in range(codes.shape[1]):
+        inside  = lengths > pos
+        chars   = codes[:,pos]
+        if inx_alpha(pos):
+            ok  = char_alpha[chars]
+        else:
+            ok  = char_digit[chars]
+        if check_range:
+            ok &= char_value[chars] < pair_base(pos//2)
+        valid  &= ~inside | ok
+    return valid
 
-grid_valid  = np.vectorize(__grid_valid)
+def grid_valid(grid,check_range=False):
+    """
+    Determine if gridsquares are valid: an even, non-zero number of characters with
+    letters and digits in the right places. With check_range, also that every
+    character is within its base, e.g. the field letters A to R.
+    Works on a single gridsquare or an array of them, returning the same shape.
+    """
+    codes, lengths = grid_codes(grid)
+    valid   = codes_valid(codes,lengths,check_range).reshape(np.shape(grid))
+    if valid.shape == ():
+        return bool(valid)
+    return valid
 
 def latlon2gridsquare(lat,lon,precision=6):
     """
@@ -58,10 +107,12 @@ def latlon2gridsquare(lat,lon,precision=6):
     and must be an even number. 4 is often used in HF communications,
     and 6 is standard for VHF/UHF. Any two locations within the same 
     6-character grid square are no more than 12 km apart.
+
+    Returns a numpy str array of the shape of lat, with '' where lat or lon is not finite.
     """
     #### Make sure input is numpy array with all finite values.
-    lats_0  = np.array(lat)
-    lons_0  = np.array(lon)
+    lats_0  = np.array(lat,dtype=float)
+    lons_0  = np.array(lon,dtype=float)
 
     lats_1  = lats_0.flatten()
     lons_1  = lons_0.flatten()
@@ -77,41 +128,24 @@ def latlon2gridsquare(lat,lon,precision=6):
 
     # Define zLats that start at 0 at the south pole
     # Define zLons that start at 0 at the antimeridian of Greenwich
-    zLats = lats +  90.
-    zLons = lons + 180.
-
-
-    # Calculate the field (a.k.a. first 2 letters)
-    base = 18.
-    container_size_lat = 180.
-    container_size_lon = 360.
-    subdivide_size_lat = container_size_lat / base
-    subdivide_size_lon = container_size_lon / base
-
-    zLats_rem        = zLats % container_size_lat
-    zLons_rem        = zLons % container_size_lon
-
-    lat_code_inx     = np.array(np.floor(zLats_rem / subdivide_size_lat),dtype=int)
-    lon_code_inx     = np.array(np.floor(zLons_rem / subdivide_size_lon),dtype=int)
-
-    lon_code  = alpha_upper[lon_code_inx]
-    lat_code  = alpha_upper[lat_code_inx]
-    this_code = lon_code + lat_code
-
-    grid_square = this_code
-    curr_prec   = 2
-
-    # Square, subsquare, extended square, and beyond...
-    while curr_prec < precision:
-        # Determine if we use base 10 numerics for base 24 alpha
-        # for this portion of the code.
-        alpha        = not bool((curr_prec/2) % 2)
-        if alpha:
-            base     = 24
-            str_code = alpha_lower
+    zLats_rem   = lats +  90.
+    zLons_rem   = lons + 180.
+
+    # Seed values for field calculation.
+    subdivide_size_lat = 180.
+    subdivide_size_lon = 360.
+
+    # Character codes of the gridsquares, one row each, filled a pair of columns at a time.
+    codes       = np.zeros((lats.size,precision),dtype=np.uint8)
+    for pair in range(precision//2):
+        # Field (a.k.a. first 2 letters), square, subsquare, extended square, and beyond...
+        base        = pair_base(pair)
+        if pair == 0:
+            str_code = field_chars
+        elif base == 24:
+            str_code = sub_chars
         else:
-            base     = 10.
-            str_code = nr_str
+            str_code = digit_chars
 
         container_size_lat     = subdivide_size_lat
         container_size_lon     = subdivide_size_lon
@@ -121,14 +155,13 @@ def latlon2gridsquare(lat,lon,precision=6):
         zLats_rem        = zLats_rem % container_size_lat
         zLons_rem        = zLons_rem % container_size_lon
 
-        lat_code_inx     = np.array(np.floor(zLats_rem / subdivide_size_lat),dtype=int)
-        lon_code_inx     = np.array(np.floor(zLons_rem / subdivide_size_lon),dtype=int)
+        lat_code_inx     = np.floor(zLats_rem / subdivide_size_lat).astype(int)
+        lon_code_inx     = np.floor(zLons_rem / subdivide_size_lon).astype(int)
 
-        lon_code    = str_code[lon_code_inx]
-        lat_code    = str_code[lat_code_inx]
-        this_code   = lon_code + lat_code
-        grid_square = grid_square + this_code
-        curr_prec  += 2
+        codes[:,2*pair]   = str_code[lon_code_inx]
+        codes[:,2*pair+1] = str_code[lat_code_inx]
+
+    grid_square = codes.view('S{:d}'.format(precision)).ravel().astype('U{:d}'.format(precision))
 
     # Build return array that puts NaNs back in place.
     ret_arr                     = np.zeros([lats_1.size],dtype=grid_square.dtype)
@@ -142,6 +175,9 @@ def gridsquare2latlon(gridsquare,position='center'):
     Calculates lat,lon pairs from gridsquares.
     This routine is vectorized.
 
+    Gridsquares may be of mixed precision, each giving the position in its own
+    cell. Empty or invalid gridsquares give NaN.
+
     position options:
         'center'
         'lower left'
@@ -149,69 +185,33 @@ def gridsquare2latlon(gridsquare,position='center'):
         'upper right'
         'lower right'
     """    
-    # Don't process lines that have no grid square.
-    gs_0        = np.array(gridsquare)
-    gs_1        = gs_0.flatten()
-    gs_good_tf  = gs_1 != ''
-    # gs_2        = gs_1[gs_good_tf]
-    gs_2 = list(filter(lambda x: x != '', gs_1))
-    
-    # Make everything lower case and put into a character array
-    # for easy slicing.
-    gss = np.char.array(gs_2).lower()
-
-    # Create string lookup lists for each of the codes.
-    alpha_pd = pd.Series(list(range(26)),index=alpha_lower)
-
-    # Make sure precision of array is uniform.
-    precs       = np.array([len(x) for x in gss.ravel()])
-    precision   = precs.max()
-    if np.unique(precs).size != 1:
-        # If a vector of gridsqaures is given without uniform precision,
-        # there should be a subroutine to pad the gridsquares with less
-        # to the center of the cell. e.g. FN20 --> FN20mm
-        raise Exception('All input grid squares must be of same precision.')
-
-    # Seed values for field calculation.
-    base               = 18.
-    container_size_lat = 180.
-    container_size_lon = 360.
-    
-    # Loop to do actual calculation
-    pos, zLat, zLon    = 0,0.,0.
-    while pos < precision:
-        # Get the 2 characters of the grid square we will work on.
-        codes               = [(x[pos],x[pos+1]) for x in gss]
-        lon_code, lat_code  = np.array(list(zip(*codes)))
-
-        # Convert code into an index number and choose a base.
-        alpha = not bool(pos/2 % 2)
-        
-        if alpha:
-            lon_inx = np.array(alpha_pd.loc[lon_code].tolist(),dtype=float)
-
-            lat_inx = np.array(alpha_pd.loc[lat_code].tolist(),dtype=float)
-            if pos != 0: base = 24.
-        else:
-            lon_inx = np.array(lon_code,dtype=float)
-            lat_inx = np.array(lat_code,dtype=float)
-
-            base = 10.
+    gs_0            = np.asarray(gridsquare)
+    codes, lengths  = grid_codes(gs_0)
+    gs_good_tf      = codes_valid(codes,lengths,check_range=True)
+
+    # Loop over character pairs, each adding its contribution to the gridsquares long enough to have it.
+    # zLat --> latitude, but south pole is 0 deg
+    # zLon --> longitude, but antimeridian of Greenwich is 0 deg
+    zLat                = np.zeros(lengths.size)
+    zLon                = np.zeros(lengths.size)
+    container_size_lat  = np.full(lengths.size,180.)
+    container_size_lon  = np.full(lengths.size,360.)
+    for pair in range(codes.shape[1]//2):
+        inside  = gs_good_tf & (lengths > 2*pair)
+        base    = pair_base(pair)
 
         # Determine resolution for this loop.
-        subdivide_size_lat = container_size_lat / base
-        subdivide_size_lon = container_size_lon / base
+        subdivide_size_lat = np.where(inside,container_size_lat / base,container_size_lat)
+        subdivide_size_lon = np.where(inside,container_size_lon / base,container_size_lon)
 
-        # Add contribution of this loop to zLat and zLon.
-        # zLat --> latitude, but south pole is 0 deg
-        # zLon --> longitude, but antimeridian of Greenwich is 0 deg
-        zLat += (subdivide_size_lat * lat_inx)
-        zLon += (subdivide_size_lon * lon_inx)
+        # Convert code into an index number and add the contribution of this loop.
+        lon_inx = np.where(inside,char_value[codes[:,2*pair]],0)
+        lat_inx = np.where(inside,char_value[codes[:,2*pair+1]],0)
+        zLat   += subdivide_size_lat * lat_inx
+        zLon   += subdivide_size_lon * lon_inx
 
-        # Interate to next to characters in the grid square.
         container_size_lat = subdivide_size_lat
         container_size_lon = subdivide_size_lon
-        pos += 2
 
     # Convert zLat,zLon to lat,lon.
     lat = zLat -  90.
@@ -233,17 +233,11 @@ def gridsquare2latlon(gridsquare,position='center'):
         lon += container_size_lon
     
     # Convert things back to include NaNs.
-    ret_lat     = np.ndarray([gs_1.size],dtype=float)
-    ret_lon     = np.ndarray([gs_1.size],dtype=float)
-
-    ret_lat[:]  = np.nan
-    ret_lon[:]  = np.nan
-
-    ret_lat[gs_good_tf] = lat
-    ret_lon[gs_good_tf] = lon
+    lat[~gs_good_tf]    = np.nan
+    lon[~gs_good_tf]    = np.nan
 
-    ret_lat     = ret_lat.reshape(gs_0.shape)
-    ret_lon     = ret_lon.reshape(gs_0.shape)
+    ret_lat     = lat.reshape(gs_0.shape)
+    ret_lon     = lon.reshape(gs_0.shape)
 
     return ret_lat,ret_lon
 
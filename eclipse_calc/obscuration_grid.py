@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Eclipse obscuration over a (time x height x lat x lon) grid, computed with calculate_obscuration in chunks of
+time steps spread over a process pool, and cached on disk so that maximum obscuration maps and eclipse tracks
+are derived from the one computation.
+
+    python3 -m eclipse_calc.obscuration_grid 2024-04-08T15:00 2024-04-08T21:00 --dt 2 --lat 10 60 --lon -130 -60
+            --res 0.5 --heights 0 300 [--workers n] [--csv output/eclipse]
+
+A cache is a directory output/eclipse_cache/<start time>_<key>, the key a hash of the grid parameters:
+    obsc.npy        float32 (n_times, n_heights, n_lats, n_lons), written as chunks complete
+    done.npy        bool (n_times,), time steps already computed, so an interrupted run carries on where it stopped
+    max_obsc.npy    float32 (n_heights, n_lats, n_lons), maximum over time
+    axes.npz        times (datetime64[s]), heights_km, lats and lons (grid cell centres)
+    meta.json       the grid parameters
+EclipseData memory-maps max_obsc.npy directly when given a cache directory in place of a MAX_OBSCURATION csv.
+"""
+import os
+import json
+import hashlib
+import datetime
+import argparse
+import multiprocessing
+
+import numpy as np
+
+cache_root = os.path.join('output','eclipse_cache')
+
+def grid_axes(sTime,eTime,dt_minutes,lat_lim,lon_lim,res_deg):
+    """
+    Time steps from sTime to eTime inclusive, and cell centre lats and lons from the limits at res_deg spacing.
+    """
+    n_times = int(round((eTime-sTime).total_seconds()/(60.*dt_minutes)))+1
+    times   = [sTime + datetime.timedelta(minutes=dt_minutes*inx) for inx in range(n_times)]
+    lats    = np.round(np.arange(lat_lim[0]+res_deg/2.,lat_lim[1],res_deg),6)
+    lons    = np.round(np.arange(lon_lim[0]+res_deg/2.,lon_lim[1],res_deg),6)
+    return times, lats, lons
+
+def cache_dir_for(params,cache_root=cache_root):
+    key = hashlib.sha256(json.dumps(params,sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(cache_root,'{!s}_{!s}'.format(params['sTime'].replace('-','').replace(':',''),key))
+
+def obscuration_chunk(args):
+    """
+    Obscuration for a chunk of time steps over every height and grid point, run in a pool worker.
+    Each calculate_obscuration call covers all grid points of one height at one time.
+    """
+    t_inxs, times, heights_km, lats, lons, min_solar_elev_deg = args
+    from astropy.coordinates import EarthLocation
+    from .eclipse_calc import calculate_obscuration
+
+    LATS, LONS  = np.meshgrid(lats,lons,indexing='ij')
+    locs        = [EarthLocation.from_geodetic(LONS.ravel(),LATS.ravel(),height*1e3) for height in heights_km]
+    out         = np.empty((len(times),len(heights_km))+LATS.shape,dtype=np.float32)
+    for t_inx,date_time in enumerate(times):
+        for h_inx,loc in enumerate(locs):
+            obsc    = calculate_obscuration(date_time,loc=loc,min_solar_elev_deg=min_solar_elev_deg)
+            out[t_inx,h_inx] = np.reshape(obsc,LATS.shape)
+    return t_inxs, out
+
+def generate(sTime,eTime,dt_minutes=5,lat_lim=(-90,90),lon_lim=(-180,180),res_deg=1.,heights_km=(0.,),
+        min_solar_elev_deg=0,n_workers=None,chunk_times=4,cache_root=cache_root):
+    """
+    Compute, or complete, the obscuration grid cache for an eclipse. Returns the cache directory.
+
+    sTime, eTime:       datetime.datetime span in UT
+    dt_minutes:         time step
+    lat_lim, lon_lim:   grid limits [deg], cells of res_deg on a side
+    heights_km:         heights above the ellipsoid
+    min_solar_elev_deg: as calculate_obscuration, obscuration is 0 where the sun is lower than this
+    n_workers:          pool processes, default number of CPUs, 1 to compute in this process
+    chunk_times:        time steps per pool task
+    """
+    times, lats, lons = grid_axes(sTime,eTime,dt_minutes,lat_lim,lon_lim,res_deg)
+    heights_km  = [float(x) for x in heights_km]
+    params      = {'sTime':sTime.isoformat(),'eTime':eTime.isoformat(),'dt_minutes':dt_minutes,
+                   'lat_lim':list(lat_lim),'lon_lim':list(lon_lim),'res_deg':res_deg,'heights_km':heights_km,
+                   'min_solar_elev_deg':min_solar_elev_deg}
+    cache_dir   = cache_dir_for(params,cache_root)
+    os.makedirs(cache_dir,exist_ok=True)
+
+    meta_fpath  = os.path.join(cache_dir,'meta.json')
+    if os.path.exists(meta_fpath):
+        with open(meta_fpath,'r') as fl:
+            if json.load(fl).get('complete'):
+                print('Obscuration grid cached in {!s}'.format(cache_dir))
+                return cache_dir
+
+    shape       = (len(times),len(heights_km),len(lats),len(lons))
+    obsc_fpath  = os.path.join(cache_dir,'obsc.npy')
+    done_fpath  = os.path.join(cache_dir,'done.npy')
+    if os.path.exists(obsc_fpath) and os.path.exists(done_fpath):
+        obsc    = np.load(obsc_fpath,mmap_mode='r+')
+        done    = np.load(done_fpath)
+    else:
+        obsc    = np.lib.format.open_memmap(obsc_fpath,mode='w+',dtype=np.float32,shape=shape)
+        obsc[:] = np.nan
+        done    = np.zeros(len(times),dtype=bool)
+    np.savez(os.path.join(cache_dir,'axes.npz'),times=np.array(times,dtype='datetime64[s]'),
+             heights_km=np.array(heights_km),lats=lats,lons=lons)
+
+    todo        = np.nonzero(~done)[0]
+    tasks       = [(t_inxs,[times[x] for x in t_inxs],heights_km,lats,lons,min_solar_elev_deg)
+                   for t_inxs in np.array_split(todo,max(1,int(np.ceil(len(todo)/chunk_times))))
+                   if len(t_inxs) > 0]
+    print('Obscuration grid {!s}: {!s} of {!s} time steps to compute'.format(shape,len(todo),len(times)))
+
+    if n_workers == 1:
+        results = map(obscuration_chunk,tasks)
+    else:
+        pool    = multiprocessing.Pool(n_workers)
+        results = pool.imap_unordered(obscuration_chunk,tasks)
+    for t_inxs,chunk in results:
+        obsc[t_inxs]    = chunk
+        done[t_inxs]    = True
+        obsc.flush()
+        np.save(done_fpath,done)
+        print('  {!s} of {!s} time steps'.format(np.count_nonzero(done),len(times)))
+    if n_workers != 1:
+        pool.close()
+        pool.join()
+
+    max_obsc    = np.zeros(shape[1:],dtype=np.float32)
+    for t_inx in range(len(times)):                   # one time step at a time, the grid need not fit in memory
+        np.fmax(max_obsc,obsc[t_inx],out=max_obsc)
+    np.save(os.path.join(cache_dir,'max_obsc.npy'),max_obsc)
+
+    params['complete'] = True
+    with open(meta_fpath,'w') as fl:
+        json.dump(params,fl,indent=1)
+    return cache_dir
+
+class ObscurationCache(object):
+    def __init__(self,cache_dir):
+        """
+        Read access to a completed obscuration grid cache. The arrays are memory-mapped, not read in.
+        """
+        with open(os.path.join(cache_dir,'meta.json'),'r') as fl:
+            self.meta   = json.load(fl)
+        axes            = np.load(os.path.join(cache_dir,'axes.npz'))
+        self.cache_dir  = cache_dir
+        self.times      = axes['times'].astype('datetime64[s]').astype(datetime.datetime)
+        self.heights_km = axes['heights_km']
+        self.lats       = axes['lats']
+        self.lons       = axes['lons']
+        self.obsc       = np.load(os.path.join(cache_dir,'obsc.npy'),mmap_mode='r')
+        self.max_obsc   = np.load(os.path.join(cache_dir,'max_obsc.npy'),mmap_mode='r')
+
+    def height_index(self,height_km=None):
+        # Index of the cached height nearest height_km, the first height if None
+        if height_km is None:
+            return 0
+        return int(np.argmin(np.abs(self.heights_km-height_km)))
+
+    def max_obscuration(self,height_km=None):
+        """
+        Maximum obscuration over the eclipse at each grid point, shape (n_lats, n_lons).
+        """
+        return self.max_obsc[self.height_index(height_km)]
+
+    def track(self,height_km=None,min_fraction=0.95):
+        """
+        Eclipse track: at each time step the grid point of greatest obscuration, kept where that obscuration
+        is at least min_fraction of the greatest anywhere during the eclipse (so the track of a total eclipse
+        covers the totality path). DataFrame indexed by date_ut with columns lat, lon and obsc, as read by
+        EclipseData from an ECLIPSE_TRACK csv.
+        """
+        import pandas as pd
+        h_inx       = self.height_index(height_km)
+        peak        = float(np.max(self.max_obsc[h_inx]))
+        rows        = []
+        for t_inx,date_time in enumerate(self.times):
+            frame   = self.obsc[t_inx,h_inx]
+            inx     = np.nanargmax(frame) if np.any(np.isfinite(frame)) else None
+            if inx is None or peak <= 0:
+                continue
+            i,j     = np.unravel_index(inx,frame.shape)
+            if frame[i,j] >= min_fraction*peak:
+                rows.append({'date_ut':date_time,'lat':self.lats[i],'lon':self.lons[j],'obsc':float(frame[i,j])})
+        df_track    = pd.DataFrame(rows,columns=['date_ut','lat','lon','obsc'])
+        return df_track.set_index('date_ut')
+
+    def write_csvs(self,output_dir,prefix='eclipse',height_km=None):
+        """
+        Write the MAX_OBSCURATION and ECLIPSE_TRACK csv files of one height in the layout EclipseData reads.
+        Returns the MAX_OBSCURATION file name.
+        """
+        import pandas as pd
+        h_inx       = self.height_index(height_km)
+        height      = self.heights_km[h_inx]
+        os.makedirs(output_dir,exist_ok=True)
+        base        = os.path.join(output_dir,'{!s}_{!s}_{:g}km.csv'.format(prefix,'{!s}',height))
+        LATS, LONS  = np.meshgrid(self.lats,self.lons,indexing='ij')
+        df          = pd.DataFrame({'lat':LATS.ravel(),'lon':LONS.ravel(),'height':height,
+                                    'obsc':np.asarray(self.max_obsc[h_inx]).ravel()})
+        comment     = '# Generated by eclipse_calc.obscuration_grid from {!s}\n'.format(self.cache_dir)
+        max_fpath   = base.format('MAX_OBSCURATION')
+        with open(max_fpath,'w') as fl:
+            fl.write(comment)
+            df.to_csv(fl,index=False)
+        with open(base.format('ECLIPSE_TRACK'),'w') as fl:
+            fl.write(comment)
+            self.track(height).to_csv(fl)
+        return max_fpath
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Compute and cache an eclipse obscuration grid.')
+    parser.add_argument('sTime',type=datetime.datetime.fromisoformat,help='start, UT, e.g. 2024-04-08T15:00')
+    parser.add_argument('eTime',type=datetime.datetime.fromisoformat,help='end, UT')
+    parser.add_argument('--dt',type=float,default=5,help='time step in minutes')
+    parser.add_argument('--lat',type=float,nargs=2,default=(-90,90),help='latitude limits')
+    parser.add_argument('--lon',type=float,nargs=2,default=(-180,180),help='longitude limits')
+    parser.add_argument('--res',type=float,default=1.,help='grid spacing in degrees')
+    parser.add_argument('--heights',type=float,nargs='+',default=[0.],help='heights in km')
+    parser.add_argument('--min_solar_elev',type=float,default=0,help='obscuration is 0 with the sun below this')
+    parser.add_argument('--workers',type=int,default=None,help='pool processes, default number of CPUs')
+    parser.add_argument('--csv',default=None,help='also write MAX_OBSCURATION and ECLIPSE_TRACK csvs here')
+    args    = parser.parse_args()
+
+    cache_dir   = generate(args.sTime,args.eTime,args.dt,args.lat,args.lon,args.res,args.heights,
+                           args.min_solar_elev,args.workers)
+    if args.csv is not None:
+        cache   = ObscurationCache(cache_dir)
+        for height in cache.heights_km:
+            print('Wrote {!s}'.format(cache.write_csvs(args.csv,height_km=height)))
@@ -1,9 +1,7 @@
 import pandas as pd
 
-# Geographiclib - https://geographiclib.sourceforge.io/Python/2.0/
-# conda install conda-forge::geographiclib
-from geographiclib.geodesic import Geodesic
-geod = Geodesic.WGS84
+# Batch WGS84 geodesics, agreeing with geographiclib - https://geographiclib.sourceforge.io/Python/2.0/
+from . import geodesy
 
 class RayTracePaths(object):
     def __init__(self,path_dcts):
@@ -27,63 +25,46 @@ class RayTracePaths(object):
         
     def __compute_rangeAzms__(self):
         """
-        Use geographic lib to calcuate the ranges [km] and azimuths [deg clockwise from North]
-        of paths dataframe.
+        Calculate the ranges [km] and azimuths [deg clockwise from North] from the transmitter to the
+        receiver and end points of all paths in one batch geodesic call per end point type.
         """
-        paths_df = self.df
-        
-        new_rows = []
-        for rinx,row in paths_df.iterrows():
-            tx_lat = row['tx_lat']
-            tx_lon = row['tx_lon']
-            endPts = ['rx','end']
-            for endPt in endPts:
-                end_lat = row.get(endPt+'_lat')
-                end_lon = row.get(endPt+'_lon')
-                if end_lat is not None:
-                    # Determine the ranges and azimuth along the profile path.
-                    invl    = geod.InverseLine(tx_lat,tx_lon,end_lat,end_lon)
-                    dist    = invl.s13*1e-3   # Distance in km
-                    azm     = invl.azi1
-    
-                    row['tx_{!s}_range_km'.format(endPt)] = dist
-                    row['tx_{!s}_azm'.format(endPt)]      = azm
-            new_rows.append(row)
-    
-        new_paths_df = pd.DataFrame(new_rows)
-        self.df = new_paths_df
+        paths_df = self.df.copy()
+
+        endPts = ['rx','end']
+        for endPt in endPts:
+            if endPt+'_lat' not in paths_df:
+                continue
+            dist, azm, _ = geodesy.inverse(paths_df['tx_lat'].to_numpy(dtype=float),
+                                           paths_df['tx_lon'].to_numpy(dtype=float),
+                                           paths_df[endPt+'_lat'].to_numpy(dtype=float),
+                                           paths_df[endPt+'_lon'].to_numpy(dtype=float))
+            paths_df['tx_{!s}_range_km'.format(endPt)] = dist
+            paths_df['tx_{!s}_azm'.format(endPt)]      = azm
+
+        self.df = paths_df
 
     def __add_endPoints__(self):
         """
-        For each row in self.df, if a 'tx_end_range_km' is defined but 'end_lat' is not,
-        compute and add an 'end_lat' and 'end_lon' from the tranmitter location
-        in the direction of the receiver location for the distance 'tx_end_range_km'.
+        If a 'tx_end_range_km' is defined but 'end_lat' is not, compute and add an 'end_lat' and 'end_lon'
+        for each path from the tranmitter location in the direction of the receiver location for the
+        distance 'tx_end_range_km'.
         """
-        paths_df = self.df
-        
-        new_rows = []
-        for rinx,row in paths_df.iterrows():
-            if ('tx_end_range_km' in row.keys()) and ('rx_lat' in row.keys()) and ('end_lat' not in row.keys()):
-                tx_lat = row['tx_lat']
-                tx_lon = row['tx_lon']
-                rx_lat = row['rx_lat']
-                rx_lon = row['rx_lon']
-                
-                invl    = geod.InverseLine(tx_lat,tx_lon,rx_lat,rx_lon)
-                rx_azm  = invl.azi1
-                rng_m  = row['tx_end_range_km']*1e3
+        paths_df = self.df.copy()
 
-                tmp    = geod.Direct(tx_lat, tx_lon, rx_azm, rng_m)
-                row['end_lat'] = tmp['lat2']
-                row['end_lon'] = tmp['lon2']
+        cols = paths_df.columns
+        if ('tx_end_range_km' in cols) and ('rx_lat' in cols) and ('end_lat' not in cols):
+            tx_lat  = paths_df['tx_lat'].to_numpy(dtype=float)
+            tx_lon  = paths_df['tx_lon'].to_numpy(dtype=float)
+            _, rx_azm, _ = geodesy.inverse(tx_lat,tx_lon,paths_df['rx_lat'].to_numpy(dtype=float),
+                                           paths_df['rx_lon'].to_numpy(dtype=float))
+            end_lat, end_lon, _ = geodesy.direct(tx_lat,tx_lon,rx_azm,paths_df['tx_end_range_km'].to_numpy(dtype=float))
+            paths_df['end_lat'] = end_lat
+            paths_df['end_lon'] = end_lon
 
-                if (row.get('end_lbl') is None) and (row.get('rx_lbl') is not None):
-                    row['end_lbl'] = row['rx_lbl']
-                    
-            new_rows.append(row)
-        new_paths_df = pd.DataFrame(new_rows)
-        
-        self.df = new_paths_df
+            if ('end_lbl' not in cols) and ('rx_lbl' in cols):
+                paths_df['end_lbl'] = paths_df['rx_lbl']
+
+        self.df = paths_df
 
     def generate_run_list(self,dates_UTC,freqs_MHz,event=''):
         """
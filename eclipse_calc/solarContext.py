@@ -9,16 +9,8 @@ from matplotlib.collections import PolyCollection
 from matplotlib.patches import Polygon
 from matplotlib import pyplot as plt
 
-import cartopy
-import cartopy.crs as ccrs
-from cartopy.mpl.ticker import LongitudeFormatter, LatitudeFormatter
-
-# Geographiclib - https://geographiclib.sourceforge.io/Python/2.0/
-# conda install conda-forge::geographiclib
-from geographiclib.geodesic import Geodesic
-geod = Geodesic.WGS84
-
 import eclipse_calc
+from eclipse_calc import geodesy   # batch WGS84 geodesics and nearest track point look up
 import calcSun
 
 def sunAzEl(dates,lat,lon):
@@ -43,10 +35,24 @@ def calc_solar_zenith(sTime,eTime,sza_lat,sza_lon,minutes=5):
     return sza
 
 class EclipseData(object):
-    def __init__(self,fname,meta={},track_kwargs={}):
+    def __init__(self,fname,meta={},track_kwargs={},height=None):
         """
-        Load a CSV containing eclipse obscuration data.
+        Load a CSV containing eclipse obscuration data, or an obscuration grid cache directory
+        written by eclipse_calc.obscuration_grid.
+
+        height: height [km] to take from a cache holding several, the first cached height if None.
+                Not used with a CSV, which holds one height.
         """
+        if os.path.isdir(fname):
+            self.__load_cache__(fname,height)
+        else:
+            self.__load_csv__(fname)
+
+        meta['fname']    = fname        
+        self.meta        = meta
+        self.track_kwargs = track_kwargs
+
+    def __load_csv__(self,fname):
         df = pd.read_csv(fname,comment='#')
 
         height = df['height'].unique()
@@ -57,7 +63,36 @@ class EclipseData(object):
         # Calculate vectors of center lats and lons.
         center_lats = np.sort(df['lat'].unique())
         center_lons = np.sort(df['lon'].unique())
+        cshape      = (len(center_lats),len(center_lons))
+
+        self.df          = df
+        self.obsc        = df['obsc'].to_numpy().reshape(cshape)
+        self.__set_grid__(center_lats,center_lons,height)
+
+        # Load track data.
+        df_track_csv = fname.replace('MAX_OBSCURATION','ECLIPSE_TRACK')
+        if os.path.exists(df_track_csv):
+            df_track = pd.read_csv(df_track_csv,parse_dates=[0],comment='#')
+            df_track = df_track.set_index('date_ut')
+            
+            self.df_track = df_track
+        else:
+            print('File not found: {!s}'.format(df_track_csv))
+            print('No eclipse track data loaded.')
+            self.df_track = None
+
+    def __load_cache__(self,cache_dir,height=None):
+        # Maximum obscuration is memory-mapped from the cache rather than parsed from a CSV.
+        from .obscuration_grid import ObscurationCache
+        cache       = ObscurationCache(cache_dir)
+        h_inx       = cache.height_index(height)
+
+        self.df          = None
+        self.obsc        = cache.max_obsc[h_inx]
+        self.__set_grid__(cache.lats,cache.lons,cache.heights_km[h_inx])
+        self.df_track    = cache.track(self.height)
 
+    def __set_grid__(self,center_lats,center_lons,height):
         # Find the lat/lon step size.
         dlat = center_lats[1] - center_lats[0]
         dlon = center_lons[1] - center_lons[0]
@@ -83,9 +118,6 @@ class EclipseData(object):
 
         cshape      = (len(center_lats),len(center_lons))
 
-        meta['fname']    = fname        
-        self.meta        = meta
-        self.df          = df
         self.center_lats = center_lats
         self.center_lons = center_lons
         self.cshape      = cshape
@@ -94,39 +126,22 @@ class EclipseData(object):
         self.dlat        = dlat
         self.dlon        = dlon
         self.height      = height
-    
-        # Load track data.
-        self.track_kwargs = track_kwargs
-        df_track_csv = fname.replace('MAX_OBSCURATION','ECLIPSE_TRACK')
-        if os.path.exists(df_track_csv):
-            df_track = pd.read_csv(df_track_csv,parse_dates=[0],comment='#')
-            df_track = df_track.set_index('date_ut')
-            
-            self.df_track = df_track
-        else:
-            print('File not found: {!s}'.format(df_track_csv))
-            print('No eclipse track data loaded.')
-            self.df_track = None
         
     def get_obsc_arr(self,obsc_min=0,obsc_max=1):
         """
-        Convert the Obscuration DataFrame to a 2D numpy array that can easily be plotted with pcolormesh.
+        Convert the obscuration values to a 2D numpy array that can easily be plotted with pcolormesh.
 
         obsc_min: obscuration values less than this number will be converted to np.nan
         obsc_max: obscuration values greater than this number will be converted to np.nan
         """
-        df = self.df.copy()
+        obsc_arr    = np.array(self.obsc,dtype=float)
         
         if obsc_min > 0:
-            tf = df['obsc'] < obsc_min
-            df.loc[tf,'obsc'] = np.nan
+            obsc_arr[obsc_arr < obsc_min] = np.nan
             
         if obsc_max < 1:
-            tf = df['obsc'] > obsc_max
-            df.loc[tf,'obsc'] = np.nan
+            obsc_arr[obsc_arr > obsc_max] = np.nan
             
-        obsc_arr    = df['obsc'].to_numpy().reshape(self.cshape)
-        
         return obsc_arr
     
     def overlay_obscuration(self,ax,obsc_min=0,alpha=0.65,cmap='gray_r',vmin=0,vmax=1,zorder=1):
@@ -173,27 +188,18 @@ class EclipseData(object):
 
         tas_new = []
         tas = self.meta.get('track_annotate',[]).copy()
+        tr_lats = df_track['lat'].to_numpy()
+        tr_lons = df_track['lon'].to_numpy()
+        if len(tas) > 0:
+            track_tree = geodesy.NearestPoint(tr_lats,tr_lons)   # built once for all the annotations
         for ta in tas:
             ta_se   = ta.get('startEnd','start')
 
-            tr_lats = df_track['lat'].to_numpy()
-            tr_lons = df_track['lon'].to_numpy()
-
             ta_lat = ta['lat']
             ta_lon = ta['lon']
 
-            ta_lats = np.ones_like(tr_lats)*ta_lat
-            ta_lons = np.ones_like(tr_lons)*ta_lon
-
-            ta_rngs = []
-            for ta_lat,ta_lon,tr_lat,tr_lon in zip(ta_lats,ta_lons,tr_lats,tr_lons):
-                # Determine the ranges and azimuth along the profile path.
-                invl    = geod.InverseLine(ta_lat,ta_lon,tr_lat,tr_lon)
-                dist    = invl.s13*1e-3   # Distance in km
-                # azm     = invl.azi1
-                ta_rngs.append(dist)
-            
-            ta_inx  = np.argmin(ta_rngs)
+            ta_inx,_ = track_tree.query(ta_lat,ta_lon)    # nearest track point on the ellipsoid
+            ta_inx  = int(ta_inx)
             
             ta['lat']   = tr_lats[ta_inx]
             ta['lon']   = tr_lons[ta_inx]
@@ -15,7 +15,10 @@ from matplotlib import pyplot as plt
 
 import digital_rf as drf
 
-from eclipse_calc import solarContext
+import load_grape_iq
+import raster_spectrogram
+
+from eclipse_calc import gen_lib   # solarContext is imported by get_solarTimeseries, only runs with a solar overlay need it
 
 import sys
 
@@ -26,8 +29,22 @@ mpl.rcParams['grid.linestyle'] = ':'
 mpl.rcParams['figure.figsize'] = np.array([15, 8])
 mpl.rcParams['axes.xmargin']   = 0
 
-def load_grape_drf(sDate,eDate,data_dir,channel='ch0'):
+# Solar elevation and eclipse obscuration series are shared by every panel and every GrapeDRF object
+# for the same place and time span, so they are cached at module level.
+solar_cache = gen_lib.LRUCache(maxsize=16)
+
+def get_solarTimeseries(sDate,eDate,lat,lon,dt_minutes=1):
+    """
+    Return a solarContext.solarTimeseries for (sDate,eDate,lat,lon,dt_minutes), reusing a cached one if
+    available. The object keeps its computed elevations and obscurations, so each is computed once.
+    """
+    from eclipse_calc import solarContext
+    key = (sDate,eDate,lat,lon,dt_minutes)
+    return solar_cache.get(key,lambda: solarContext.solarTimeseries(sDate,eDate,lat,lon,dt_minutes))
+
+def load_grape_drf(sDate,eDate,data_dir,channel='ch0',precision='complex128'):
     # DATA LOADING #########################
+    # precision: 'complex128', 'complex64' or 'int16' storage of the IQ, see load_grape_iq.py
     meta_dir    = os.path.join(data_dir,channel,'metadata')
     do          = drf.DigitalRFReader(data_dir)
     dmr         = drf.DigitalMetadataReader(meta_dir)
@@ -73,37 +90,39 @@ def load_grape_drf(sDate,eDate,data_dir,channel='ch0'):
 
     sinx_0      = drf.util.time_to_sample(sDate,fs)
     sinx_1      = drf.util.time_to_sample(eDate,fs)
-    blks        = do.get_continuous_blocks(sinx_0,sinx_1,channel)
-    for sinx, nsamps in blks.items():
-        break # Get the first sample index and number of samples
+    nsamps      = int(sinx_1 - sinx_0)
+
+    # Read every continuous block between sinx_0 and sinx_1 once, for all subchannels,
+    # into a preallocated array. Gaps stay zero and are flagged False in valid.
+    iq, valid   = load_grape_iq.read_grape_drf_masked(do,channel,sinx_0,nsamps,precision=precision)
+    single      = iq.ndim == (2 if precision == 'int16' else 1)
 
     bigarray_dct = {}
-    for cfreq in cntr_freqs:
-        bigarray_dct[cfreq] = np.zeros(nsamps,dtype=complex)
-
-    for cfreq_inx,(cfreq, bigarray) in enumerate(bigarray_dct.items()):
-        print()
-        print('Working on {!s} MHz....'.format(cfreq))
-        data = do.read_vector(sinx, nsamps, channel)
-        # edits to original code start here
-        if data.ndim == 1:
-            bigarray[:] = data
+    for cfreq_inx,cfreq in enumerate(cntr_freqs):
+        if single:
+            bigarray_dct[cfreq] = iq
         else:
-            bigarray[:] = data[:, cfreq_inx]
-        # edits to original code end here
-        #bigarray[:] = data[:,cfreq_inx]  -- original line
+            bigarray_dct[cfreq] = iq[cfreq_inx]
 
     result  = {}
     result['bigarray_dct']  = bigarray_dct
+    result['valid']         = valid
+    result['precision']     = precision
     result['latest_meta']   = latest_meta[latest_inx]
     result['properties']    = properties
+    sinx                    = sinx_0
     t0                      = drf.util.sample_to_datetime(sinx,fs)
     result['timevec_utc']   = [t0+drf.util.samples_to_timedelta(x,fs) for x in range(nsamps)]
     return result
 
 class GrapeDRF(object):
     def __init__(self,sDate,eDate,station,
-            output_dir=os.path.join('output','grapeDRF')):
+            output_dir=os.path.join('output','grapeDRF'),precision='complex128',spectrum_cache_size=4):
+        """
+        precision: storage of the IQ in memory and in the cache file, 'complex128' (default),
+            'complex64' (half the size) or 'int16' (a quarter). See load_grape_iq.py for accuracy.
+        spectrum_cache_size: number of spectrograms kept in memory for reuse by later panels.
+        """
 
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -114,13 +133,16 @@ class GrapeDRF(object):
         event_fname = '{!s}-{!s}_{!s}_grapeDRF'.format(sDate_str,eDate_str,station)
         png_fname   = event_fname+'.png'
         png_fpath   = os.path.join(output_dir,png_fname)
-        ba_fpath    = os.path.join(output_dir,event_fname+'.ba.pkl')
+        if precision == 'complex128':
+            ba_fpath    = os.path.join(output_dir,event_fname+'.ba.pkl')
+        else:
+            ba_fpath    = os.path.join(output_dir,event_fname+'.{!s}.ba.pkl'.format(precision))
         data_dir    = os.path.join('data','psws_grapeDRF',station)  
 
-        result  = load_grape_drf(sDate,eDate,data_dir)
+        result  = load_grape_drf(sDate,eDate,data_dir,precision=precision)
 
         # if not os.path.exists(ba_fpath):
-        #     result  = load_grape_drf(sDate,eDate,data_dir)
+        #     result  = load_grape_drf(sDate,eDate,data_dir,precision=precision)
         #     with open(ba_fpath,'wb') as fl:
         #         pickle.dump(result,fl)
         # else:
@@ -131,6 +153,7 @@ class GrapeDRF(object):
         self.result             = result
         self.cfreqs             = list(result['bigarray_dct'].keys())
         self.fs                 = result['properties']['samples_per_second']
+        self.precision          = result.get('precision','complex128')
         self.sDate              = sDate
         self.eDate              = eDate
         self.data_dir           = data_dir
@@ -138,7 +161,7 @@ class GrapeDRF(object):
         self.output_dir         = output_dir
         self.png_fpath          = png_fpath
         self.cmap               = mpl.colors.LinearSegmentedColormap.from_list(" ", ["black","darkgreen","green","yellow","red"])
-        self.spectrum_timevec   = None
+        self.spectrum_cache     = gen_lib.LRUCache(maxsize=spectrum_cache_size)
 
     def plot_figure(self,cfreqs=None,png_fpath=None,**kwargs):
         print('Now plotting {!s}...'.format(self.event_fname))
@@ -162,10 +185,61 @@ class GrapeDRF(object):
         fig.savefig(png_fpath,bbox_inches='tight')
         print(png_fpath)
 
+    def spectrogram(self,cfreq,nfft=1024,window='hann',nperseg=256,noverlap=None):
+        """
+        Spectrogram of one center frequency, memoized on (cfreq,nfft,window,nperseg,noverlap).
+        Repeated panels and figures of the same frequency reuse the result; the least recently used
+        spectrogram is dropped once spectrum_cache_size are held.
+
+        Returns dict with 'f' (Hz, zero centered), 'Sxx_db' (PSD dB, NaN in data gaps),
+        't_epoch' (epoch seconds of the columns) and 'timevec' (the same as UTC datetimes).
+        """
+        if noverlap is None:
+            noverlap = nperseg//8
+        key = (cfreq,nfft,window,nperseg,noverlap)
+        return self.spectrum_cache.get(key,lambda: self.__compute_spectrogram__(*key))
+
+    def __compute_spectrogram__(self,cfreq,nfft,window,nperseg,noverlap):
+        result          = self.result
+        bigarray        = result['bigarray_dct'][cfreq]
+        bigarray        = load_grape_iq.iq_to_complex(bigarray,load_grape_iq.compute_dtype(self.precision))
+        f, t_spec, Sxx  = signal.spectrogram(bigarray,fs=self.fs,nperseg=nperseg,noverlap=noverlap,
+                                nfft=nfft,window=window,return_onesided=False)
+        valid           = result.get('valid')
+        if valid is not None:
+            # Blank segments that straddle a data gap rather than plotting the FFT of zeros.
+            seg_ok          = load_grape_iq.window_valid(valid,nperseg,nperseg-noverlap,len(t_spec))
+            Sxx[:,~seg_ok]  = np.nan
+
+        ts0             = min(result['timevec_utc']).timestamp()
+        ts1             = max(result['timevec_utc']).timestamp()
+        ts_vec          = np.linspace(ts0,ts1,len(t_spec))
+
+        spec            = {}
+        spec['f']       = (np.fft.fftshift(f)).astype('float64') # Frequency needs to be in float64 for some reason...
+        spec['Sxx_db']  = 10*np.log10(np.fft.fftshift(Sxx,axes=0))
+        spec['t_epoch'] = ts_vec
+        spec['timevec'] = [datetime.datetime.utcfromtimestamp(x) for x in ts_vec]
+        return spec
+
+    def write_spectrogram_png(self,cfreq,png_fpath,width_px=2000,height_px=None,vmin=None,vmax=None,**kwargs):
+        """
+        Write the spectrogram of cfreq straight to a PNG without axes or labels, one pixel column per
+        width_px bin. kwargs are the spectrogram geometry, see spectrogram().
+        """
+        spec    = self.spectrogram(cfreq,**kwargs)
+        return raster_spectrogram.write_png(png_fpath,spec['t_epoch'],spec['f'],spec['Sxx_db'],
+                    width_px,height_px,cmap=self.cmap,vmin=vmin,vmax=vmax)
+
     def plot_ax(self,cfreq,ax,cmap=None,plot_colorbar=False,
             xlim=None,
             solar_lat=None,solar_lon=None,
-            overlaySolarElevation=True,overlayEclipse=False):
+            overlaySolarElevation=True,overlayEclipse=False,
+            nfft=1024,window='hann',nperseg=256,noverlap=None,raster=False):
+        """
+        raster: draw the spectrogram as an image binned to the axes pixels (raster_spectrogram.py)
+            instead of a pcolormesh, much faster for day long spans.
+        """
 
         sDate   = self.sDate
         eDate   = self.eDate
@@ -185,25 +259,20 @@ class GrapeDRF(object):
             print(msg)
             return
 
-        f, t_spec, Sxx  = signal.spectrogram(bigarray,fs=self.fs,nfft=1024,window='hann',return_onesided=False)
-        if self.spectrum_timevec is None:
-            # TODO: Make this more clean in the future.
-            ts0                     = min(result['timevec_utc']).timestamp()
-            ts1                     = max(result['timevec_utc']).timestamp()
-            ts_vec                  = np.linspace(ts0,ts1,len(t_spec))
-            self.spectrum_timevec   = [datetime.datetime.utcfromtimestamp(x) for x in ts_vec]
-
-        f               = (np.fft.fftshift(f)).astype('float64') # Frequency needs to be in float64 for some reason...
-        Sxx             = np.fft.fftshift(Sxx,axes=0)
-        Sxx_db          = 10*np.log10(Sxx)
+        spec            = self.spectrogram(cfreq,nfft=nfft,window=window,nperseg=nperseg,noverlap=noverlap)
         if cmap is None:
             cmap = self.cmap
-        mpbl            = ax.pcolormesh(self.spectrum_timevec,f,Sxx_db,cmap=cmap)
+        if raster:
+            t_mpl   = raster_spectrogram.epoch_to_mpl(spec['t_epoch'])
+            mpbl    = raster_spectrogram.imshow_spectrogram(ax,t_mpl,spec['f'],spec['Sxx_db'],cmap=cmap)
+            ax.xaxis_date()
+        else:
+            mpbl    = ax.pcolormesh(spec['timevec'],spec['f'],spec['Sxx_db'],cmap=cmap)
 
         if plot_colorbar:
-            cbar = fig.colorbar(mpbl,label='PSD [dB]')
+            cbar = fig.colorbar(mpbl,ax=ax,label='PSD [dB]')
 
-        sts     = solarContext.solarTimeseries(sDate,eDate,solar_lat,solar_lon)
+        sts     = get_solarTimeseries(sDate,eDate,solar_lat,solar_lon)
         odct    = {'color':'white','lw':4,'alpha':0.75}
         if overlaySolarElevation:
             sts.overlaySolarElevation(ax,**odct)
@@ -20,15 +20,16 @@
 
 import digital_rf as drf
 import numpy as np
-import pylab as plt
 import csv                         # to write csv file for plotting and comparison in Excel
 from datetime import datetime
 import pytz
 import sys
 import os
-import maidenhead as mh           # lat lon to locator, used if locator not present, eg Grape 1 DRF metadata
 
 import load_metadata              # this is a module in this directory to read digital RF metadata
+import load_grape_iq              # this is a module in this directory to read IQ data across data gaps
+import doppler_kernels            # this is a module in this directory with the per-minute FFT and ACF processing
+import stage_metrics              # this is a module in this directory for stage timing, counters and peak memory
 
 base_directory='./'
 data_dir=os.path.join(base_directory,'data','psws_grapeDRF')
@@ -58,13 +59,15 @@ if (float(sys.argv[4])-float(sys.argv[3])) <1:
    print ("Stop time must be at least one hour greater than start time")
    exit()
 
+stage_metrics.start('grape_acf_doppler_spread')   # stage times and counts to ./output/profiles at exit
+
 #
 
 ################################################
 # Get metadata then set up constants and arrays
 ################################################
 # Call module function to read in metadata, draws on data_dict code from Nathaniel Frissell 
-
+stage_metrics.mark('metadata')
 (date,freqList,s1,s0,fs,theCallsign,grid,lat,lon) = load_metadata.load_grape_drf_metadata(data_dir,channel)
 
 # Check sensible and available command line start and stop times
@@ -90,6 +93,7 @@ time_window=60                               # 60 seconds is default for each pr
 length=int(np.floor(length*(60/time_window))) # in case time window changed, then alter length accordingly
 
 m_samples=int(fs*time_window)
+precision='complex64'                        # IQ storage: 'complex64', 'int16' (least memory) or 'complex128', see load_grape_iq.py
 n_samples=int(length*m_samples+1)            # total length of input data in samples
 s=s0+hours_offset*3600*fs                    # calculate start time given command line start time offset
 
@@ -105,15 +109,18 @@ data=np.zeros(m_samples)
 # digital_rf read in code
 ########################################
 
+stage_metrics.mark('read')
 do.get_channels()
 # get samples, these are i,q pairs. Starting at s
-input = do.read_vector(s, n_samples, channel)
+# All continuous blocks in the span are read, gaps are zero filled and flagged False in valid
 if len(freqList) > 1: 
-  data=input[:,freq_index]
+  data,valid=load_grape_iq.read_grape_drf_masked(do,channel,s,n_samples,sub_channel=freq_index,precision=precision)
 else:                               # single channel Grape so 1 dimensional data array
-  data=input[:]
+  data,valid=load_grape_iq.read_grape_drf_masked(do,channel,s,n_samples,precision=precision)
+window_ok=load_grape_iq.window_valid(valid,m_samples+1,m_samples,length)  # ACF at one lag needs one sample beyond the window
 print ("First data sample is ", data[0])
 
+stage_metrics.mark('acf')
 with open(csv_filename, 'w', encoding='UTF8',) as out_file:     # open a csv file for write, write metadata, headers then data rows
  writer=csv.writer(out_file)
  writer.writerow(["Date","Callsign","Grid","Freq (MHz)","Lat","Lon"])
@@ -122,25 +129,25 @@ with open(csv_filename, 'w', encoding='UTF8',) as out_file:     # open a csv fil
 
 # Analysis outer and inner loops
  for j in range (0,length):
-  R_T0=0
-  R_Ts=0
   k=int(j*m_samples)
-  for i in range (0, m_samples):                        # analysis and average frequency and level every specified time window
-    R_T0=R_T0+data[i+k]*np.conjugate(data[i+k])         # ACF function at zero lag
-    R_Ts=R_Ts+data[i+k]*np.conjugate(data[i+1+k])       # ACF function at one lag
-    real[i]=np.real(data[i+k])  
-  freq[j]=round(-(1/(2*np.pi*0.1))*np.angle(R_Ts),5)    # round for csv file, 0.01 mHz resolution is OTT but useful for WW0WWV
-  level=np.std(real)+np.average(real)                   # matches expected from 20*log10(65535) as 16 bit full scale
-                                                        # with very small freq shifts have to add 'DC' component
-  dB_level[j]=round(20*np.log10(level),2)               # round for csv, 2 decimal places is sensible
-  spread[j]=(1.414/(2*np.pi*0.1))*np.sqrt(np.abs(np.log((R_T0/np.abs(R_Ts)))))*1000    # spread in milliHertz
-  spread[j]=round(spread[j],0)                          # round for csv file, 1 mHz resolution is sensible
   time[j]=round(((j)/(60*(60/time_window)))+hours_offset,5)                # time in hours, rounded for csv file
+  if not window_ok[j]:                                  # window spans a data gap, no estimate rather than ACF of zero fill
+    freq[j]=np.nan
+    spread[j]=np.nan
+    dB_level[j]=np.nan
+    writer.writerow([time[j],freq[j],spread[j],dB_level[j]])
+    continue
+  # Doppler, spread and level from the zero and one lag ACF of this window plus the one-lag sample
+  freq[j],spread[j],dB_level[j]=doppler_kernels.acf_doppler(data[k:k+m_samples+1],m_samples,fs)
   writer.writerow([time[j],freq[j],spread[j],dB_level[j]])
+ stage_metrics.count('acf_windows',np.count_nonzero(window_ok[:length]))
+ stage_metrics.count('rows_written',length)
 
 ###########################################
 # Plots of Doppler, Spread and Level
 ###########################################
+stage_metrics.mark('plot')
+import pylab as plt               # matplotlib imported only once the analysis is done and there is something to plot
 plot_dir=os.path.join(output_dir,'plots',theCallsign)   # plots go into a subdirectory by callsign
 if not os.path.exists(plot_dir):
   os.makedirs(plot_dir)
@@ -183,4 +190,5 @@ plt.gcf().set_size_inches(8, 3, forward=True)
 plt.tight_layout()
 plt.savefig(plot_dir +"/ACF_Level" + "_" + str(frequency) + "MHz_" + date + ".png", dpi=600)
 
+stage_metrics.finish()                # written before the plot windows, so the time they are open is not counted
 plt.show()
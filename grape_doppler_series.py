@@ -0,0 +1,134 @@
+# Program to read in the metadata and IQ data from a Grape receiver in digital_rf format
+# and extract instantaneous Doppler (frequency deviation) time series at a high rate, e.g. one value per second,
+# from sliding windows rather than the 60 s ensembles of grape_acf_doppler_spread.py and grape_fft_spectrogram.py.
+# Two estimators, both computing every window of a subchannel at once (see doppler_kernels.py):
+#   acf       phase difference of successive samples averaged over the window (the one lag ACF), with spread and power.
+#             Fastest, a day of 1 s values for all subchannels in seconds. The power weighted mean Doppler of all modes.
+#   zoomfft   peak of a zoom FFT of the Hann windowed samples over +-2 Hz, interpolated. Follows the strongest mode.
+# Output is binary: a .npz of float32 arrays (subchannels x windows) of Doppler, spread and power, with the time of the
+# first window centre and the hop, read back with doppler_kernels.read_doppler_series(). Optionally also a
+# Timestamp,Freq Dev csv file per subchannel as time_vs_fd, read by custom_time_vs_fd.ipynb.
+#
+# Script needs four command line arguments:
+# 1. Directory to process 2. Index of array of frequency to process, or all for every subchannel
+# 3. Start time in hour   4. Stop time in hour
+# Optional further arguments: window=10 (seconds), hop=1 (seconds), method=acf or zoomfft, csv
+#     e.g. python3 grape_doppler_series.py ch1_W2NAF all 0 24
+#          python3 grape_doppler_series.py ch1_W2NAF 3 15 21 window=5 hop=0.5 method=zoomfft csv
+# Output in ./output/doppler/callsign/
+
+import digital_rf as drf
+import numpy as np
+import csv                         # to write the optional csv file
+from datetime import datetime
+import pytz
+import sys
+import os
+
+import load_metadata              # this is a module in this directory to read digital RF metadata
+import load_grape_iq              # this is a module in this directory to read IQ data across data gaps
+import doppler_kernels            # this is a module in this directory with the FFT and ACF processing
+import stage_metrics              # this is a module in this directory for stage timing, counters and peak memory
+
+base_directory='./'
+data_dir=os.path.join(base_directory,'data','psws_grapeDRF')
+output_dir=os.path.join(base_directory,'output')
+
+do = drf.DigitalRFReader(data_dir)
+
+# check for at least four command line arguments
+if len(sys.argv) < 5:
+   print ("Rerun with channel name, frequency index (or all) and start and stop hours as four command line arguments")
+   exit()
+
+channel=sys.argv[1]
+all_flag=sys.argv[2] == 'all'
+hours_offset=float(sys.argv[3])  # Start time for data input
+hours_stop=float(sys.argv[4])
+options=dict(arg.split('=',1) for arg in sys.argv[5:] if '=' in arg)
+window_s=float(options.get('window',10))      # seconds in each sliding window
+hop_s=float(options.get('hop',1))             # seconds between window centres, i.e. 1 for a 1 Hz series
+method=options.get('method','acf')
+csv_flag='csv' in sys.argv[5:]
+
+if method not in ('acf','zoomfft'):
+   print ("method must be acf or zoomfft")
+   exit()
+
+if hours_offset < 0 or hours_offset > 23 or hours_stop <= hours_offset:
+   print ("Start time (hours) must be between 0 and 23 and stop time later than start")
+   exit()
+
+stage_metrics.start('grape_doppler_series')   # stage times and counts to ./output/profiles at exit
+
+################################################
+# Get metadata then set up constants
+################################################
+stage_metrics.mark('metadata')
+(date,freqList,s1,s0,fs,theCallsign,grid,lat,lon) = load_metadata.load_grape_drf_metadata(data_dir,channel)
+fs=float(fs)                                 # samples_per_second is np.longdouble, which datetime will not take
+freqList=list(np.atleast_1d(freqList))
+
+# Check sensible and available command line start and stop times
+if hours_stop >= ((s1-s0)/fs)/3600:
+   print ("End time specified beyond end of data set: Reading to last sample in data set")
+   hours_stop=((s1-s0)/fs)/3600
+
+if all_flag:
+  freq_indices=list(range(len(freqList)))
+else:
+  freq_indices=[int(sys.argv[2])]
+
+window_samples=int(round(window_s*fs))
+hop_samples=max(1,int(round(hop_s*fs)))
+s=int(s0+hours_offset*3600*fs)               # start sample given command line start time offset
+n_samples=int((hours_stop-hours_offset)*3600*fs)+1
+precision='int16'                            # IQ storage, least memory for a day of all subchannels, see load_grape_iq.py
+
+doppler_dir=os.path.join(output_dir,'doppler',theCallsign)
+if not os.path.exists(doppler_dir):
+  os.makedirs(doppler_dir)
+
+########################################
+# digital_rf read in code
+########################################
+stage_metrics.mark('read')
+do.get_channels()
+try:
+  data,valid=load_grape_iq.read_grape_drf_masked(do,channel,s,n_samples,precision=precision)
+except ValueError:                           # channel holds float samples, so no int16 storage
+  data,valid=load_grape_iq.read_grape_drf_masked(do,channel,s,n_samples,precision='complex64')
+if data.ndim == (1 if np.iscomplexobj(data) else 2):
+  data=data[None]                            # single channel Grape, as one row of subchannels
+
+########################################
+# Sliding window Doppler, all windows of a subchannel at once
+########################################
+stage_metrics.mark(method)
+kernel=doppler_kernels.sliding_acf_doppler if method == 'acf' else doppler_kernels.zoom_fft_doppler
+results=[kernel(data[i],valid,fs,window_samples,hop_samples) for i in freq_indices]
+doppler=np.array([r[0] for r in results])
+spread=np.array([r[1] for r in results])
+power_db=np.array([r[2] for r in results])
+t0=s/fs+results[0][3][0]/fs                  # epoch seconds of the first window centre
+n_windows=doppler.shape[1]
+print ("Computed", n_windows, "windows of", window_s, "s every", hop_s, "s for", len(freq_indices), "subchannel(s)")
+
+stage_metrics.mark('write')
+freqs=[freqList[i] for i in freq_indices]
+start_str=datetime.fromtimestamp(s/fs,pytz.utc).strftime('%Y%m%dT%H%M')
+file_stem=doppler_dir+'/'+start_str+'_'+channel+'_'+('all' if all_flag else str(freqs[0])+'MHz')+'_'+method
+doppler_kernels.write_doppler_series(file_stem+'.npz',t0,hop_samples/fs,window_samples/fs,method,freqs,doppler,spread,
+                                     power_db,theCallsign,grid)
+stage_metrics.count('rows_written',n_windows*len(freq_indices))
+print ("Doppler series written to", file_stem+'.npz')
+
+if csv_flag:                                 # text copy in the time_vs_fd layout, one file per subchannel
+  times=[datetime.fromtimestamp(t0+j*hop_samples/fs,pytz.utc).strftime('%Y-%m-%d %H:%M:%S') for j in range(n_windows)]
+  for i,frequency in enumerate(freqs):
+    csv_filename=doppler_dir+'/'+start_str+'_'+str(frequency)+'MHz_'+method+'_time_vs_fd.csv'
+    with open(csv_filename, 'w', encoding='UTF8',) as out_file:
+      writer=csv.writer(out_file)
+      writer.writerow(["Timestamp","Freq Dev"])
+      writer.writerows(zip(times,doppler[i].tolist()))
+    print ("csv file written to", csv_filename)
@@ -21,20 +21,19 @@
 
 import digital_rf as drf
 import numpy as np
-import pylab as plt
-from mpl_toolkits.axisartist.parasite_axes import HostAxes
 import csv                      # to write csv file for plotting and comparison in Excel
 from datetime import datetime
 import pytz
-import scipy
 import sys
 import os
 from scipy import stats
-from scipy.fft import fft, fftfreq, fftshift
+from scipy.fft import fftfreq, fftshift
 from scipy import signal        # For the  Continuous Wavelet Transform (CWT)
-from prophet import Prophet
 
 import load_metadata              # this is a module in this directory to read digital RF metadata
+import load_grape_iq              # this is a module in this directory to read IQ data across data gaps
+from doppler_kernels import findLocalPeak, freqInterpolate, trainingQc, minute_spectrum, cwt_peaks, prophet_predict
+import stage_metrics              # this is a module in this directory for stage timing, counters and peak memory
 
 import logging
 logging.getLogger('prophet').setLevel(logging.WARNING) 
@@ -43,10 +42,6 @@ logger.addHandler(logging.NullHandler())
 logger.propagate = False
 logger.setLevel(logging.CRITICAL)
 
-from pandas import DataFrame
-from pandas import to_datetime
-from pandas import Timedelta
-
 # set base directory for subsequent read operations and set up digital RF reader appropriate directory
 base_directory='./'
 data_dir=os.path.join(base_directory,'data','psws_grapeDRF')
@@ -74,57 +69,18 @@ if hours_offset < 0 or hours_offset > 23:
 
 length=int(sys.argv[4])           # in minutes
 
+stage_metrics.start('grape_fft_CWT_tracking_prophet')   # stage times and counts to ./output/profiles at exit
+
 ##########################################################
-# Data processing functions
+# Data processing functions findLocalPeak, freqInterpolate and trainingQc, and the CWT peak search and
+# Prophet prediction, are in doppler_kernels.py
 ##########################################################
-# local peak search: takes array index of CWF identified peak, does local search n bins either side for a true peak, returns index
-def findLocalPeak (index, radius,level):
-  # This method finds if the true local peak is to one side or other of CWF peak, and if so returns its index
-  if index < 5 or index >594:
-     return index                     # This is special case at either end near -5 and +5 Hz where we cannot search. Should not happen
-  cwf_peak=level[index]
-  for i in range (index-radius,index+radius+1):
-     if level[i] > cwf_peak:
-       index=i
-       cwf_peak=level[i]
-  return index
-
-# Interpolate between frequency bins based on the weighted linear signal level at peak and either side
-def freqInterpolate (index, radius, x, level):
-  # This method interpolates in frequency space around true local peak returning an amplitude-weighted frequency
-  if index < 5 or index >594:
-     return x[index]                      # This is special case at either end near -5 and +5 Hz where we cannot search. Should not happen
-  sum=0
-  sum_weights=0
-  for i in range (index-radius,index+radius+1):
-      sum=sum+x[i]*10**(level[i]/20)      # Convert dB level to linear
-      sum_weights=sum_weights+10**(level[i]/20)
-  freq_interp=sum/sum_weights           # Interpolated peak frequency
-  return freq_interp
-
-# QC the frequency training set
-def trainingQc (freq,level,threshold):
-  # The frequency array may have outliers, especially if the level is under parameter: level_threshold dB.
-  # This function looks for levels under the threshold, replaces with NaN, finds the median, replaces NaNs with the median
-  # and returns a frequency array QC'd in this form
-  len_in=len(freq)
-  for n in range (0,len_in):
-      if level[n] <= threshold:
-         freq[n]=np.nan
-  raw_median=np.nanmedian(freq)
-  count=np.count_nonzero(np.isnan(freq))
-  if count < 8:
-      for n in range (0,len_in):
-        if np.isnan(freq[n]):
-          freq[n]=raw_median
-  median=np.median(freq)
-  return freq,median,count
 
 ########################################
 # Main code
 ########################################
 # Call module function to read in metadata, draws on data_dict code from Nathaniel Frissell 
-
+stage_metrics.mark('metadata')
 (date,freqList,s1,s0,fs,theCallsign,grid,lat,lon) = load_metadata.load_grape_drf_metadata(data_dir,channel)
 
 delta_f_threshold= 1      # Hz  If calculated Doppler differs by more than this from previous and level below threshold run cwf with (1,4)
@@ -138,6 +94,7 @@ m_samples=int(fs*time_window)
 n_samples=int(length*m_samples+1)     # how many samples at fs to read in
 s=s0+hours_offset*3600*fs             # s0 comes from the metadata
 frequency=freqList[freq_index]        # This comes from command line argument and metadata frequency list
+precision='complex64'                 # IQ storage, see load_grape_iq.py
 
 time=np.empty(length)
 level_1st=np.empty(length)
@@ -155,6 +112,7 @@ if not os.path.exists(csv_dir):
 csv_filename=csv_dir+'/CWF_Proph_data_' + "_" + str(frequency) + "MHz_" + date + ".csv"    #
 
 # digital_rf read in code
+stage_metrics.mark('read')
 do = drf.DigitalRFReader(data_dir)
 do.get_channels()
 
@@ -163,13 +121,15 @@ plot_start = datetime.fromtimestamp(unix_time,pytz.utc).strftime('%Y-%m-%d %H:%M
 print ("Analysis at ",plot_start)
 
 # get samples, these are i,q pairs. Starting at s and going on for length*10*60
-input = do.read_vector(s, n_samples, channel)
+# All continuous blocks in the span are read, gaps are zero filled and flagged False in valid
 if len(freqList) > 1: 
-  data=input[:,freq_index]
+  data,valid=load_grape_iq.read_grape_drf_masked(do,channel,s,n_samples,sub_channel=freq_index,precision=precision)
 else:                               # single channel Grape so 1 dimensional data array
-  data=input[:]
+  data,valid=load_grape_iq.read_grape_drf_masked(do,channel,s,n_samples,precision=precision)
+window_ok=load_grape_iq.window_valid(valid,m_samples,n_windows=length)   # False for one minute windows that span a gap
 
 # generate the x axis, which is frequency here 
+stage_metrics.mark('cwt')
 x=fftshift(fftfreq(m_samples,1/samp_rate))
 
 # generate a Hann window of length m_samples (i.e. 600 samples)
@@ -187,33 +147,16 @@ with open(csv_filename, 'w', encoding='UTF8',) as out_file:  # open a csv file f
 # Now iterate over each one minute of data to calculate frequencies and levels in 1 minute intervals
  for j in range (0,length):
     time[j]=((j)/60)+hours_offset                               # time in hours
+    if not window_ok[j]:                                        # minute spans a data gap, no Doppler or level
+      freq_1st[j]=freq_2nd[j]=level_1st[j]=level_2nd[j]=np.nan
+      continue
     k=int(j*m_samples)
-    yf=fftshift(fft(data[k:k+m_samples],norm="forward",overwrite_x=False)*Hann_factor)     # do the FFT and fftshift moves 0 Hz to centre
-    yf=20*np.log10(np.abs(yf))                                                                     # convert to dB
+    yf=minute_spectrum(data[k:k+m_samples])                     # dB spectrum, 0 Hz at centre
 
 ######################################################################################
-# Scipy find_peaks_cwt approach using continuous wavelet transform 
-# https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.find_peaks_cwt.html
+# Scipy find_peaks_cwt approach using continuous wavelet transform, 2,4 is empirical selection for one-hop widths
 #######################################################################################
-
-    peakind = signal.find_peaks_cwt(yf, widths=np.arange(2,4))           # 2,4 is empirical selection for one-hop widths
-
-    # find the index at maximum level
-    max=np.argmax(yf[peakind])                                    # This is easy
-    index_max_1st=peakind[max]
-    freq_max_1st=x[index_max_1st]
-    level_max_1st=yf[index_max_1st]
-
-    level_max_2nd=-999
-    for k in peakind:      
-      level=yf[k]
-      if level>level_max_2nd:
-         if level < level_max_1st:
-           level_max_2nd=level
-
-    index_max_2nd = [i for i, value in enumerate(yf) if abs(value - level_max_2nd) < 0.02]   # an enumerate approach for a neat, pythonic solution
-    index_max_2nd=index_max_2nd[0]                                                           # returns an array i.e. list kjust need 1st element
-    freq_max_2nd=x[index_max_2nd]
+    (index_max_1st,freq_max_1st,level_max_1st,index_max_2nd,freq_max_2nd,level_max_2nd)=cwt_peaks(yf,x,np.arange(2,4))
     print (f"{freq_max_1st:.3f},{level_max_1st:.3f},{freq_max_2nd:.3f},{level_max_2nd:.3f}")
 
    # For second measurement onward look at:
@@ -226,23 +169,8 @@ with open(csv_filename, 'w', encoding='UTF8',) as out_file:  # open a csv file f
     if j>0:
       if (((freq_max_1st-freq_1st[j-1]) > delta_f_threshold) and (level_max_1st<level_threshold)) or \
          (((freq_max_2nd-freq_2nd[j-1]) > delta_f_threshold) and (level_max_2nd<level_threshold)):
-         peakind = signal.find_peaks_cwt(yf, widths=np.arange(1,4))           # try with narrower cwf setting
-         # find the index at maximum level
-         max=np.argmax(yf[peakind])                                    # This is easy
-         index_max_1st=peakind[max]
-         freq_max_1st=x[index_max_1st]
-         level_max_1st=yf[index_max_1st]
-
-         level_max_2nd=-999
-         for k in peakind:      
-           level=yf[k]
-           if level>level_max_2nd:
-              if level < level_max_1st:
-                level_max_2nd=level
-
-         index_max_2nd = [i for i, value in enumerate(yf) if abs(value - level_max_2nd) < 0.02]   # an enumerate approach for a neat, pythonic solution
-         index_max_2nd=index_max_2nd[0]                                                           # returns an array i.e. list kjust need 1st element
-         freq_max_2nd=x[index_max_2nd]
+         (index_max_1st,freq_max_1st,level_max_1st,index_max_2nd,freq_max_2nd,level_max_2nd)=\
+           cwt_peaks(yf,x,np.arange(1,4))                            # try with narrower cwf setting
          level_1st[j]=yf[index_max_1st]
          level_2nd[j]=yf[index_max_2nd]
   #       print ("Tried (1,4)",f"{time[j]:.4f},{freq_max_1st:.3f},{level_max_1st:.3f},{freq_max_2nd:.3f},{level_max_2nd:.3f}")
@@ -272,6 +200,7 @@ with open(csv_filename, 'w', encoding='UTF8',) as out_file:  # open a csv file f
 #    print (f"{freq_1st[j]:.3f},{level_1st[j]:.3f},{freq_2nd[j]:.3f},{level_2nd[j]:.3f}\n")
 
 ###### End of the For loop every minute of data, now have data as arrays
+ stage_metrics.count('fft_windows',np.count_nonzero(window_ok))
  print("Narrow setting count: ", used_narrow_count)
 # The second peak may be low level, insufficient SNR, and a poor Doppler, if below set threshold set to NaN  
  for m in range(0,length):
@@ -283,6 +212,8 @@ with open(csv_filename, 'w', encoding='UTF8',) as out_file:  # open a csv file f
 ##################
 #
 # plot so far, i.e. with widths (2,4) and interpolated 
+ stage_metrics.mark('plot')
+ import pylab as plt              # matplotlib imported only once the peaks are found, Prophet by prophet_predict on first use
  plot_dir=os.path.join(output_dir,'plots',theCallsign)   # plots go into a subdirectory by callsign
  if not os.path.exists(plot_dir):
     os.makedirs(plot_dir)
@@ -304,13 +235,16 @@ with open(csv_filename, 'w', encoding='UTF8',) as out_file:  # open a csv file f
  plt.gcf().set_size_inches(8, 3, forward=True)
  plt.tight_layout()
  plt.savefig(plot_dir +"/CWF_Proph_Raw" + "_" + str(frequency) + "MHz_" + date + ".png", dpi=600)
+ stage_metrics.mark(None)             # the time the plot window is open is not counted
  plt.show()
 
 ##################
 #  Automatically form a training set using linear regression and test residuals one by onw.
 ##################
 # perform the initial regression on freq_1st against time
-res = stats.linregress(time[0:10],freq_1st[0:10])
+stage_metrics.mark('training')
+fit=np.isfinite(freq_1st[0:10])                                       # minutes in data gaps are left out of the fit
+res = stats.linregress(time[0:10][fit],freq_1st[0:10][fit])
 # Now go through each freq_1st to see if its residual is smaller than for the freq_2nd, if it is, swap, then recalculate
 for j in range(0,10):
 #   print (f"{time[j]:.5f},{freq_1st[j]:.3f},{level_1st[j]:.3f},{freq_2nd[j]:.3f},{level_2nd[j]:.3f}")
@@ -340,6 +274,7 @@ with open(csv_filename, 'a', encoding='UTF8',) as out_file:  # open the csv file
   writer.writerow([time[j],freq_1st[j],level_1st[j],-999,-999,-999,freq_2nd_threshold[j],level_2nd[j]])
 
 # Now use the Prophet prediction one step ahead
+ stage_metrics.mark('prophet')
  for j in range (10,length):       # First 10 i.e. (0-9) is the training set, manually checked and assigned to the two rays
   score=0
   
@@ -347,34 +282,8 @@ with open(csv_filename, 'a', encoding='UTF8',) as out_file:  # open the csv file
 #  print("Training QC: ",time[j],median,count)   # diagnostic print median and count of level <=level_threshold, that is nan substituted with median
 #  print (training)
   
-  df = DataFrame({'ds': time[j-10: j]*3600*1e9, 'y': training})
-  df['ds']= to_datetime(df['ds'])
-#  print (df)
-  prediction_time=df['ds'].iloc[-1] + Timedelta(minutes=3)  # Required prediction is one time slot ahead, but Prophet looks lagged, so try three
-#  print (prediction_time)
-
-# define the model
-  model = Prophet()
-# fit the model
-  model.fit(df)
-
-# define the period for which we want a prediction
-  future = list()
-  future.append([prediction_time])
-  future = DataFrame(future)
-  future.columns = ['ds']
-  future['ds']= to_datetime(future['ds'])
-
-# use the model to make a forecast
-  forecast = model.predict(future)
-# summarize the forecast
-#  print(forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']].head())
-
-#  exit()
-  f_1st_pred=forecast['yhat'].iloc[-1]   # copy from pandas dataframe
-  f_1st_pred_l=forecast['yhat_lower'].iloc[-1]   # lower limit
-  f_1st_pred_u=forecast['yhat_upper'].iloc[-1]   # upper limit
-
+  # Prophet fitted to the training set, prediction is one time slot ahead, but Prophet looks lagged, so try three
+  (f_1st_pred,f_1st_pred_l,f_1st_pred_u)=prophet_predict(time[j-10: j],training)
 
   if np.abs(f_1st_pred-freq_1st[j])>np.abs(f_1st_pred-freq_2nd_threshold[j]):  # suggests need to swap, increment score
      score =score +1
@@ -383,6 +292,7 @@ with open(csv_filename, 'a', encoding='UTF8',) as out_file:  # open the csv file
     level_1st[j], level_2nd[j] = level_2nd[j], level_1st[j]            # bigger difference for 1st, swap 1st and 2nd
   print (f"{time[j]:.5f},{freq_1st[j]:.3f},{level_1st[j]:.3f},{f_1st_pred:.3f},{f_1st_pred_l:.3f},{f_1st_pred_u:.3f},{freq_2nd_threshold[j]:.3f},{level_2nd[j]:.3f}, {median:.3f},{count:.0f}")
   writer.writerow([time[j],freq_1st[j],level_1st[j],f_1st_pred,f_1st_pred_l,f_1st_pred_u,freq_2nd_threshold[j],level_2nd[j],score])
+ stage_metrics.count('rows_written',length)
 
 # I'll set a signal level threshold of level_threshold dB for accepting one-hop and credible Doppler, else set value  np.nan
 for i in range (0,length):
@@ -391,6 +301,7 @@ for i in range (0,length):
   if level_2nd[i]< level_threshold:
      freq_2nd_threshold[i]=np.nan
 
+stage_metrics.mark('plot')
 fig2=plt.figure()     # plot the two rays
 plt.suptitle("Doppler sets A and B Assigned " + theCallsign + " at " + str(frequency) + " MHz", fontsize=12)
 
@@ -407,4 +318,5 @@ plt.tight_layout()
 
 plt.savefig(plot_dir +"/CWF_Proph_Assigned" + "_" + str(frequency) + "MHz_" + date + ".png", dpi=600)
 
+stage_metrics.finish()                # written before the plot window, so the time it is open is not counted
 plt.show()
@@ -18,10 +18,7 @@
 
 import digital_rf as drf
 import numpy as np
-import matplotlib as mpl
-import pylab as plt
-from scipy.fft import fft, fftfreq, fftshift
-from scipy import signal
+from scipy.fft import fftfreq, fftshift
 from datetime import datetime, timedelta
 import pytz
 import sys
@@ -30,11 +27,13 @@ import configparser
 from sys import exit
 
 import load_metadata              # this is a module in this directory to read digital RF metadata
+import load_grape_iq              # this is a module in this directory to read IQ data across data gaps
+import raster_spectrogram         # this is a module in this directory to draw spectrograms as images
+import doppler_kernels            # this is a module in this directory with the per-minute FFT and ACF processing
+import stage_metrics              # this is a module in this directory for stage timing, counters and peak memory
 
 # python3 grape_fft_spectrogram.py ch0_G4HZX 6 8 13
 
-sys.argv = [sys.argv[0], 'ch0_G4HZX', '6', '8', '13']
-
 # set base directory for subsequent read operations and set up digital RF reader appropriate directory
 base_directory='./'
 data_dir=os.path.join(base_directory,'data','psws_grapeDRF')
@@ -69,10 +68,13 @@ if (float(sys.argv[4])-float(sys.argv[3])) <1:
    print ("Stop time must be at least one hour greater than start time")
    exit()
 
+stage_metrics.start('grape_fft_spectrogram')   # stage times and counts to ./output/profiles at exit
+
 ################################################
 # Get metadata then set up constants and arrays
 ################################################
 # Call module function to read in metadata, draws on data_dict code from Nathaniel Frissell 
+stage_metrics.mark('metadata')
 (date,freqList,s1,s0,fs,theCallsign,grid,lat,lon) = load_metadata.load_grape_drf_metadata(data_dir,channel)
 
 ################################################
@@ -96,7 +98,8 @@ else:
 print("Length of selected period ",length, " minutes")
 
 frequency=freqList[freq_index]        # This comes from command line argument and metadata frequency list
-Hann_factor=1.63                      # Energy correction factor # https://community.sw.siemens.com/s/article/window-correction-factors
+precision='complex64'                 # IQ storage: 'complex64', 'int16' (least memory) or 'complex128', see load_grape_iq.py
+work_dtype=load_grape_iq.compute_dtype(precision)   # complex64 FFTs unless complex128 storage is requested
 time_window=60                        # 60 seconds of data for each FFT, i.e. each vertical 'line' in spectrogram
 m_samples=int(fs*time_window)         # Number of samples in time window, fs is from metadata, the sample rate
 n_samples=length*m_samples+1          # how many samples to read in, determined from length, diff of stop and start time in command line
@@ -105,20 +108,21 @@ s=s0+hours_offset*3600*fs             # calculate start time given command line
 
 real=np.zeros(m_samples)         # plain numpy arrays
 im=np.zeros(m_samples)
-zf=np.empty(m_samples)           # this is an initially empty array, for the frequency axis, that we'll stack at each time interval
 data=np.empty(m_samples)
 
 ########################################
 # digital_rf read in code
 ########################################
 
+stage_metrics.mark('read')
 do.get_channels()
 # get samples, these are i,q pairs. Starting at s and going on for length*10*60
-input = do.read_vector(s, n_samples, channel)
+# All continuous blocks in the span are read, gaps are zero filled and flagged False in valid
 if len(freqList) > 1: 
-  data=input[:,freq_index]
+  data,valid=load_grape_iq.read_grape_drf_masked(do,channel,s,n_samples,sub_channel=freq_index,precision=precision)
 else:                               # single channel Grape so 1 dimensional data array
-  data=input[:]
+  data,valid=load_grape_iq.read_grape_drf_masked(do,channel,s,n_samples,precision=precision)
+window_ok=load_grape_iq.window_valid(valid,m_samples,n_windows=length)   # False for one minute windows that span a gap
 
 print ("First data sample is ", data[0])
 
@@ -126,29 +130,27 @@ print ("First data sample is ", data[0])
 # FFT processing
 ########################################
 # generate the x and y axes for the contour plot 
+stage_metrics.mark('fft')
 
 x=np.linspace(hours_offset,hours_offset+int(length/60), length)
 yf=fftfreq(m_samples,1/fs)
 yf=fftshift(yf)                        # shift the zero frequency to the centre, avoids white line at zero on spectrogram
 
-# generate a Hann window of length m_samples (i.e. 600 samples)
-window = signal.windows.hann(m_samples)
-
-for j in range (0,length-1):
-   k=int(j*m_samples)
-   yt=fft(data[k:k+m_samples]*window,norm="forward",overwrite_x=False)*Hann_factor     # do the FFT
-   yt_abs=fftshift(np.abs(yt))        # shift zero frequency to centre
-   zf=np.column_stack((zf,yt_abs))    # stack the results in the 2D array zf for contour plotting
+# Hann windowed FFT of each one minute window, zero frequency centred, nan columns where the window spans a gap
+zf=doppler_kernels.fft_spectrogram(data,window_ok,m_samples,length,work_dtype)
 
 zf_dB=10*np.log10(zf)	              # Log 10 for Power Spectral Density (PSD)
 
 ##########################################
 # now plot, annotate and save
 ##########################################
+stage_metrics.mark('plot')
+import pylab as plt               # matplotlib imported only once the spectrogram is computed
 plot_dir=os.path.join(output_dir,'plots',theCallsign)   # plots go into a subdirectory by callsign
 if not os.path.exists(plot_dir):
   os.makedirs(plot_dir)
 
+plot_dpi=300                          # ample for an image binned to the axes, was 600 for the contour plot
 plot_title="Doppler shift at " + theCallsign + " at " + str(frequency) + " MHz"
 xaxis_title="Time on " + date + " (hours UTC)" 
 
@@ -162,8 +164,9 @@ levels=np.arange(min_level,max_level+6,3)
 
 fig, ax= plt.subplots()   # 
 
-# Contour plot, label, get colorbar and label
-cs=ax.contourf(x,yf,zf_dB, levels, cmap="Greys")
+# Spectrogram drawn as one image binned to the axes pixels, banded at the same 3 dB levels as the former contourf,
+# far quicker to draw and save than a contour plot of every FFT bin
+cs=raster_spectrogram.imshow_spectrogram(ax,x,yf,zf_dB,cmap="Greys",levels=levels,width_px=int(12*plot_dpi))
 
 plt.suptitle(plot_title)
 plt.xlabel(xaxis_title)
@@ -172,12 +175,12 @@ plt.gcf().set_size_inches(12, 4.5, forward=True)
 plt.xlim(hours_offset,hours_offset+np.ceil(length/60))
 plt.ylim(l_dopp_lim,u_dopp_lim)
 
-cbar = fig.colorbar(cs)
+cbar = fig.colorbar(cs, ax=ax)    # the mappable of the raster image is not attached to an axes
 cbar.set_label("PSD uncalibrated (dB)", rotation=270, labelpad=25)
 plt.tight_layout()
 
 # Save the plot
-plt.savefig(plot_dir + "/Spectrogram" + "_" + str(frequency) + "MHz_" + date + ".png", dpi=600)
+plt.savefig(plot_dir + "/Spectrogram" + "_" + str(frequency) + "MHz_" + date + ".png", dpi=plot_dpi)
 print("PSWS Spectrogram saved")
 
 ###################################################################################################
@@ -185,6 +188,7 @@ print("PSWS Spectrogram saved")
 ###################################################################################################
 if db_flag == 'True':
   print("Database look-up and synthetic spectrum requested")
+  stage_metrics.mark('database')
   import psycopg2                             # to access the postgresql database
   import matplotlib.patches as mpatches       # for synth_spec labelling
 
@@ -258,8 +262,9 @@ if db_flag == 'True':
     plt.legend(handles=[black_patch, blue_patch, green_patch, purple_patch, brown_patch, cyan_patch, lime_patch, orchid_patch],\
       ncol=2, loc=legend_loc)
      
-    plt.savefig(plot_dir + "/Spectrogram+Synth" + "_" + str(frequency) + "MHz_" + date + ".png", dpi=600)
+    plt.savefig(plot_dir + "/Spectrogram+Synth" + "_" + str(frequency) + "MHz_" + date + ".png", dpi=plot_dpi)
   else:
     print("No data in the database to match SQL statement - check it - and or run pathfinder etc.")
 
+stage_metrics.finish()                # written before the plot window, so the time it is open is not counted
 plt.show()
\ No newline at end of file
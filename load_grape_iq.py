@@ -0,0 +1,168 @@
+# Module to load IQ data for a PSWS digital RF channel from Grape receivers
+# Gap-aware: every continuous block inside the requested span is read, not just the first,
+# into a preallocated output with a validity mask that is True where samples were recorded.
+# Dropouts are left as zeros with valid=False, so downstream FFT/ACF can skip those windows.
+#
+# Precision options for the stored IQ, selected with precision=:
+#   'complex128'  legacy, 16 bytes per sample. No accuracy advantage for 16 bit Grape data.
+#   'complex64'   8 bytes per sample, half the memory. Every 16 bit integer I and Q value is held exactly
+#                 in float32, so storage is lossless. FFTs and ACFs done in single precision have a
+#                 relative rounding error of about 1e-7, i.e. more than 100 dB below the spectral peak
+#                 and well under the 96 dB range of the 16 bit ADC, so spectrograms and Doppler
+#                 estimates are unchanged to the resolution written out.
+#   'int16'       4 bytes per sample, a quarter of the memory. Raw I,Q integer pairs in a trailing axis
+#                 of length 2, converted to complex64 one window or block at a time with iq_to_complex.
+#                 Lossless, but only available when the channel stores integer samples.
+
+import numpy as np
+
+import stage_metrics                # module in this directory, stage timing and counters, samples_read counted here
+
+chunk_samples_default = 36000      # one hour at 10 samples per second, upper limit on a single read_vector call
+max_samples_default = 1728000      # two days at 10 samples per second, longest span read_grape_drf_masked holds in memory
+
+precision_dtypes = {'complex128':np.complex128,'complex64':np.complex64,'int16':np.int16}
+
+def compute_dtype(precision):
+    """
+    Complex dtype the FFT/ACF engines should work in for a given storage precision.
+    """
+    if precision == 'complex128':
+        return np.complex128
+    return np.complex64
+
+def raw_to_pairs(blk):
+    """
+    Convert a block from read_vector_raw to int16 I,Q pairs in a trailing axis of length 2.
+    Complex integer data comes back from digital_rf as a structured array with fields 'r' and 'i'.
+    """
+    if blk.dtype.names is not None:
+        return np.stack((blk['r'],blk['i']),axis=-1).astype(np.int16,copy=False)
+    if not np.issubdtype(blk.dtype,np.integer):
+        raise ValueError('int16 precision needs integer IQ samples, channel holds {!s}'.format(blk.dtype))
+    return blk.astype(np.int16,copy=False)
+
+def iq_to_complex(iq,dtype=np.complex64):
+    """
+    Convert a window or block of stored IQ to complex for FFT/ACF processing.
+    int16 pairs (trailing axis of length 2) become I+jQ, complex input is cast without copying if possible.
+    """
+    if np.iscomplexobj(iq):
+        return iq.astype(dtype,copy=False)
+    out         = np.empty(iq.shape[:-1],dtype=dtype)
+    out.real    = iq[...,0]
+    out.imag    = iq[...,1]
+    return out
+
+def iter_grape_drf_blocks(do,channel,s_start,n_samples,sub_channel=None,chunk_samples=chunk_samples_default,
+        raw=False):
+    """
+    Lazily iterate over the recorded data between s_start and s_start+n_samples.
+
+    do:             digital_rf.DigitalRFReader
+    channel:        channel name, e.g. 'ch0'
+    s_start:        first sample index (samples since the epoch)
+    n_samples:      number of samples in the requested span
+    sub_channel:    index of a single subchannel (center frequency) to read, None for all
+    chunk_samples:  long continuous blocks are read in pieces no longer than this,
+                    so multi-day spans never sit in memory all at once
+    raw:            if True read the stored integers with read_vector_raw and yield int16 I,Q pairs
+                    instead of complex64
+
+    Yields (offset,data) where offset is the position of data[0] relative to s_start.
+    """
+    s_start = int(s_start)                        # scripts compute s_start from float hour offsets
+    s_stop  = s_start + int(n_samples)            # one past the last requested sample
+    blks    = do.get_continuous_blocks(s_start,s_stop-1,channel)
+    for sinx, nsamps in blks.items():
+        b0  = max(sinx,s_start)                   # clip each block to the requested span
+        b1  = min(sinx+nsamps,s_stop)
+        for c0 in range(b0,b1,chunk_samples):
+            n_read  = min(chunk_samples,b1-c0)
+            if raw:
+                data    = raw_to_pairs(do.read_vector_raw(c0,n_read,channel,sub_channel))
+            else:
+                data    = do.read_vector(c0,n_read,channel,sub_channel)
+            stage_metrics.count('samples_read',n_read)
+            yield c0-s_start, data
+
+def read_grape_drf_masked(do,channel,s_start,n_samples,sub_channel=None,precision='complex64',
+        chunk_samples=chunk_samples_default,max_samples=max_samples_default):
+    """
+    Assemble all continuous blocks in the span into one preallocated array.
+
+    precision:  'complex128', 'complex64' or 'int16', see the notes at the top of this module
+    max_samples: longer spans raise ValueError, process them block by block with iter_grape_drf_blocks
+                (or tile by tile, as spectrogram_pyramid.py does) instead. None for no limit.
+
+    Returns (data,valid):
+        data:   shape (n_samples,) if sub_channel is given or the channel has one subchannel,
+                otherwise (n_subchannels,n_samples) so each subchannel row is contiguous.
+                For 'int16' a trailing axis of length 2 holds the I,Q pair.
+                Samples inside gaps are zero.
+        valid:  boolean array of length n_samples, True where data was recorded.
+    """
+    if precision not in precision_dtypes:
+        raise ValueError('precision must be one of {!s}'.format(list(precision_dtypes)))
+    dtype       = precision_dtypes[precision]
+    raw         = precision == 'int16'
+    n_samples   = int(n_samples)
+    if max_samples is not None and n_samples > max_samples:
+        raise ValueError('{!s} samples requested, more than max_samples={!s}: iterate over the span with '
+                         'iter_grape_drf_blocks instead'.format(n_samples,max_samples))
+    props       = do.get_properties(channel)
+    n_sub       = props.get('num_subchannels',1)
+
+    if sub_channel is not None or n_sub == 1:
+        shape   = (n_samples,)
+    else:
+        shape   = (n_sub,n_samples)
+    if raw:
+        shape   = shape + (2,)
+    data    = np.zeros(shape,dtype=dtype)
+    valid   = np.zeros(n_samples,dtype=bool)
+    n_dims  = data.ndim - 1 if raw else data.ndim    # sample dimensions, not counting the I,Q axis
+
+    with stage_metrics.stage('read_iq'):
+        for offset, blk in iter_grape_drf_blocks(do,channel,s_start,n_samples,sub_channel,chunk_samples,raw):
+            n_read  = len(blk)
+            if raw and blk.ndim == 3:
+                blk = blk.transpose(1,0,2)                # (samples,subchannels,2) to (subchannels,samples,2)
+            elif not raw and blk.ndim == 2:
+                blk = blk.T
+            if n_dims == 1:
+                data[offset:offset+n_read]      = blk if blk.ndim == data.ndim else blk[0]
+            else:
+                data[:,offset:offset+n_read]    = blk
+            valid[offset:offset+n_read] = True
+
+    n_gap   = n_samples - np.count_nonzero(valid)
+    if n_gap > 0:
+        print("Data gaps: ",n_gap," of ",n_samples," samples missing, these windows will be skipped")
+    return data, valid
+
+def window_valid(valid,m_samples,step=None,n_windows=None):
+    """
+    Flag analysis windows that contain only recorded samples.
+
+    valid:      boolean mask from read_grape_drf_masked
+    m_samples:  samples per window (FFT segment or ACF ensemble)
+    step:       samples between window starts, defaults to m_samples (no overlap)
+    n_windows:  number of windows, defaults to as many as fit in valid
+
+    Returns boolean array of length n_windows, False if any sample of the window is in a gap
+    or falls beyond the end of the mask.
+    """
+    if step is None:
+        step = m_samples
+    if n_windows is None:
+        n_windows = max(0,(len(valid)-m_samples)//step+1)
+
+    n_bad   = np.concatenate(([0],np.cumsum(~valid)))    # running count of missing samples
+    starts  = np.arange(n_windows)*step
+    stops   = starts + m_samples
+    ok      = stops <= len(valid)
+    starts  = np.minimum(starts,len(valid))
+    stops   = np.minimum(stops,len(valid))
+    ok     &= (n_bad[stops]-n_bad[starts]) == 0
+    return ok
@@ -0,0 +1,118 @@
+# Module with the propagation mode heuristics of modefinder.py, so modefinder.py and benchmark.py classify with the same code
+# Modes are codified as 1E 2E 1F 2F 1Ehi 2Ehi 1Fhi 2Fhi for starters
+# Gwyn Griffiths G3ZIL, classification passes taken unchanged from modefinder.py
+
+import numpy as np
+import configparser
+import statistics
+
+def read_heuristics(heuristics_file):
+  """
+  The [propagation] settings of ./config/heuristics.ini as a dict.
+  """
+  config = configparser.ConfigParser()
+  config.read(heuristics_file)                # use a text editor to modify and add to the heuristics file
+  return {'min_apogee_E':config['propagation'].getint('min_apogee_E'),
+          'max_apogee_E':config['propagation'].getint('max_apogee_E'),
+          'min_apogee_F':config['propagation'].getint('min_apogee_F'),
+          'min_diff_h':config['propagation'].getint('min_hdashF-hF'),
+          'max_diff_h':config['propagation'].getint('max_hdashF-hF'),
+          'elev_diff_lo_hi':config['propagation'].getfloat('elev_diff_lo_hi'),
+          'sep_EloEhi':config['propagation'].getfloat('sep_EloEhi')}
+
+def classify_modes(path_data, time_str, heuristics):
+  """
+  Mode designator of each ray of a *pathfinder.csv file.
+
+  path_data:    the csv columns after the time, i.e. hops, initial elevation, virtual height, apogee, 2nd hop apogee, ...
+  time_str:     the time column as strings, rays of the same time step are adjacent
+  heuristics:   dict from read_heuristics
+
+  Returns a character array of designators, '' where no mode was assigned.
+  """
+  min_apogee_E=heuristics['min_apogee_E']
+  max_apogee_E=heuristics['max_apogee_E']
+  min_apogee_F=heuristics['min_apogee_F']
+  elev_diff_lo_hi=heuristics['elev_diff_lo_hi']
+  sep_EloEhi=heuristics['sep_EloEhi']
+
+  n_traces=len(time_str)                 # number of rows, time intervals, to process
+  p_mode=np.empty(n_traces, dtype='U5')  #  character array to hold mode designator
+  E_median=np.empty(n_traces)            # we'll calcuate 1E median initial elevation to help with 1E assignment
+
+  # Could be streamlined by using elif, but keep at its simplest for now
+  # Helps my clarity (!) of thought for each of the propagation modes
+  # First pass look for 1E
+  for i in range (0,n_traces):
+    if path_data[i,0] == 1:
+      if path_data[i,3] > min_apogee_E and path_data[i,3] < max_apogee_E:
+        p_mode[i] = '1E'
+
+  # Second pass look for 2E
+  for i in range (0,n_traces):
+    if path_data[i,0] == 2:
+      if path_data[i,3] > min_apogee_E and path_data[i,3] < max_apogee_E:
+        p_mode[i] = '2E'
+
+  # Third pass look for 1F
+  for i in range (0,n_traces):
+    if path_data[i,0] == 1:
+      if path_data[i,3] > min_apogee_F:
+        p_mode[i] = '1F'
+
+  # Fourth pass look for 2F
+  for i in range (0,n_traces):
+    if path_data[i,0] == 2:
+      if path_data[i,3] > min_apogee_F and path_data[i,4] > min_apogee_F:
+        p_mode[i] = '2F'
+
+  # Fifth pass look for 1F that are high rays
+  for i in range (0,n_traces):
+    if path_data[i,0] == 1:
+      if time_str[i] == time_str[i-1]:
+        if p_mode[i] == '1F' and p_mode[i-1] == '1F':
+          if (path_data[i,1]-path_data[i-1,1]) > elev_diff_lo_hi:
+            p_mode[i]='1Fhi'
+
+  # sixth pass look for 2F that are high rays
+  for i in range (0,n_traces):
+    if path_data[i,0] == 2:
+      if time_str[i] == time_str[i-1]:
+        if p_mode[i] == '2F' and p_mode[i-1] == '2F':
+          if (path_data[i,1]-path_data[i-1,1]) > elev_diff_lo_hi:
+            p_mode[i]='2Fhi'
+
+  # seventh pass look for 1E that are high rays
+  for i in range (0,n_traces):
+    if path_data[i,0] == 1:
+      if time_str[i] == time_str[i-1]:
+        if p_mode[i] == '1E' and p_mode[i-1] == '1E':
+          if (path_data[i,1]-path_data[i-1,1]) > elev_diff_lo_hi:
+            p_mode[i]='1Ehi'
+
+  # eighth pass look for 2E that are high rays
+  for i in range (0,n_traces):
+    if path_data[i,0] == 2:
+      if time_str[i] == time_str[i-1]:
+        if p_mode[i] == '2E' and p_mode[i-1] == '2E':
+          if (path_data[i,1]-path_data[i-1,1]) > elev_diff_lo_hi:
+            p_mode[i]='2Ehi'
+
+  # ninth pass reassess 1E rays for being high high rays, where sep_EloEhi is from the heuristics file and can be set there
+  # Some 1Ehi misclassified as 1E because there was no normal (low) 1E at that time
+  # Form the median initial elevation for those classified as 1E (inc those actually 1Ehi)
+  # and check if elevation > median+x, if so, reclassify as 1Ehi
+  index=0                         # calculate median only for mode = 1E
+  for i in range (0,n_traces):
+    if path_data[i,0] == 1:
+      if p_mode[i] == '1E':
+       E_median[index]=path_data[i,1]
+       index=index+1
+  if np.min(E_median) > min_apogee_E:
+    e_median=statistics.median(E_median[0:index-1])
+    for i in range (0,n_traces):
+      if path_data[i,0] == 1:
+        if p_mode[i] == '1E' and path_data[i,1] > (e_median+sep_EloEhi):
+          p_mode[i]='1Ehi'
+          #print("corrected 1E to 1Ehi at ", time_str[i])
+  return p_mode
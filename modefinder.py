@@ -18,14 +18,18 @@ import sys
 import os
 import configparser
 from datetime import datetime
-import statistics
 import pylab as plt
 import matplotlib.patches as mpatches
 import matplotlib.dates as mdates
 import matplotlib.units as munits
 
+import mode_heuristics             # module in this directory, the propagation mode classification passes
+import stage_metrics               # module in this directory, stage timing, counters and peak memory
+
 callsign = sys.argv[1]                     # callsign for subdirectory name
 csv_in_file = sys.argv[2]                  # *pathfinder.csv file   
+stage_metrics.start('modefinder')          # stage times and counts to ./output/profiles at exit
+stage_metrics.mark('read')
 
 # Set up arrays etc
 
@@ -43,20 +47,17 @@ if not os.path.exists(plot_dir):
   os.makedirs(plot_dir)
 
 # Read in heuristics file, which is general not path or frequency specific
-config = configparser.ConfigParser()
-config.read(heuristics_file)                # use a text editor to modify and add to the heuristics file 
-
-min_apogee_E=config['propagation'].getint('min_apogee_E')
-max_apogee_E=config['propagation'].getint('max_apogee_E')
-min_apogee_F=config['propagation'].getint('min_apogee_F')
-min_diff_h=config['propagation'].getint('min_hdashF-hF')
-max_diff_h=config['propagation'].getint('max_hdashF-hF')
-elev_diff_lo_hi=config['propagation'].getfloat('elev_diff_lo_hi')
-sep_EloEhi=config['propagation'].getfloat('sep_EloEhi')
+heuristics=mode_heuristics.read_heuristics(heuristics_file)   # use a text editor to modify and add to the heuristics file
+min_apogee_E=heuristics['min_apogee_E']
+max_apogee_E=heuristics['max_apogee_E']
+min_apogee_F=heuristics['min_apogee_F']
 
 # Read frequency in MHz, tx callsign and plot parameters from the specific config.ini file
+config = configparser.ConfigParser()
 config.read(config_file)
 freq=config['settings'].getfloat('freq')
+if csv_in_file.endswith('MHz'):               # file from pathfinder.py multi-frequency mode, e.g. 202407260000_10.0MHz
+  freq=float(csv_in_file.split('_')[-1][:-3])
 tx=config['metadata'].get('tx')
 legend_loc=config['plots'].get('legend')
 
@@ -87,87 +88,12 @@ for i in range(0,len(time_str)):
 ##############################################
 
 # Setup arrays
+stage_metrics.mark('classify')
 n_traces=len(time_str)                 # number of rows, time intervals, to process
-
-p_mode=np.empty(n_traces, dtype='U5')  #  character array to hold mode designator
 color=np.empty(n_traces,dtype='U10')   # character array to hold a color name for each and every elevaltion spot
-E_median=np.empty(n_traces)                  # we'll calcuate 1E median initial elevation to help with 1E assignment
-
-# Could be streamlined by using elif, but keep at its simplest for now
-# Helps my clarity (!) of thought for each of the propagation modes 
-# First pass look for 1E
-for i in range (0,n_traces):
-  if path_data[i,0] == 1:
-    if path_data[i,3] > min_apogee_E and path_data[i,3] < max_apogee_E:
-      p_mode[i] = '1E'
-
-# Second pass look for 2E
-for i in range (0,n_traces):
-  if path_data[i,0] == 2:
-    if path_data[i,3] > min_apogee_E and path_data[i,3] < max_apogee_E:
-      p_mode[i] = '2E'
 
-# Third pass look for 1F
-for i in range (0,n_traces):
-  if path_data[i,0] == 1:
-    if path_data[i,3] > min_apogee_F:
-      p_mode[i] = '1F'
-
-# Fourth pass look for 2F
-for i in range (0,n_traces):
-  if path_data[i,0] == 2:
-    if path_data[i,3] > min_apogee_F and path_data[i,4] > min_apogee_F:
-      p_mode[i] = '2F'
-
-# Fifth pass look for 1F that are high rays
-for i in range (0,n_traces):
-  if path_data[i,0] == 1:
-    if time_str[i] == time_str[i-1]:
-      if p_mode[i] == '1F' and p_mode[i-1] == '1F':
-        if (path_data[i,1]-path_data[i-1,1]) > elev_diff_lo_hi:
-          p_mode[i]='1Fhi'
-
-# sixth pass look for 2F that are high rays
-for i in range (0,n_traces):
-  if path_data[i,0] == 2:
-    if time_str[i] == time_str[i-1]:
-      if p_mode[i] == '2F' and p_mode[i-1] == '2F':
-        if (path_data[i,1]-path_data[i-1,1]) > elev_diff_lo_hi:
-          p_mode[i]='2Fhi'
-
-# seventh pass look for 1E that are high rays
-for i in range (0,n_traces):
-  if path_data[i,0] == 1:
-    if time_str[i] == time_str[i-1]:
-      if p_mode[i] == '1E' and p_mode[i-1] == '1E':
-        if (path_data[i,1]-path_data[i-1,1]) > elev_diff_lo_hi:
-          p_mode[i]='1Ehi'
-
-# eighth pass look for 2E that are high rays
-for i in range (0,n_traces):
-  if path_data[i,0] == 2:
-    if time_str[i] == time_str[i-1]:
-      if p_mode[i] == '2E' and p_mode[i-1] == '2E':
-        if (path_data[i,1]-path_data[i-1,1]) > elev_diff_lo_hi:
-          p_mode[i]='2Ehi'
-
-# ninth pass reassess 1E rays for being high high rays, where sep_EloEhi is from the heuristics file and can be set there
-# Some 1Ehi misclassified as 1E because there was no normal (low) 1E at that time
-# Form the median initial elevation for those classified as 1E (inc those actually 1Ehi)
-# and check if elevation > median+x, if so, reclassify as 1Ehi
-index=0                         # calculate median only for mode = 1E
-for i in range (0,n_traces):
-  if path_data[i,0] == 1:
-    if p_mode[i] == '1E':
-     E_median[index]=path_data[i,1]
-     index=index+1
-if np.min(E_median) > min_apogee_E:
-  e_median=statistics.median(E_median[0:index-1])
-  for i in range (0,n_traces):
-    if path_data[i,0] == 1:
-      if p_mode[i] == '1E' and path_data[i,1] > (e_median+sep_EloEhi):
-        p_mode[i]='1Ehi'
-        #print("corrected 1E to 1Ehi at ", time_str[i])
+# The classification passes are in mode_heuristics.py
+p_mode=mode_heuristics.classify_modes(path_data, time_str, heuristics)
 
 print("Assignment to modes completed")
 #for i in range (0,n_traces): 
@@ -200,6 +126,7 @@ for i in range (0,n_traces):
   else:
     color[i]='r'
 
+stage_metrics.mark('plot')
 fig, ax = plt.subplots()     
 plt.suptitle("Initial elevation of " + str(freq) +" MHz rays leaving " + tx + " arriving at " + callsign, fontsize=12)
 
@@ -243,10 +170,12 @@ plt.legend(handles=[black_patch, blue_patch, green_patch, purple_patch, grey_pat
 # save and show the elevation figure
 plt.savefig(plot_dir + "/" + csv_in_file + "_apogee.png", dpi=600)
 
+stage_metrics.mark(None)                   # the time the plot windows are open is not counted
 plt.show()
 print("Plots generated and saved")
 
 # output the original data plus classification and color into file *_modefinder.csv in ./output/csv/callsign dir
+stage_metrics.mark('write')
 with open(csv_out_name, 'w', encoding='UTF8',) as out_file:     # open a csv file for write
   writer=csv.writer(out_file)
   writer.writerow(["Date,Hops,p_mode,color,Init_elev,one_hop_virt_ht,one_hop_apogee,2nd hop apogee,gnd_range,phase_path,geo_path,pylap_doppler"])
@@ -254,5 +183,6 @@ with open(csv_out_name, 'w', encoding='UTF8',) as out_file:     # open a csv fil
   for i in range (0,n_traces):
     writer.writerow([time_str[i], path_data[i,0], p_mode[i], color[i],path_data[i,1], path_data[i,2], path_data[i,3],\
        path_data[i,4], path_data[i,5], path_data[i,6], path_data[i,7], path_data[i,8]])
+  stage_metrics.count('rows_written',n_traces)
 
 print("modefinder csv file  written")
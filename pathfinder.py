@@ -39,20 +39,26 @@
 #---------------------------------------------------------------
 #    V2.0 G Griffiths in this pathfinder form. September- 2025
 #    Takes two command line arguments name of callsign_config.ini file in config subdirectory and a datetime for the csv filename as YYYYMMDDHHMM
+#    An optional third argument sweep, given by pathfinder.sh, saves the UT+5 min ionosphere so the next 5 minute step
+#    reuses it as its base ionosphere and computes only one new IRI grid
+#    An optional --ut YYYYMMDDHHMM gives the UT of this step in place of ut in the config file, which is only read.
+#    The path distance and bearing go to the run record in ./output/runs, see run_spec.py
 #---------------------------------------------------------------
 
 import numpy as np  # py
 import time
+import json
 import ctypes as c
 import os 
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
 import csv                         # to write csv file for plotting and comparison in Excel
 import maidenhead as mh            # locators to lat lon, hence distance and bearing
-from pathlib import Path
 
-import configparser
 import ast
+import run_spec                    # module in this directory, read only config and per run output records
+import raytrace_backend            # module in this directory, PyLap or its analytic stand-in
+import stage_metrics               # module in this directory, stage timing, counters and peak memory
 
 from geographiclib.geodesic import Geodesic 
 from scipy import signal
@@ -66,30 +72,6 @@ faulthandler.enable()
 # PyLap array indexing for second hop data not right, or I have not understood. I have workaround
 ##################################################################################################
 
-################################################################
-# add the paths for pylap as  we are likely in a protected environment 
-pylappath=str(os.environ['PYTHONPATH'])    # this requirement to add to path easy to do
-                                           # Not so easy for the directory pylap-0.1.0a0-py3.12-linux-x86_64.egg
-def find_dir_path(name, start_path='.'):
-    """Recursively finds the first directory matching a given name."""
-    start_dir = Path(start_path)
-    for path in start_dir.rglob(name):
-       if path.is_dir():
-            return path.resolve() # .resolve() returns the absolute path
-    return None
-
-userid=str(os.getlogin())
-pylapeggpath = str(find_dir_path('pylap-0.1.0a0-py3.12-linux-x86_64.egg','/home/'+userid+'/.local/'))
-#print(pylapeggpath)
-
-sys.path.insert(0,pylappath)   # these two additions to search path needed as in ext managed environment
-sys.path.insert(0, pylapeggpath)
-#################################################################
-# The PyLap part
-#################################################################
-from pylap.raytrace_2d import raytrace_2d 
-from Ionosphere import gen_iono_grid_2d as gen_iono
-
 #-----------------------------------------------------------------------------
 # Data processing functions
 #
@@ -109,20 +91,41 @@ def findLocalPeak (index, radius, proximity):
 def remove_adjacent(L):
   return [elem for i, elem in enumerate(L) if i == 0 or L[i-1]+1 != elem]
 
+# Ionosphere carried between time steps of a sweep. The UT+5 min grid of step k is the UT grid of step k+1, so it is
+# saved with a key of everything the IRI grid depends on, and only reused if the key of the next step matches exactly
+def iono_key(ut, grid_parms):
+  return json.dumps({'ut':[int(x) for x in ut], 'grid':grid_parms}, sort_keys=True)
+
+def load_iono_carry(cache_file, key):
+  # Returns (iono_pf_grid, collision_freq, irreg, iono_te_grid) saved by the previous step, or None
+  if not os.path.exists(cache_file):
+    return None
+  with np.load(cache_file, allow_pickle=False) as npz:
+    if str(npz['key']) != key:
+      return None
+    return npz['iono_pf_grid'], npz['collision_freq'], npz['irreg'], npz['iono_te_grid']
+
+def save_iono_carry(cache_file, key, iono_pf_grid, collision_freq, irreg, iono_te_grid):
+  np.savez(cache_file, key=key, iono_pf_grid=iono_pf_grid, collision_freq=collision_freq, irreg=irreg,
+           iono_te_grid=iono_te_grid)
+
 #------------------------------------------------------------------------------
 # Read in configuration from a *_config.ini  got from the first command line parameter
 #
 config_file = sys.argv[1]                  # filename from calling script is prefix_config.ini where prefix could be callsign   
-callsign=str(config_file.split('_')[0])    # extract callsign to use for subdirectory of output/csv csv, str to convery list item, here 1st, to string var
-callsign=callsign.split("/",2)[2]
+file_time=sys.argv[2]  # this is date time in form YYYYMMDDHHMM for prefix to csv file name
+sweep_flag = 'sweep' in sys.argv[3:]       # carry UT+5 min ionosphere forward to the next step
+stage_metrics.start('pathfinder')          # stage times and counts to ./output/profiles at exit
+stage_metrics.mark('setup')
 
 # set up base directory, and the directory path for config file 
 base_directory='./'
 
-config = configparser.ConfigParser()
-config.read(config_file)           # the accompanying bash script will update this file for successive runs of this python script 
+config = run_spec.load(config_file, sys.argv, file_time)   # read only, UT from --ut if the bash script gives it
+callsign=config.callsign                   # callsign to use for subdirectory of output/csv
+tracer=raytrace_backend.from_config(config) # PyLap unless raytracer = analytic in [settings]
 
-UT=ast.literal_eval(config.get('settings','ut'))  # The parameters for PyLap, 'get' by itself returns text
+UT=list(config.ut)                         # The parameters for PyLap
 R12=config['settings'].getint('r12')
 freq=config['settings'].getfloat('freq')
 nhops=config['settings'].getint('nhops')
@@ -133,8 +136,6 @@ rx_grid=config['settings'].get('rx_grid')
 elev_start=config['settings'].getfloat('elev_start')
 elev_stop=config['settings'].getfloat('elev_stop')
 
-file_time=sys.argv[2]  # this is date time in form YYYYMMDDHHMM for prefix to csv file name
-
 ###################################################
 # Consequentials
 elev_inc = 0.005               # set to 0.005 degrees, we are not plotting, and need to get consistently close to same distance tx-rx
@@ -142,7 +143,16 @@ elevs = np.arange(elev_start, elev_stop, elev_inc, dtype = float)
 num_elevs = len(elevs)
 proximity=np.empty(num_elevs)
 
-freqs = freq * np.ones(num_elevs, dtype = float) 
+# Multi-frequency mode: an optional freqs = [5, 10, 15] list in the config traces all frequencies as one combined fan
+# against the same ionosphere, i.e. one IRI cost for every subchannel of a station, with a csv file per frequency
+if config.has_option('settings','freqs'):
+  freq_list=[float(f) for f in ast.literal_eval(config.get('settings','freqs'))]
+  multi_freq_flag=True
+else:
+  freq_list=[freq]
+  multi_freq_flag=False
+fan_elevs = np.tile(elevs, len(freq_list))                               # elevation sweep repeated for each frequency
+fan_freqs = np.repeat(np.array(freq_list, dtype = float), num_elevs)     # with the matching frequency for each ray
 
 origin_lat,origin_long=mh.to_location(tx_grid, center=True)   # convert 6 char Maidenhead to centre of box lat long
 rx_lat,rx_long=mh.to_location(rx_grid, center=True)
@@ -154,10 +164,8 @@ print("tx at: ",round(origin_lat,2), "˚N ",round(origin_long,2), "˚E")
 print("rx at: ",rx_lat, "˚N ",rx_long, "˚E")
 print("rx at distance: ",round(distance,3), " km and initial bearing: ",round(ray_bear,1))
 
-# update the config file with the calculated distance 
-config.set('settings', 'distance', str(round(distance,3)))
-with open(config_file, 'w') as configfile:
-    config.write(configfile)
+# record the calculated distance for this run, the config file is not changed
+run_spec.write_record(config, 'pathfinder', {'distance':round(distance,3), 'bearing':round(ray_bear,1)})
 
 # constants and rarely set options
 speed_of_light = 2.99792458e8
@@ -195,86 +203,133 @@ iri_options = {
             #    'hmF2':5.0
               }   # py
 
-with open(output_dir+'/'+file_time+'_pathfinder.csv', 'a', encoding='UTF8',) as out_file:     # open a csv file for write
-  writer=csv.writer(out_file)
-  if os.path.getsize(output_dir+'/'+file_time+'_pathfinder.csv') == 0:    # If size zero, new file, so write header
-    writer.writerow(["Date, Hops, Init_elev, one_hop_virt_ht, one_hop_apogee, 2nd hop apogee, gnd_range, phase_path, geo_path, pylap_doppler"])
-
-  date=datetime(UT[0],UT[1],UT[2],UT[3],UT[4])
-  print ("Ray trace for time: ", date)
+date=datetime(UT[0],UT[1],UT[2],UT[3],UT[4])
+print ("Ray trace for time: ", date)
 
 # Generate an ionosphere IRI2016
+stage_metrics.mark(None)                   # the grid and trace calls are the iono and raytrace stages of raytrace_backend.py
+if not sweep_flag:
   iono_pf_grid, iono_pf_grid_5, collision_freq, irreg, iono_te_grid = \
-    gen_iono.gen_iono_grid_2d(origin_lat, origin_long, R12, UT, ray_bear,
+    tracer.gen_iono_grid_2d(origin_lat, origin_long, R12, UT, ray_bear,
            max_range, num_range, range_inc, start_height,
-	     height_inc, num_heights, kp, doppler_flag, 'iri2016',
-		  iri_options)
+	       height_inc, num_heights, kp, doppler_flag, 'iri2016',
+		    iri_options)
+else:
+# Time sweep: the base grid at UT is the UT+5 min grid of the previous step if it was saved, so only UT+5 is new.
+# Each grid is generated with doppler_flag 0 so IRI runs once per call
+  grid_parms = [round(origin_lat,6), round(origin_long,6), R12, round(ray_bear,6), max_range, num_range,
+                start_height, height_inc, num_heights, kp, iri_options, tracer.name]
+  iono_cache_dir = os.path.join(base_directory,'output','iono_cache',callsign)
+  if not os.path.exists(iono_cache_dir):
+    os.makedirs(iono_cache_dir)
+  iono_cache_file = os.path.join(iono_cache_dir,file_time+'_pathfinder_iono_carry.npz')   # one per sweep
+  UT_5 = list((datetime(*UT) + timedelta(minutes=5)).timetuple()[0:5])
+
+  with stage_metrics.stage('iono_carry'):
+    carried = load_iono_carry(iono_cache_file, iono_key(UT, grid_parms))
+  if carried is not None:
+    print("Reusing UT+5 min ionosphere from previous time step")
+    iono_pf_grid, collision_freq, irreg, iono_te_grid = carried
+  else:
+    iono_pf_grid, unused_grid_5, collision_freq, irreg, iono_te_grid = \
+      tracer.gen_iono_grid_2d(origin_lat, origin_long, R12, UT, ray_bear,
+             max_range, num_range, range_inc, start_height,
+	         height_inc, num_heights, kp, 0, 'iri2016',
+		      iri_options)
+
+  iono_pf_grid_5, unused_grid_5, collision_freq_5, irreg_5, iono_te_grid_5 = \
+    tracer.gen_iono_grid_2d(origin_lat, origin_long, R12, UT_5, ray_bear,
+           max_range, num_range, range_inc, start_height,
+	       height_inc, num_heights, kp, 0, 'iri2016',
+		    iri_options)
+  with stage_metrics.stage('iono_carry'):
+    save_iono_carry(iono_cache_file, iono_key(UT_5, grid_parms), iono_pf_grid_5, collision_freq_5, irreg_5, iono_te_grid_5)
 
 #M convert plasma frequency grid to  electron density in electrons/cm^3
-  iono_en_grid = (iono_pf_grid ** 2) / 80.6164e-6
-  iono_en_grid_5 = (iono_pf_grid_5 ** 2) / 80.6164e-6
+iono_en_grid = (iono_pf_grid ** 2) / 80.6164e-6
+iono_en_grid_5 = (iono_pf_grid_5 ** 2) / 80.6164e-6
 
-  #print('Generating {} 2D NRT rays ...'.format(num_elevs))
+#print('Generating {} 2D NRT rays ...'.format(len(fan_elevs)))
 
-  ray_data, ray_path_data, ray_path_state = \
-     raytrace_2d(origin_lat, origin_long, elevs, ray_bear, freqs, nhops,
-         tol, irregs_flag, iono_en_grid, iono_en_grid_5,
+ray_data, ray_path_data, ray_path_state = \
+   tracer.raytrace_2d(origin_lat, origin_long, fan_elevs, ray_bear, fan_freqs, nhops,
+       tol, irregs_flag, iono_en_grid, iono_en_grid_5,
  	    collision_freq, start_height, height_inc, range_inc, irreg)
 
+#-----------------------------------------------------
+# Split the combined fan back into one fan of num_elevs rays per frequency, each to its own csv file
+#-----------------------------------------------------
+stage_metrics.mark('find_modes')
+for freq_inx in range(0, len(freq_list)):
+  freq=freq_list[freq_inx]
+  fan_data=ray_data[freq_inx*num_elevs:(freq_inx+1)*num_elevs]
+  fan_path_data=ray_path_data[freq_inx*num_elevs:(freq_inx+1)*num_elevs]
+  if multi_freq_flag:
+    csv_name=output_dir+'/'+file_time+'_'+str(freq)+'MHz_pathfinder.csv'    # e.g. 202407260000_10.0MHz_pathfinder.csv
+  else:
+    csv_name=output_dir+'/'+file_time+'_pathfinder.csv'
+
+  with open(csv_name, 'a', encoding='UTF8',) as out_file:     # open a csv file for write
+    writer=csv.writer(out_file)
+    if os.path.getsize(csv_name) == 0:    # If size zero, new file, so write header
+      writer.writerow(["Date, Hops, Init_elev, one_hop_virt_ht, one_hop_apogee, 2nd hop apogee, gnd_range, phase_path, geo_path, pylap_doppler"])
+
 #-----------------------------------------------------
 # Output: No ray trace plot but text and csv file with one ray tx->rx for up to four modes - one-hop E, two-hop E, one hop F and two-hop F
 #-----------------------------------------------------
 #
-  for rayId in range(0, num_elevs):     # generate a proximity array, larger value closest to exact distance, hence shows as peaks 
-    proximity[rayId]=(1/(abs(ray_data[rayId]['ground_range'][0] - distance)))
+    for rayId in range(0, num_elevs):     # generate a proximity array, larger value closest to exact distance, hence shows as peaks 
+      proximity[rayId]=(1/(abs(fan_data[rayId]['ground_range'][0] - distance)))
 	  
 # Use Continuous Wavelet Transform method for finding peaks in the proximity metric with ray elevation 
-  raw_peaks = signal.find_peaks_cwt(proximity, widths=np.arange(1,8))  # 1,4 empirical selection, peaks look to be sharp
-  peaks=remove_adjacent(raw_peaks)   # Sometime the CWF can output adjacent values for a sigle peak, so remove in the called function
-
-  prev_rayId_min=0                        # avoid curious happening of twice with same rayID
-
-  for i in range(0,len(peaks)):           # this can be a long array of small peaks at excessive proximities 
-    if proximity[peaks[i]] >1/distance_margin:        # 1 divided by distance_margin, will find one peak for a mode at required range
-      rayId_min=findLocalPeak(peaks[i],3,proximity)
-      if rayId_min != prev_rayId_min:                 # extract the data from the PyLap arrays and round to suitable resolution for output
-        initial_elev=round(ray_data[rayId_min]['initial_elev'][0],3)
-        virtual_height=round(ray_data[rayId_min]['virtual_height'][0],3)
-        apogee=round(ray_data[rayId_min]['apogee'][0],3)
-        ground_range=round(ray_data[rayId_min]['ground_range'][0],3)
-        phase_path=round(ray_data[rayId_min]['phase_path'][0],3)
-        geometric_path=round(ray_data[rayId_min]['geometric_path_length'][0],3)
-        pylap_doppler=round(ray_data[rayId_min]['Doppler_shift'][0],3)
-
-     #print (initial_elev, virtual_height, apogee, NaN, ground_range, phase_path, geometric_path, doppler_shift)
-        if not np.isnan(virtual_height):      # This is one hop loop, so if virt height is a nan there is no valid data
-          writer.writerow([date, "1", initial_elev, virtual_height, apogee, NaN, ground_range, phase_path, geometric_path, pylap_doppler])
-        prev_rayId_min=rayId_min
+    raw_peaks = signal.find_peaks_cwt(proximity, widths=np.arange(1,8))  # 1,4 empirical selection, peaks look to be sharp
+    peaks=remove_adjacent(raw_peaks)   # Sometime the CWF can output adjacent values for a sigle peak, so remove in the called function
+
+    prev_rayId_min=0                        # avoid curious happening of twice with same rayID
+
+    for i in range(0,len(peaks)):           # this can be a long array of small peaks at excessive proximities 
+      if proximity[peaks[i]] >1/distance_margin:        # 1 divided by distance_margin, will find one peak for a mode at required range
+        rayId_min=findLocalPeak(peaks[i],3,proximity)
+        if rayId_min != prev_rayId_min:                 # extract the data from the PyLap arrays and round to suitable resolution for output
+          initial_elev=round(fan_data[rayId_min]['initial_elev'][0],3)
+          virtual_height=round(fan_data[rayId_min]['virtual_height'][0],3)
+          apogee=round(fan_data[rayId_min]['apogee'][0],3)
+          ground_range=round(fan_data[rayId_min]['ground_range'][0],3)
+          phase_path=round(fan_data[rayId_min]['phase_path'][0],3)
+          geometric_path=round(fan_data[rayId_min]['geometric_path_length'][0],3)
+          pylap_doppler=round(fan_data[rayId_min]['Doppler_shift'][0],3)
+
+       #print (initial_elev, virtual_height, apogee, NaN, ground_range, phase_path, geometric_path, doppler_shift)
+          if not np.isnan(virtual_height):      # This is one hop loop, so if virt height is a nan there is no valid data
+            writer.writerow([date, "1", initial_elev, virtual_height, apogee, NaN, ground_range, phase_path, geometric_path, pylap_doppler])
+            stage_metrics.count('rows_written')
+          prev_rayId_min=rayId_min
 
 #  Now for the second hop
-  prev_rayId_min=0                        # avoid curious happening of twice with same rayID
-
-  for rayId in range(0, num_elevs):   # generate a proximity array, larger value closest to exact distance, hence shows as peaks 
-    proximity[rayId]=(1/(abs(ray_path_data[rayId]['ground_range'][-1] - distance)))
-
-  raw_peaks = signal.find_peaks_cwt(proximity, widths=np.arange(3,8))  # 3,8 empirical selection, two hop peaks wider
-  peaks=remove_adjacent(raw_peaks)   #
-
-  for i in range(0,len(peaks)):         # this can be a long array of small peaks at excessive proximities 
-    if proximity[peaks[i]] >1/distance_margin:        # 1 divided by distance_margin, will find one peak for a mode at required range
-      rayId_min=findLocalPeak(peaks[i],3,proximity)
-      if rayId_min != prev_rayId_min:
-        idx_max=len(ray_path_data[rayId_min]['height'])
-        idx_min=int(idx_max/2)
-        second_hop_apogee=round(np.max(ray_path_data[rayId_min]['height'][idx_min:idx_max]),3)
-        # Getting the second hop data this way of indexing works, there is somethink quirky in PyLap that needs to be checked.
-        initial_elev=round(ray_data[rayId_min]['initial_elev'][0],3)
-        virtual_height=round(ray_data[rayId_min]['virtual_height'][0],3)
-        apogee=round(ray_data[rayId_min]['apogee'][0],3)
-        ground_range=round(ray_path_data[rayId_min]['ground_range'][-1],3)
-        phase_path=round(ray_path_data[rayId_min]['phase_path'][-1],3)
-        geometric_path=round(ray_path_data[rayId_min]['geometric_distance'][-1],3)
-        pylap_doppler=round(ray_data[rayId_min]['Doppler_shift'][0],3)
+    prev_rayId_min=0                        # avoid curious happening of twice with same rayID
+
+    for rayId in range(0, num_elevs):   # generate a proximity array, larger value closest to exact distance, hence shows as peaks 
+      proximity[rayId]=(1/(abs(fan_path_data[rayId]['ground_range'][-1] - distance)))
+
+    raw_peaks = signal.find_peaks_cwt(proximity, widths=np.arange(3,8))  # 3,8 empirical selection, two hop peaks wider
+    peaks=remove_adjacent(raw_peaks)   #
+
+    for i in range(0,len(peaks)):         # this can be a long array of small peaks at excessive proximities 
+      if proximity[peaks[i]] >1/distance_margin:        # 1 divided by distance_margin, will find one peak for a mode at required range
+        rayId_min=findLocalPeak(peaks[i],3,proximity)
+        if rayId_min != prev_rayId_min:
+          idx_max=len(fan_path_data[rayId_min]['height'])
+          idx_min=int(idx_max/2)
+          second_hop_apogee=round(np.max(fan_path_data[rayId_min]['height'][idx_min:idx_max]),3)
+          # Getting the second hop data this way of indexing works, there is somethink quirky in PyLap that needs to be checked.
+          initial_elev=round(fan_data[rayId_min]['initial_elev'][0],3)
+          virtual_height=round(fan_data[rayId_min]['virtual_height'][0],3)
+          apogee=round(fan_data[rayId_min]['apogee'][0],3)
+          ground_range=round(fan_path_data[rayId_min]['ground_range'][-1],3)
+          phase_path=round(fan_path_data[rayId_min]['phase_path'][-1],3)
+          geometric_path=round(fan_path_data[rayId_min]['geometric_distance'][-1],3)
+          pylap_doppler=round(fan_data[rayId_min]['Doppler_shift'][0],3)
         
-        if second_hop_apogee < 580:        # seems that it is possible for a spurious apogee for rays that escape and do not land
-          writer.writerow([date, "2", initial_elev, NaN, apogee, second_hop_apogee, ground_range, phase_path, geometric_path, pylap_doppler]) 
+          if second_hop_apogee < 580:        # seems that it is possible for a spurious apogee for rays that escape and do not land
+            writer.writerow([date, "2", initial_elev, NaN, apogee, second_hop_apogee, ground_range, phase_path, geometric_path, pylap_doppler])
+            stage_metrics.count('rows_written') 
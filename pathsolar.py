@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#  Name pathsolar.py
+#
+# Purpose : To take the output csv file from modefinder.py (or pathfinder.py) of rays landing at the receiver and add,
+#           for every ray, the eclipse obscuration and solar zenith angle at its reflection point(s) at apogee height,
+#           so Doppler features can be compared with the obscuration each path actually saw rather than that at the receiver.
+#           A one hop ray is taken to reflect at the midpoint of its ground range along the tx to rx great circle, a two hop
+#           ray at one quarter and three quarters, at one_hop_apogee and 2nd hop apogee respectively.
+#           All rows are computed at once with eclipse_calc.obscuration_at, which calls astropy for the Sun and Moon once per
+#           distinct time (288 for a day of 5 minute steps) and does the rest in numpy, so a whole day of all modes takes seconds.
+#           Two command line arguments, the callsign subdirectory designator and the csv file prefix, e.g. 202404081500,
+#           with an optional third, pathfinder, to annotate the *_pathfinder.csv file rather than *_modefinder.csv
+#           Outputs the input columns plus the solar columns to *_pathsolar.csv in ./output/csv/callsign/
+#    For use with HamSCI PSWS analysis.
+
+import numpy as np
+import csv
+import sys
+import os
+from datetime import datetime
+
+import run_spec                    # module in this directory, read only config and tx rx geometry
+import stage_metrics               # module in this directory, stage timing, counters and peak memory
+from eclipse_calc import geodesy   # batch WGS84 geodesics
+from eclipse_calc.eclipse_calc import obscuration_at    # obscuration and solar zenith angle at many times and places
+
+callsign = sys.argv[1]                     # callsign for subdirectory name
+csv_in_file = sys.argv[2]                  # csv file prefix
+source = 'pathfinder' if 'pathfinder' in sys.argv[3:] else 'modefinder'
+stage_metrics.start('pathsolar')           # stage times and counts to ./output/profiles at exit
+stage_metrics.mark('read')
+
+# set up base directory, and paths for csv in/out and config file
+base_directory='./'
+csv_dir=os.path.join(base_directory,'output','csv',callsign)
+config_dir=os.path.join(base_directory,'config')
+csv_in_name=csv_dir + '/' + csv_in_file + '_' + source + '.csv'
+csv_out_name=csv_dir + '/' + csv_in_file + '_pathsolar.csv'
+config_file=config_dir + '/' + callsign + '_config.ini'
+
+config = run_spec.load(config_file)
+geometry=run_spec.path_geometry(config)    # tx and rx positions and the bearing, as used by pathfinder.py
+
+# Read the csv, the header is written by pathfinder.py and modefinder.py as one quoted field, so split it on commas
+with open(csv_in_name) as csvfile:
+  reader = csv.reader(csvfile)
+  header = [name.strip() for name in ','.join(next(reader)).split(',')]
+  rows = [row for row in reader if row]
+n_rows=len(rows)
+print("Read", n_rows, "rays from", csv_in_name)
+
+column = {name:i for i,name in enumerate(header)}
+date = np.array([datetime.strptime(row[column['Date']], '%Y-%m-%d %H:%M:%S') for row in rows], dtype='datetime64[s]')
+hops = np.array([float(row[column['Hops']]) for row in rows])
+gnd_range = np.array([float(row[column['gnd_range']]) for row in rows])
+apogee = np.array([[float(row[column['one_hop_apogee']]), float(row[column['2nd hop apogee']])] for row in rows])
+apogee = apogee.reshape(n_rows, 2)
+
+# Reflection points along the great circle: one hop at 1/2 of the ground range, two hop at 1/4 and 3/4
+stage_metrics.mark('geometry')
+fraction = np.where(hops[:,None] == 1, [[0.5, np.nan]], [[0.25, 0.75]])
+refl_lat, refl_lon, _ = geodesy.direct(geometry['tx_lat'], geometry['tx_lon'], geometry['bearing'],
+                                       gnd_range[:,None]*fraction)
+refl_height = np.where(hops[:,None] == 1, apogee*[[1, np.nan]], apogee)
+valid = np.isfinite(refl_lat) & np.isfinite(refl_height)
+
+# Obscuration and solar zenith angle at the reflection points, and at the receiver on the ground for comparison
+stage_metrics.mark('obscuration')
+refl = obscuration_at(np.repeat(date[:,None], 2, axis=1)[valid], refl_lat[valid], refl_lon[valid], refl_height[valid])
+refl_obsc = np.full((n_rows, 2), np.nan)
+refl_sza = np.full((n_rows, 2), np.nan)
+refl_obsc[valid] = refl['obsc']
+refl_sza[valid] = refl['solar_zenith_deg']
+rx = obscuration_at(date, geometry['rx_lat'], geometry['rx_lon'])
+path_obsc = np.nanmean(refl_obsc, axis=1) if n_rows else np.empty(0)   # mean over the reflection points of the ray
+print("Obscuration computed at", np.count_nonzero(valid), "reflection points of", n_rows, "rays")
+
+# output the original data plus the solar columns into file *_pathsolar.csv in ./output/csv/callsign dir
+stage_metrics.mark('write')
+solar_header = ['refl1_lat','refl1_lon','refl1_ht','refl1_obsc','refl1_sza','refl2_lat','refl2_lon','refl2_ht','refl2_obsc',
+                'refl2_sza','path_obsc','rx_obsc','rx_sza']
+with open(csv_out_name, 'w', encoding='UTF8',) as out_file:     # open a csv file for write
+  writer=csv.writer(out_file)
+  writer.writerow([','.join(header + solar_header)])
+
+  for i in range (0,n_rows):
+    solar=[]
+    for hop in range(0,2):
+      solar += [round(refl_lat[i,hop],4), round(refl_lon[i,hop],4), refl_height[i,hop], round(refl_obsc[i,hop],4),
+                round(refl_sza[i,hop],3)]
+    solar += [round(path_obsc[i],4), round(rx['obsc'][i],4), round(rx['solar_zenith_deg'][i],3)]
+    writer.writerow(rows[i] + solar)
+  stage_metrics.count('rows_written',n_rows)
+
+print("pathsolar csv file written to", csv_out_name)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# Name pipeline.py
+#
+# Purpose : Run the modelling chain pathfinder.sh (sweep.py) -> modefinder.py -> synthspec.py -> grape_fft_spectrogram.py DB
+#           as a graph of stages for many stations, frequencies and dates from one JSON manifest, redoing only what changed.
+#           Each stage is given the hash of everything it reads: the config file options it uses, heuristics.ini,
+#           the content of the upstream csv files and the source of the script itself. The hash is kept in a stamp file
+#           in ./output/pipeline and a stage whose hash and outputs are unchanged is skipped. So after a change to
+#           heuristics.ini only modefinder.py onward is rerun, and a stage downstream of one that produced
+#           identical output is skipped.
+#           Stages with no dependence on each other (stations, frequencies of a multi-frequency config, dates) are run
+#           in parallel, up to n_procs at once.
+#
+#   python3 pipeline.py manifest.json [n_procs] [--force] [--dry-run]
+#
+# Manifest:
+#   {"runs": [
+#      {"config": "N8GA_config.ini", "start": "202407260000", "minutes": 60, "days": 7, "db": true},
+#      {"config": "W2NAF_config.ini", "start": "202404081500", "minutes": 180, "db": true,
+#       "spectrogram": {"channel": "ch1_W2NAF", "freq_index": 3, "start_hour": 15, "stop_hour": 21}}
+#   ]}
+# Run keys:
+#   config         *_config.ini file in ./config, callsign is taken from its name as in the other scripts
+#   start          first time step as YYYYMMDDHHMM, minutes the time span of the pathfinder sweep
+#   days           optional, repeat the run on this many consecutive days from start (default 1)
+#   db             optional, upload synthspec.py output to the database, needed for the spectrogram stage
+#   spectrogram    optional, arguments of grape_fft_spectrogram.py, run with DB once all the run's synthspec stages are done
+#   pathsolar      optional, true to add eclipse obscuration and solar zenith angle at the ray reflection points with
+#                  pathsolar.py after each modefinder stage
+#
+# The pathfinder sweep is given the start time on its command line and leaves the config file unchanged (see run_spec.py),
+# so the pathfinder stages of one config file for different dates run alongside each other too. A sweep that failed
+# part way is resumed from its manifest (see sweep.py) when the pipeline is run again.
+
+import os
+import sys
+import ast
+import json
+import time
+import hashlib
+import datetime
+import subprocess
+import configparser
+
+import run_spec                    # module in this directory, callsign from config file name
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+base_directory='./'
+config_dir=os.path.join(base_directory,'config')
+stamp_dir=os.path.join(base_directory,'output','pipeline')
+heuristics_file=os.path.join(config_dir,'heuristics.ini')
+
+# Source files each stage runs, hashed so that a code change reruns the stage
+stage_sources={'pathfinder':['sweep.py','pathfinder.py','run_spec.py','raytrace_backend.py','raytrace_analytic.py'],
+               'modefinder':['modefinder.py','mode_heuristics.py'],
+               'synthspec':['synthspec.py'],
+               'pathsolar':['pathsolar.py','run_spec.py','eclipse_calc/eclipse_calc.py','eclipse_calc/geodesy.py'],
+               'spectrogram':['grape_fft_spectrogram.py','load_metadata.py','load_grape_iq.py','raster_spectrogram.py',
+                              'doppler_kernels.py']}
+
+################################
+# Hashing
+################################
+
+def hash_file(fname):
+  # sha256 of a file's content, or of its absence
+  h=hashlib.sha256()
+  if not os.path.exists(fname):
+    h.update(b'missing')
+    return h.hexdigest()
+  with open(fname,'rb') as in_file:
+    for block in iter(lambda: in_file.read(1<<20), b''):
+      h.update(block)
+  return h.hexdigest()
+
+def hash_options(config_file, options, exclude=()):
+  # Hash of the named config sections, or (section, option) pairs, as read by configparser so that comments,
+  # blank lines and option order do not matter. Options in exclude are left out, e.g. ut which pathfinder.sh steps.
+  config=configparser.ConfigParser()
+  config.read(config_file)
+  values=[]
+  for item in options:
+    if isinstance(item, tuple):
+      section, option = item
+      values.append([section, option, config.get(section, option, fallback=None)])
+    elif config.has_section(item):
+      values.extend([item, option, value] for option, value in sorted(config.items(item)) if option not in exclude)
+  return hashlib.sha256(json.dumps(values).encode()).hexdigest()
+
+def stage_hash(node):
+  # Hash of everything the stage reads, evaluated when the stage is ready to run so upstream outputs are final
+  parts={'stage':node['stage'], 'args':node['args']}
+  parts['sources']=[hash_file(os.path.join(base_directory,f)) for f in stage_sources[node['stage']]]
+  parts['config']=hash_options(node['config_file'], node['config_options'], exclude=('ut','distance','bearing'))
+  if node['stage']=='modefinder':
+    parts['heuristics']=hash_options(heuristics_file, ['propagation'])
+  parts['inputs']=[hash_file(f) for f in node['inputs']]
+  if node['stage']=='spectrogram':
+    parts['data']=data_mtime(os.path.join(base_directory,'data','psws_grapeDRF',node['args'][0]))
+  return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def data_mtime(data_dir):
+  # Latest modification time of a digital RF channel directory and its hourly subdirectories
+  mtime=0.
+  if os.path.isdir(data_dir):
+    mtime=os.stat(data_dir).st_mtime
+    for sub in os.scandir(data_dir):
+      if sub.is_dir():
+        mtime=max(mtime, sub.stat().st_mtime)
+  return mtime
+
+def stamp_file(node):
+  return os.path.join(stamp_dir, node['stage'], node['id'].replace('/','_')+'.json')
+
+def is_up_to_date(node, input_hash):
+  fname=stamp_file(node)
+  if not os.path.exists(fname):
+    return False
+  with open(fname,'r') as in_file:
+    stamp=json.load(in_file)
+  return stamp.get('hash')==input_hash and all(os.path.exists(f) for f in node['outputs'])
+
+def write_stamp(node, input_hash):
+  fname=stamp_file(node)
+  os.makedirs(os.path.dirname(fname), exist_ok=True)
+  with open(fname,'w') as out_file:
+    json.dump({'id':node['id'], 'hash':input_hash, 'outputs':node['outputs'],
+               'finished':datetime.datetime.now(datetime.timezone.utc).isoformat()}, out_file, indent=1)
+
+################################
+# Building the graph
+################################
+
+def file_prefixes(config_file, start):
+  # csv file prefixes written by pathfinder.py, one per frequency in multi-frequency mode
+  config=configparser.ConfigParser()
+  config.read(config_file)
+  if config.has_option('settings','freqs'):
+    return [start+'_'+str(float(f))+'MHz' for f in ast.literal_eval(config.get('settings','freqs'))]
+  return [start]
+
+def build_graph(manifest):
+  """
+  Expand a manifest into a dict of stage nodes keyed by id. Each node has the command to run, the files it
+  reads and writes, the config options it depends on and the ids of the nodes it must follow.
+  """
+  nodes={}
+  def add(node):
+    nodes[node['id']]=node
+    return node['id']
+
+  for run in manifest['runs']:
+    config_name=run['config']
+    config_file=os.path.join(config_dir, config_name)
+    callsign=run_spec.callsign_of(config_name)
+    csv_dir=os.path.join(base_directory,'output','csv',callsign)
+    first=datetime.datetime.strptime(run['start'],'%Y%m%d%H%M')
+    synth_ids=[]
+    for day in range(0, run.get('days',1)):
+      start=(first+datetime.timedelta(days=day)).strftime('%Y%m%d%H%M')
+      prefixes=file_prefixes(config_file, start)
+      path_id=add({'id':callsign+'/'+start+'/pathfinder', 'stage':'pathfinder',
+                   'cmd':[sys.executable,'sweep.py','pathfinder',config_name,str(run['minutes']),start],
+                   'args':[start, run['minutes']],
+                   'config_file':config_file, 'config_options':['settings'], 'inputs':[],
+                   'outputs':[os.path.join(csv_dir, p+'_pathfinder.csv') for p in prefixes], 'deps':[]})
+      for prefix in prefixes:
+        mode_id=add({'id':callsign+'/'+prefix+'/modefinder', 'stage':'modefinder',
+                     'cmd':[sys.executable,'modefinder.py',callsign,prefix], 'args':[prefix],
+                     'config_file':config_file,
+                     'config_options':[('settings','freq'),('metadata','tx'),('plots','legend')],
+                     'inputs':[os.path.join(csv_dir, prefix+'_pathfinder.csv')],
+                     'outputs':[os.path.join(csv_dir, prefix+'_modefinder.csv')], 'deps':[path_id]})
+        synth_cmd=[sys.executable,'synthspec.py',callsign,prefix]+(['DB'] if run.get('db') else [])
+        synth_ids.append(add({'id':callsign+'/'+prefix+'/synthspec', 'stage':'synthspec',
+                     'cmd':synth_cmd, 'args':synth_cmd[3:], 'config_file':config_file,
+                     'config_options':[('settings','freq'),('settings','tx_grid'),('settings','rx_grid'),'metadata'],
+                     'inputs':[os.path.join(csv_dir, prefix+'_modefinder.csv')],
+                     'outputs':[os.path.join(csv_dir, prefix+'_synthspec.csv')], 'deps':[mode_id]}))
+        if run.get('pathsolar'):
+          add({'id':callsign+'/'+prefix+'/pathsolar', 'stage':'pathsolar',
+               'cmd':[sys.executable,'pathsolar.py',callsign,prefix], 'args':[prefix], 'config_file':config_file,
+               'config_options':[('settings','tx_grid'),('settings','rx_grid')],
+               'inputs':[os.path.join(csv_dir, prefix+'_modefinder.csv')],
+               'outputs':[os.path.join(csv_dir, prefix+'_pathsolar.csv')], 'deps':[mode_id]})
+
+    if 'spectrogram' in run:
+      spec=run['spectrogram']
+      args=[spec['channel'], str(spec['freq_index']), str(spec['start_hour']), str(spec['stop_hour'])]
+      add({'id':callsign+'/'+run['start']+'_'+spec['channel']+'_'+args[1]+'/spectrogram', 'stage':'spectrogram',
+           'cmd':[sys.executable,'grape_fft_spectrogram.py']+args+['DB'], 'args':args,
+           'config_file':config_file, 'config_options':['plots'],
+           'inputs':[nodes[i]['outputs'][0] for i in synth_ids], 'outputs':[], 'deps':list(synth_ids)})
+  return nodes
+
+################################
+# Running
+################################
+
+def run_node(node, log_dir):
+  # Run one stage as a subprocess with a non interactive matplotlib backend, output to a log file.
+  # Returns the exit code.
+  env=dict(os.environ, MPLBACKEND='Agg')
+  log_name=os.path.join(log_dir, node['id'].replace('/','_')+'.log')
+  with open(log_name,'w') as log_file:
+    return subprocess.run(node['cmd'], cwd=base_directory, env=env, stdout=log_file, stderr=subprocess.STDOUT).returncode
+
+def run_graph(nodes, n_procs=None, force=False, dry_run=False):
+  """
+  Run the stage graph. A stage starts once all its deps have finished or been skipped.
+  Returns a dict of id: status, status being 'done', 'skipped', 'failed' or 'blocked' (an upstream stage failed).
+  """
+  if n_procs is None:
+    n_procs=os.cpu_count()
+  log_dir=os.path.join(stamp_dir,'logs')
+  os.makedirs(log_dir, exist_ok=True)
+
+  status={}
+  running={}
+  pool=ThreadPoolExecutor(max_workers=n_procs)
+  while len(status) < len(nodes):
+    for node in nodes.values():             # stages downstream of a failure will never run
+      if node['id'] not in status and any(status.get(d) in ('failed','blocked') for d in node['deps']):
+        status[node['id']]='blocked'
+        print('blocked:', node['id'])
+
+    ready=[n for n in nodes.values() if n['id'] not in status and n['id'] not in running.values()
+           and all(status.get(d) in ('done','skipped') for d in n['deps'])]
+    for node in ready:
+      if len(running) >= n_procs:
+        break
+      input_hash=stage_hash(node)
+      if not force and is_up_to_date(node, input_hash):
+        status[node['id']]='skipped'
+        print('skipped:', node['id'])
+        continue
+      if dry_run:
+        status[node['id']]='done'
+        print('would run:', node['id'], ' '.join(node['cmd']))
+        continue
+      print('running:', node['id'])
+      if node['stage']=='pathfinder' and os.path.exists(stamp_file(node)) and '--fresh' not in node['cmd']:
+        node['cmd'].append('--fresh')       # inputs changed since a complete sweep, otherwise resume a partial one
+      node['hash']=input_hash
+      running[pool.submit(run_node, node, log_dir)]=node['id']
+
+    if len(running)==0:
+      if len(ready)==0 and len(status) < len(nodes):
+        break                               # nothing can start, should not happen as every dep is a stage of the graph
+      continue                              # only skipped or blocked stages this pass, look again for newly ready ones
+    finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+    for future in finished:
+      node=nodes[running.pop(future)]
+      try:
+        code=future.result()
+      except Exception as err:
+        code=str(err)
+      if code==0 and all(os.path.exists(f) for f in node['outputs']):
+        write_stamp(node, node['hash'])
+        status[node['id']]='done'
+      else:
+        status[node['id']]='failed'
+      print(status[node['id']]+':', node['id'])
+  pool.shutdown()
+  return status
+
+if __name__ == '__main__':
+  args=[x for x in sys.argv[1:] if not x.startswith('--')]
+  if len(args) < 1:
+    print ("Rerun with a manifest file, optionally the number of parallel stages, --force and --dry-run")
+    sys.exit()
+
+  with open(args[0],'r') as in_file:
+    manifest=json.load(in_file)
+  nodes=build_graph(manifest)
+  print(len(nodes), " stages in the pipeline")
+  tic=time.time()
+  status=run_graph(nodes, int(args[1]) if len(args) > 1 else None, '--force' in sys.argv, '--dry-run' in sys.argv)
+  counts={s:list(status.values()).count(s) for s in ('done','skipped','failed','blocked')}
+  print(counts['done'], " run, ", counts['skipped'], " up to date, ", counts['failed'], " failed, ",
+        counts['blocked'], " blocked, in ", round(time.time()-tic,1), " s. Logs in ", os.path.join(stamp_dir,'logs'))
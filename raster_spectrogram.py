@@ -0,0 +1,167 @@
+# Fast raster rendering of Doppler spectrograms
+# contourf and pcolormesh build one polygon per cell, which for a day of one minute FFTs with 600 frequency
+# bins (or 30000 columns of a 256 point spectrogram) is slow to draw and very slow to save at high dpi.
+# Here the spectrogram is first binned to the pixel grid it will be shown on, mapped to colours with a
+# precomputed lookup table (LUT) and drawn as a single image with imshow on numeric time extents.
+# write_png skips matplotlib figures altogether and writes the coloured pixel grid straight to a PNG,
+# for batch runs over many station-days.
+#
+# Time is handled as numbers throughout: epoch seconds or decimal hours, never lists of datetimes.
+# epoch_to_mpl converts epoch seconds to matplotlib date numbers for date formatted axes.
+
+import datetime
+import warnings
+
+import numpy as np
+import matplotlib as mpl
+import matplotlib.image
+import matplotlib.pyplot as plt
+
+def epoch_to_mpl(t_epoch):
+    """
+    Convert epoch seconds (UTC) to matplotlib date numbers.
+    """
+    return mpl.dates.date2num(datetime.datetime(1970,1,1)) + np.asarray(t_epoch,dtype=float)/86400.
+
+def colormap_lut(cmap,n_colors=256,bad=(0,0,0,0)):
+    """
+    Precompute an RGBA uint8 lookup table of n_colors entries from a matplotlib colormap (name or object).
+    One extra entry at index n_colors holds the colour for NaN (data gaps), transparent by default.
+    """
+    if not isinstance(cmap,mpl.colors.Colormap):
+        cmap = plt.get_cmap(cmap)
+    lut         = np.empty((n_colors+1,4),dtype=np.uint8)
+    lut[:-1]    = np.round(cmap(np.linspace(0,1,n_colors))*255)
+    lut[-1]     = bad
+    return lut
+
+def levels_to_index(Sxx_db,lut,vmin=None,vmax=None,levels=None):
+    """
+    Map spectrogram levels to LUT indices.
+
+    With levels (band edges, as for contourf) each band gets one LUT entry, so the LUT should have
+    len(levels)-1 colours, and values below levels[0] or above levels[-1] are left blank as contourf
+    leaves them. Otherwise vmin to vmax is spread linearly over the LUT.
+    NaN (and blank) maps to the last LUT entry.
+    """
+    n_colors    = len(lut) - 1
+    bad         = ~np.isfinite(Sxx_db)
+    if levels is not None:
+        with np.errstate(invalid='ignore'):
+            bad = bad | (Sxx_db < levels[0]) | (Sxx_db > levels[-1])
+        inx = np.digitize(Sxx_db,levels[1:-1])
+    else:
+        if vmin is None:
+            vmin = np.nanmin(Sxx_db)
+        if vmax is None:
+            vmax = np.nanmax(Sxx_db)
+        with np.errstate(invalid='ignore'):
+            inx = np.floor((Sxx_db - vmin)/(vmax - vmin)*n_colors)
+        inx = np.clip(np.nan_to_num(inx),0,n_colors-1).astype(np.intp)
+    inx[bad]    = n_colors
+    return inx
+
+def resample_axis(arr,axis,n_out,reduce='max'):
+    """
+    Resample arr along axis to n_out bins. When shrinking, groups of adjacent bins are combined with
+    nanmax (keeps narrow Doppler traces visible) or nanmean; when enlarging, bins are repeated.
+    """
+    arr     = np.moveaxis(np.asarray(arr),axis,0)
+    n_in    = arr.shape[0]
+    if n_in <= n_out:
+        out = arr[(np.arange(n_out)*n_in)//n_out]
+        return np.moveaxis(out,0,axis)
+
+    k       = int(np.ceil(n_in/n_out))
+    n_pad   = (-n_in) % k
+    if n_pad:
+        pad = np.full((n_pad,)+arr.shape[1:],np.nan,dtype=np.result_type(arr.dtype,np.float32))
+        arr = np.concatenate((arr,pad),axis=0)
+    arr     = arr.reshape((arr.shape[0]//k,k)+arr.shape[1:])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore',category=RuntimeWarning)     # all-NaN groups inside gaps stay NaN
+        if reduce == 'mean':
+            out = np.nanmean(arr,axis=1)
+        else:
+            out = np.nanmax(arr,axis=1)
+    return np.moveaxis(out,0,axis)
+
+def bin_to_pixels(t,f,Sxx_db,width_px=None,height_px=None,reduce='max'):
+    """
+    Bin a spectrogram (len(f),len(t)) to at most width_px columns and height_px rows.
+    Axes that already have fewer bins than pixels are left alone, imshow scales them.
+
+    Returns (t,f,Sxx_db) of the binned grid, t and f being bin centres.
+    """
+    t       = np.asarray(t,dtype=float)
+    f       = np.asarray(f,dtype=float)
+    if width_px is not None and len(t) > width_px:
+        Sxx_db  = resample_axis(Sxx_db,1,width_px,reduce)
+        t       = resample_axis(t,0,width_px,'mean')
+    if height_px is not None and len(f) > height_px:
+        Sxx_db  = resample_axis(Sxx_db,0,height_px,reduce)
+        f       = resample_axis(f,0,height_px,'mean')
+    return t, f, Sxx_db
+
+def extent(t,f):
+    """
+    imshow extent [left,right,bottom,top] placing each bin centred on its t and f value.
+    """
+    dt  = (t[-1] - t[0])/max(len(t)-1,1)
+    df  = (f[-1] - f[0])/max(len(f)-1,1)
+    return [t[0]-dt/2.,t[-1]+dt/2.,f[0]-df/2.,f[-1]+df/2.]
+
+def to_rgba(Sxx_db,cmap='viridis',vmin=None,vmax=None,levels=None,n_colors=256):
+    """
+    Colour a spectrogram through a LUT. Returns (rgba,mappable), rgba being uint8 (len(f),len(t),4) and
+    mappable a ScalarMappable with the same colour scale for fig.colorbar.
+    """
+    if levels is not None:
+        n_colors    = len(levels) - 1
+    if vmin is None:
+        vmin = np.nanmin(Sxx_db) if levels is None else levels[0]
+    if vmax is None:
+        vmax = np.nanmax(Sxx_db) if levels is None else levels[-1]
+    lut     = colormap_lut(cmap,n_colors)
+    rgba    = lut[levels_to_index(Sxx_db,lut,vmin,vmax,levels)]
+
+    lcmap   = mpl.colors.ListedColormap(lut[:-1]/255.)
+    if levels is not None:
+        norm    = mpl.colors.BoundaryNorm(levels,n_colors)
+    else:
+        norm    = mpl.colors.Normalize(vmin,vmax)
+    mappable = mpl.cm.ScalarMappable(norm=norm,cmap=lcmap)
+    mappable.set_array([])
+    return rgba, mappable
+
+def imshow_spectrogram(ax,t,f,Sxx_db,cmap='viridis',vmin=None,vmax=None,levels=None,
+        width_px=None,height_px=None,reduce='max'):
+    """
+    Draw a spectrogram (len(f),len(t)) on ax as one image.
+
+    t:          numeric column times, e.g. decimal hours or epoch_to_mpl() date numbers
+    f:          frequency of each row
+    width_px, height_px: pixel size to bin to, width_px defaults to the width of ax
+
+    Returns a ScalarMappable for fig.colorbar, which is not drawn on ax so pass ax to colorbar too.
+    """
+    if width_px is None:
+        width_px = int(np.ceil(ax.get_window_extent().width))
+    t, f, Sxx_db    = bin_to_pixels(t,f,Sxx_db,width_px,height_px,reduce)
+    rgba, mappable  = to_rgba(Sxx_db,cmap,vmin,vmax,levels)
+    ax.imshow(rgba,extent=extent(t,f),origin='lower',aspect='auto',interpolation='nearest')
+    return mappable
+
+def write_png(fpath,t,f,Sxx_db,width_px=2000,height_px=None,cmap='viridis',vmin=None,vmax=None,levels=None,
+        reduce='max'):
+    """
+    Write a spectrogram straight to a PNG of width_px by height_px pixels (height defaults to len(f)),
+    low frequencies at the bottom. No figure, axes or mesh is built.
+    """
+    if height_px is None:
+        height_px = len(f)
+    t, f, Sxx_db    = bin_to_pixels(t,f,Sxx_db,width_px,height_px,reduce)
+    rgba, mappable  = to_rgba(Sxx_db,cmap,vmin,vmax,levels)
+    rgba            = resample_axis(resample_axis(rgba,1,width_px),0,height_px)
+    mpl.image.imsave(fpath,rgba,origin='lower')
+    return fpath
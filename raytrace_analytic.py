@@ -0,0 +1,328 @@
+# Module with an analytic stand-in for the PyLap ionosphere grids and ray tracers, see raytrace_backend.py
+# Same calls and return values as PyLap gen_iono_grid_2d, raytrace_2d, gen_iono_grid_3d and raytrace_3d, so pathfinder.py,
+# SS_sidescatter.py and SS_sidescatter_batch.py run unchanged, in a fraction of a second, where PyLap is not installed.
+#
+# Ionosphere: Chapman E and F2 layers on a spherical Earth. foE from the CCIR formula, foF2 and hmF2 following the solar
+# zenith angle and R12, so the layers rise and fall through the day and Doppler appears at sunrise and sunset.
+# No magnetic field (Bx, By, Bz are zero and O and X rays are the same), no irregularities, no absorption.
+#
+# Rays: each hop reflects from the layer at the reflection point, taken as a parabolic layer fitted to the grid column
+# there (peak plasma frequency, peak height and the half density height below the peak), E if the equivalent vertical
+# frequency is below foE, else F2, else the ray escapes. The secant law with the curved Earth incidence angle gives the
+# equivalent vertical frequency, the parabolic layer formulas the virtual and true reflection heights, and the hop is
+# the triangle to the virtual height (ground range, group path) as in Breit and Tuve and Martyn's theorems. The phase
+# and geometric paths are taken along straight lines to the true reflection height. Retardation of F rays in the E
+# layer is ignored. Doppler is -f/c times the rate of change of phase path between the grids at UT and UT+5 minutes,
+# with each hop held at UT+5 to the layer it reflects from at UT; where that layer no longer reflects it, it is nan.
+#
+# ray_data fields, one value per hop (nan for hops not completed): initial_elev, final_elev, frequency, lat, lon,
+#   ground_range, group_range, phase_path, geometric_path_length, apogee, gnd_rng_to_apogee, plasma_freq_at_apogee,
+#   virtual_height, Doppler_shift, Doppler_spread, ray_label (1 ground return, -1 escaped), nhops_attempted
+# ray_path_data fields, one value per path point: ground_range, height, group_range, phase_path, geometric_distance,
+#   and for 3D also lat, lon, initial_elev, initial_bearing, frequency
+
+import numpy as np
+from datetime import datetime, timedelta
+
+R_earth = 6371.0                    # km, spherical Earth
+speed_of_light = 2.99792458e8       # m/s
+n_half = 16                         # path points up to and down from each reflection
+E_top = 160.0                       # km, top of the E region when fitting layers to a grid column
+doppler_dt = 300.0                  # s, the UT+5 min grid
+
+################################
+# Ionosphere
+################################
+
+def solar_zenith_cos(ut, lat, lon):
+  """
+  Cosine of the solar zenith angle at UT [year, month, day, hour, minute] for arrays of lat and lon (˚).
+  """
+  t = datetime(*[int(x) for x in ut[0:5]])
+  doy = t.timetuple().tm_yday
+  hour = t.hour + t.minute/60.
+  decl = np.deg2rad(-23.44*np.cos(2*np.pi*(doy+10)/365.))
+  hour_angle = np.deg2rad(15.*(hour-12.) + np.asarray(lon))
+  lat = np.deg2rad(np.asarray(lat))
+  return np.sin(lat)*np.sin(decl) + np.cos(lat)*np.cos(decl)*np.cos(hour_angle)
+
+def layer_parameters(cos_chi, R12):
+  # foE (MHz), foF2 (MHz) and hmF2 (km) for the solar zenith angle and sunspot number
+  sun = np.maximum(cos_chi, 0.)
+  foE = np.maximum(0.9*((180.+1.44*R12)*sun)**0.25, 0.4)        # CCIR, with a night time floor
+  foF2_day = 5.+0.04*R12
+  foF2 = 0.45*foF2_day + 0.55*foF2_day*sun**0.6
+  hmF2 = 300.-50.*sun
+  return foE, foF2, hmF2
+
+def chapman_pf(heights, foE, foF2, hmF2, hmE=110., HE=10., HF=50.):
+  # Plasma frequency (MHz) of the sum of Chapman E and F2 layers, heights broadcast against the layer arrays
+  def chapman(h, fo, hm, H):
+    z = (h-hm)/H
+    return (fo**2)*np.exp(0.5*(1.-z-np.exp(-z)))
+  return np.sqrt(chapman(heights, foE, hmE, HE) + chapman(heights, foF2, hmF2, HF))
+
+def collision_profile(heights):
+  # Electron collision frequency (per s), exponential with height
+  return 1e7*np.exp(-(heights-70.)/6.)
+
+def destination(lat, lon, bearing, ground_range):
+  """
+  lat, lon (˚) at ground_range (km) along the great circle leaving lat, lon on bearing (˚), arrays broadcast.
+  """
+  lat1, lon1, brg = np.deg2rad(lat), np.deg2rad(lon), np.deg2rad(bearing)
+  d = np.asarray(ground_range)/R_earth
+  lat2 = np.arcsin(np.sin(lat1)*np.cos(d) + np.cos(lat1)*np.sin(d)*np.cos(brg))
+  lon2 = lon1 + np.arctan2(np.sin(brg)*np.sin(d)*np.cos(lat1), np.cos(d)-np.sin(lat1)*np.sin(lat2))
+  return np.rad2deg(lat2), (np.rad2deg(lon2)+180.) % 360. - 180.
+
+def ut_plus(ut, seconds):
+  return list((datetime(*[int(x) for x in ut[0:5]]) + timedelta(seconds=seconds)).timetuple()[0:5])
+
+def gen_iono_grid_2d(origin_lat, origin_long, R12, UT, ray_bear, max_range, num_range, range_inc, start_height,
+                     height_inc, num_heights, kp, doppler_flag, profile_type='iri2016', iri_options=None):
+  """
+  As PyLap gen_iono_grid_2d. Returns iono_pf_grid, iono_pf_grid_5 (UT+5 min, if doppler_flag), collision_freq, irreg
+  and iono_te_grid, the grids of shape (num_heights, num_range).
+  """
+  heights = start_height + height_inc*np.arange(num_heights)
+  ranges = range_inc*np.arange(num_range)
+  lats, lons = destination(origin_lat, origin_long, ray_bear, ranges)
+  def grid(ut):
+    foE, foF2, hmF2 = layer_parameters(solar_zenith_cos(ut, lats, lons), R12)
+    return chapman_pf(heights[:,None], foE[None,:], foF2[None,:], hmF2[None,:])
+  iono_pf_grid = grid(UT)
+  iono_pf_grid_5 = grid(ut_plus(UT, doppler_dt)) if doppler_flag else iono_pf_grid.copy()
+  collision_freq = np.repeat(collision_profile(heights)[:,None], num_range, axis=1)
+  irreg = np.zeros((4, num_range))
+  iono_te_grid = np.repeat((300.+3.*heights)[:,None], num_range, axis=1)
+  return iono_pf_grid, iono_pf_grid_5, collision_freq, irreg, iono_te_grid
+
+def gen_iono_grid_3d(UT, R12, iono_grid_parms, geomag_grid_parms, doppler_flag, profile_type='iri2016'):
+  """
+  As PyLap gen_iono_grid_3d. Returns iono_pf_grid, iono_pf_grid_5, collision_freq of shape (num_lat, num_lon, num_ht)
+  and Bx, By, Bz of the geomagnetic grid shape, all zero.
+  """
+  lat_start, lat_inc, num_lat, lon_start, lon_inc, num_lon, ht_start, ht_inc, num_ht = iono_grid_parms
+  lats = lat_start + lat_inc*np.arange(num_lat)
+  lons = lon_start + lon_inc*np.arange(num_lon)
+  heights = ht_start + ht_inc*np.arange(num_ht)
+  lat2, lon2 = np.meshgrid(lats, lons, indexing='ij')
+  def grid(ut):
+    foE, foF2, hmF2 = layer_parameters(solar_zenith_cos(ut, lat2, lon2), R12)
+    return chapman_pf(heights[None,None,:], foE[...,None], foF2[...,None], hmF2[...,None])
+  iono_pf_grid = grid(UT)
+  iono_pf_grid_5 = grid(ut_plus(UT, doppler_dt)) if doppler_flag else iono_pf_grid.copy()
+  collision_freq = np.broadcast_to(collision_profile(heights), iono_pf_grid.shape).copy()
+  B_shape = (int(geomag_grid_parms[2]), int(geomag_grid_parms[5]), int(geomag_grid_parms[8]))
+  return iono_pf_grid, iono_pf_grid_5, collision_freq, np.zeros(B_shape), np.zeros(B_shape), np.zeros(B_shape)
+
+################################
+# Layer fits to grid columns
+################################
+
+def fit_layers(pf, heights):
+  """
+  Parabolic E and F layer parameters of each grid column. pf is (..., n_heights) plasma frequency (MHz).
+  Returns a dict of fcE, hmE, ymE, fcF, hmF, ymF arrays of the leading shape of pf.
+  """
+  pf2 = np.asarray(pf, dtype=float)**2
+  out = {}
+  for name, region in (('E', heights < E_top), ('F', heights >= E_top)):
+    p = np.where(region, pf2, -np.inf)
+    i_max = np.argmax(p, axis=-1)
+    peak = np.take_along_axis(pf2, i_max[...,None], axis=-1)[...,0]
+    hm = heights[i_max]
+    # half density height below the peak; N/Nm = 1-((h-hm)/ym)**2 is a half at hm-ym/sqrt(2)
+    below = (heights < hm[...,None]) & (pf2 <= 0.5*peak[...,None])
+    h_half = np.max(np.where(below, heights, -np.inf), axis=-1)
+    ym = np.where(np.isfinite(h_half), np.sqrt(2.)*(hm-h_half), 2.*(heights[1]-heights[0]))
+    out['fc'+name] = np.sqrt(np.maximum(peak, 0.))
+    out['hm'+name] = hm
+    out['ym'+name] = np.maximum(ym, 1.)
+  return out
+
+def parabolic_heights(fv, fc, hm, ym):
+  # Virtual and true reflection heights (km) of a parabolic layer at equivalent vertical frequency fv < fc
+  x = np.clip(fv/fc, 0., 0.999999)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    xlog = np.where(x > 0, x*np.log((1+x)/(1-x)), 0.)
+  return (hm-ym) + 0.5*ym*xlog, hm - ym*np.sqrt(1.-x**2)
+
+################################
+# Ray tracing
+################################
+
+def trace_hops(elevs, freqs, nhops, layers_at, top_height, layer=None):
+  """
+  Hop by hop reflection of each ray, vectorised over rays.
+
+  elevs, freqs:   initial elevation (˚) and frequency (MHz) of each ray
+  layers_at:      function of the ground range (km) of each ray returning fit_layers arrays there
+  top_height:     top of the grid (km), where escaping rays end
+  layer:          optional (n_rays, nhops) reflecting layer of each hop to hold to (the layer output of a previous trace),
+                  a hop that cannot reflect from the same layer is then taken as not landing
+
+  Returns a dict of (n_rays, nhops) arrays: theta (half hop central angle, rad), h_v, h_r, fv, ground_range (cumulative),
+  group (cumulative), phase (cumulative), layer (1 E, 2 F, 0 none), and label per ray (1 landed after every hop,
+  -1 escaped).
+  """
+  n = len(elevs)
+  b = np.deg2rad(np.asarray(elevs, dtype=float))
+  f = np.asarray(freqs, dtype=float)
+  cos_b = np.cos(b)
+  keys = ('theta','h_v','h_r','fv','ground_range','group','phase')
+  out = {key:np.full((n, nhops), np.nan) for key in keys}
+  out['layer'] = np.zeros((n, nhops), dtype=int)
+  active = np.ones(n, dtype=bool)
+  gr0, group0, phase0 = np.zeros(n), np.zeros(n), np.zeros(n)
+  for hop in range(nhops):
+    L = layers_at(gr0 + 300.)
+    h_v = L['hmF'].copy()
+    for iteration in range(4):                       # reflection point depends on the virtual height, so iterate
+      sin_i = np.clip(R_earth*cos_b/(R_earth+h_v), 0., 1.)
+      theta = np.pi/2 - b - np.arcsin(sin_i)
+      L = layers_at(gr0 + R_earth*theta)
+      fv = f*np.sqrt(1.-sin_i**2)
+      hvE, hrE = parabolic_heights(fv, L['fcE'], L['hmE'], L['ymE'])
+      hvF, hrF = parabolic_heights(fv, L['fcF'], L['hmF'], L['ymF'])
+      refl_E = fv < L['fcE']
+      refl_F = ~refl_E & (fv < L['fcF'])
+      if layer is not None:                          # same layer as before or no reflection
+        refl_F = (layer[:,hop] == 2) & (fv < L['fcF'])
+        refl_E = (layer[:,hop] == 1) & (fv < L['fcE'])
+      h_v = np.where(refl_E, hvE, np.where(refl_F, hvF, top_height))
+    h_r = np.where(refl_E, hrE, np.where(refl_F, hrF, np.nan))
+    landed = active & (refl_E | refl_F)
+    sin_i = R_earth*cos_b/(R_earth+h_v)
+    theta = np.pi/2 - b - np.arcsin(sin_i)
+    slant_v = (R_earth+h_v)*np.sin(theta)/cos_b                 # tx to virtual reflection point, law of sines
+    slant_r = np.sqrt(R_earth**2 + (R_earth+h_r)**2 - 2*R_earth*(R_earth+h_r)*np.cos(theta))
+    gr0 = gr0 + 2*R_earth*theta
+    group0 = group0 + 2*slant_v
+    phase0 = phase0 + 2*slant_r
+    for key, value in (('theta',theta), ('h_v',h_v), ('h_r',h_r), ('fv',fv), ('ground_range',gr0),
+                       ('group',group0), ('phase',phase0), ('layer',np.where(refl_E, 1, 2))):
+      out[key][landed, hop] = value[landed]
+    escaped_now = active & ~landed
+    out['theta'][escaped_now, hop] = theta[escaped_now]           # to the top of the grid, for the path
+    active = landed
+  out['label'] = np.where(active, 1, -1)
+  return out
+
+def hop_path(b, theta, h_r, gr_start, top_only=False):
+  # Path points of one hop: straight up to the true reflection height over the half hop, then down (not if top_only)
+  t = np.linspace(0., 1., n_half+1)
+  ax, ay = R_earth, 0.
+  bx, by = (R_earth+h_r)*np.cos(theta), (R_earth+h_r)*np.sin(theta)
+  x, y = ax + t*(bx-ax), ay + t*(by-ay)
+  ang, rad = np.arctan2(y, x), np.hypot(x, y)
+  if not top_only:
+    ang = np.concatenate((ang, 2*theta-ang[-2::-1]))
+    rad = np.concatenate((rad, rad[-2::-1]))
+  return gr_start + R_earth*ang, rad - R_earth
+
+def ray_outputs(elevs, freqs, nhops, hops, hops_5, top_height, origin_lat=None, origin_lon=None, bearings=None):
+  # PyLap style ray_data and ray_path_data lists from trace_hops at UT and UT+5 min
+  n = len(elevs)
+  b = np.deg2rad(np.asarray(elevs, dtype=float))
+  # hops_5 is traced holding each hop to the layer it reflects from at UT, so the phase path changes with that
+  # layer rather than jumping between layers; a hop with no same layer reflection at UT+5 min has nan Doppler
+  dphase = hops_5['phase'] - hops['phase']                         # km per doppler_dt
+  doppler = -(np.asarray(freqs)[:,None]*1e6/speed_of_light)*(dphase*1000./doppler_dt)
+  three_d = origin_lat is not None
+  if three_d:
+    lat, lon = destination(origin_lat, origin_lon, np.asarray(bearings)[:,None], hops['ground_range'])
+  ray_data, ray_path_data = [], []
+  for i in range(n):
+    gr, h_v, h_r = hops['ground_range'][i], hops['h_v'][i], hops['h_r'][i]
+    gr_start = np.concatenate(([0.], gr[:-1]))
+    ray = {'initial_elev':np.full(nhops, elevs[i]), 'final_elev':np.where(np.isnan(gr), np.nan, elevs[i]),
+           'frequency':np.full(nhops, freqs[i]), 'ground_range':gr, 'group_range':hops['group'][i],
+           'phase_path':hops['phase'][i], 'geometric_path_length':hops['phase'][i], 'apogee':h_r,
+           'gnd_rng_to_apogee':gr_start + R_earth*hops['theta'][i], 'plasma_freq_at_apogee':hops['fv'][i],
+           'virtual_height':h_v, 'Doppler_shift':doppler[i], 'Doppler_spread':np.zeros(nhops),
+           'ray_label':np.full(nhops, hops['label'][i]), 'nhops_attempted':nhops}
+    if three_d:
+      ray['lat'], ray['lon'] = lat[i], lon[i]
+    ray_data.append(ray)
+
+    # path, hop by hop, to the ground or up to the top of the grid for a ray that escapes
+    path_gr, path_h, path_group, path_phase = [], [], [], []
+    start, group_done, phase_done = 0., 0., 0.
+    for hop in range(nhops):
+      if np.isnan(gr[hop]):
+        g, h = hop_path(b[i], hops['theta'][i,hop], top_height, start, top_only=True)
+        s = np.concatenate(([0.], np.cumsum(np.hypot(np.diff(g), np.diff(h)))))
+        path_gr.append(g)
+        path_h.append(h)
+        path_group.append(group_done+s)
+        path_phase.append(phase_done+s)
+        break
+      g, h = hop_path(b[i], hops['theta'][i,hop], h_r[hop], start)
+      s = np.concatenate(([0.], np.cumsum(np.hypot(np.diff(g), np.diff(h)))))
+      hop_phase = hops['phase'][i,hop] - phase_done
+      hop_group = hops['group'][i,hop] - group_done
+      scale = hop_group/hop_phase if hop_phase > 0 else 1.
+      path_gr.append(g)
+      path_h.append(h)
+      path_phase.append(phase_done + s*(hop_phase/s[-1]))
+      path_group.append(group_done + s*(hop_phase/s[-1])*scale)
+      start, group_done, phase_done = gr[hop], hops['group'][i,hop], hops['phase'][i,hop]
+    path = {'ground_range':np.concatenate(path_gr), 'height':np.concatenate(path_h),
+            'group_range':np.concatenate(path_group), 'phase_path':np.concatenate(path_phase)}
+    path['geometric_distance'] = path['phase_path']
+    if three_d:
+      path['lat'], path['lon'] = destination(origin_lat, origin_lon, bearings[i], path['ground_range'])
+      path['initial_elev'] = np.array([elevs[i]])
+      path['initial_bearing'] = np.array([bearings[i]])
+      path['frequency'] = np.array([freqs[i]])
+    ray_path_data.append(path)
+  return ray_data, ray_path_data
+
+def raytrace_2d(origin_lat, origin_long, elevs, ray_bear, freqs, nhops, tol, irregs_flag, iono_en_grid, iono_en_grid_5,
+                collision_freq, start_height, height_inc, range_inc, irreg):
+  """
+  As PyLap raytrace_2d, grids (num_heights, num_range) of electron density (per cm^3).
+  Returns ray_data, ray_path_data and ray_path_state (empty dicts).
+  """
+  elevs = np.atleast_1d(np.asarray(elevs, dtype=float))
+  freqs = np.broadcast_to(np.asarray(freqs, dtype=float), elevs.shape)
+  num_heights, num_range = iono_en_grid.shape
+  heights = start_height + height_inc*np.arange(num_heights)
+  top_height = heights[-1]
+  def column_lookup(en_grid):
+    layers = fit_layers(np.sqrt(np.maximum(en_grid.T, 0.)*80.6164e-6), heights)   # per range column
+    def layers_at(ground_range):
+      inx = np.clip(np.rint(ground_range/range_inc), 0, num_range-1).astype(int)
+      return {key:value[inx] for key, value in layers.items()}
+    return layers_at
+  hops = trace_hops(elevs, freqs, nhops, column_lookup(iono_en_grid), top_height)
+  hops_5 = trace_hops(elevs, freqs, nhops, column_lookup(iono_en_grid_5), top_height, hops['layer'])
+  ray_data, ray_path_data = ray_outputs(elevs, freqs, nhops, hops, hops_5, top_height)
+  return ray_data, ray_path_data, [{} for i in range(len(elevs))]
+
+def raytrace_3d(origin_lat, origin_long, origin_ht, elevs, ray_bears, freqs, OX_mode, nhops, tol, iono_en_grid,
+                iono_en_grid_5, collision_freq, iono_grid_parms, Bx, By, Bz, geomag_grid_parms):
+  """
+  As PyLap raytrace_3d, grids (num_lat, num_lon, num_ht) of electron density (per cm^3). OX_mode has no effect.
+  Returns ray_data, ray_path_data and ray_state_vec (empty dicts).
+  """
+  elevs = np.atleast_1d(np.asarray(elevs, dtype=float))
+  freqs = np.broadcast_to(np.asarray(freqs, dtype=float), elevs.shape)
+  bears = np.broadcast_to(np.asarray(ray_bears, dtype=float), elevs.shape)
+  lat_start, lat_inc, num_lat, lon_start, lon_inc, num_lon, ht_start, ht_inc, num_ht = iono_grid_parms
+  heights = ht_start + ht_inc*np.arange(num_ht)
+  top_height = heights[-1]
+  def column_lookup(en_grid):
+    layers = fit_layers(np.sqrt(np.maximum(en_grid, 0.)*80.6164e-6), heights)     # per lat, lon column
+    def layers_at(ground_range):
+      lat, lon = destination(origin_lat, origin_long, bears, ground_range)
+      i = np.clip(np.rint((lat-lat_start)/lat_inc), 0, num_lat-1).astype(int)
+      j = np.clip(np.rint((lon-lon_start)/lon_inc), 0, num_lon-1).astype(int)
+      return {key:value[i,j] for key, value in layers.items()}
+    return layers_at
+  hops = trace_hops(elevs, freqs, nhops, column_lookup(iono_en_grid), top_height)
+  hops_5 = trace_hops(elevs, freqs, nhops, column_lookup(iono_en_grid_5), top_height, hops['layer'])
+  ray_data, ray_path_data = ray_outputs(elevs, freqs, nhops, hops, hops_5, top_height, origin_lat, origin_long, bears)
+  return ray_data, ray_path_data, [{} for i in range(len(elevs))]
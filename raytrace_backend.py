@@ -0,0 +1,91 @@
+# Module to choose the ray tracer used by pathfinder.py, SS_sidescatter.py and SS_sidescatter_batch.py
+# A backend provides the four PyLap calls the scripts use, with PyLap's arguments and return values:
+#   gen_iono_grid_2d, raytrace_2d     2D numerical ray tracing along the great circle path (pathfinder.py)
+#   gen_iono_grid_3d, raytrace_3d     3D magneto-ionic ray tracing (the sidescatter scripts)
+# Backends:
+#   pylap       PyLap itself, the default, found via PYTHONPATH and the pylap egg under ~/.local as before
+#   analytic    the Chapman layer stand-in of raytrace_analytic.py, needs only numpy. For running, testing and
+#               profiling the modelling chain where PyLap is not installed; its results are not PyLap's.
+# Select with raytracer = analytic in the [settings] section of the *_config.ini file, so the choice is part of the run
+# specification (and of the pipeline.py hash of [settings]).
+# Either way the calls are timed as the stages iono and raytrace of stage_metrics.py, with the rays of each call counted.
+
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import stage_metrics              # module in this directory, stage timing and counters
+
+backends = ('pylap','analytic')
+pylap_egg = 'pylap-0.1.0a0-py3.12-linux-x86_64.egg'
+
+def find_dir_path(name, start_path='.'):
+    """Recursively finds the first directory matching a given name."""
+    start_dir = Path(start_path)
+    for path in start_dir.rglob(name):
+       if path.is_dir():
+            return path.resolve() # .resolve() returns the absolute path
+    return None
+
+def add_pylap_paths():
+  # add the paths for pylap as we are likely in a protected environment
+  # PYTHONPATH is easy to add, not so easy the directory pylap-0.1.0a0-py3.12-linux-x86_64.egg, so look in ~/.local
+  # Path.home() rather than os.getlogin(), which fails when there is no controlling terminal, e.g. under pipeline.py
+  pylappath = os.environ.get('PYTHONPATH')
+  pylapeggpath = find_dir_path(pylap_egg, Path.home()/'.local')
+  if pylapeggpath is None:
+    print ("Cannot find", pylap_egg, "under", Path.home()/'.local', ", relying on the python path for PyLap")
+  else:
+    sys.path.insert(0, str(pylapeggpath))
+  if pylappath:
+    sys.path.insert(0, pylappath)
+
+def load_pylap():
+  add_pylap_paths()
+  from Ionosphere import gen_iono_grid_2d, gen_iono_grid_3d
+  from pylap.raytrace_2d import raytrace_2d
+  from pylap.raytrace_3d import raytrace_3d
+  return SimpleNamespace(name='pylap', gen_iono_grid_2d=gen_iono_grid_2d.gen_iono_grid_2d, raytrace_2d=raytrace_2d,
+                         gen_iono_grid_3d=gen_iono_grid_3d.gen_iono_grid_3d, raytrace_3d=raytrace_3d)
+
+def load_analytic():
+  import raytrace_analytic         # module in this directory, Chapman layer stand-in for PyLap
+  return SimpleNamespace(name='analytic', gen_iono_grid_2d=raytrace_analytic.gen_iono_grid_2d,
+                         raytrace_2d=raytrace_analytic.raytrace_2d, gen_iono_grid_3d=raytrace_analytic.gen_iono_grid_3d,
+                         raytrace_3d=raytrace_analytic.raytrace_3d)
+
+def timed(fn, stage, elevs_arg=None):
+  # fn timed as stage, and when elevs_arg is the position of the elevations argument the rays traced counted
+  def call(*args, **kwargs):
+    with stage_metrics.stage(stage):
+      result=fn(*args, **kwargs)
+      if elevs_arg is not None:
+        stage_metrics.count('rays_traced', len(args[elevs_arg]))
+    return result
+  return call
+
+def instrument(tracer):
+  return SimpleNamespace(name=tracer.name, gen_iono_grid_2d=timed(tracer.gen_iono_grid_2d, 'iono'),
+                         raytrace_2d=timed(tracer.raytrace_2d, 'raytrace', 2),
+                         gen_iono_grid_3d=timed(tracer.gen_iono_grid_3d, 'iono'),
+                         raytrace_3d=timed(tracer.raytrace_3d, 'raytrace', 3))
+
+def load(name='pylap'):
+  """
+  The backend called name, see backends, with its calls timed.
+  """
+  if name == 'pylap':
+    return instrument(load_pylap())
+  if name == 'analytic':
+    return instrument(load_analytic())
+  raise ValueError('unknown ray tracer {}, choose from {}'.format(name, ', '.join(backends)))
+
+def from_config(config):
+  """
+  The backend named by raytracer in [settings] of a RunSpec or configparser object, PyLap if not given.
+  """
+  name = config.get('settings', 'raytracer', fallback='pylap')
+  tracer = load(name)
+  print("Ray tracer: ", tracer.name)
+  return tracer
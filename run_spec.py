@@ -0,0 +1,159 @@
+# Module for the run specification of the ray tracing scripts
+# The *_config.ini file is read once into a RunSpec, which cannot be changed after loading. The UT of a time step is
+# passed on the command line with --ut YYYYMMDDHHMM rather than written into the config file by the bash drivers, and
+# results derived during a run (path distance and bearing, metric peaks) are written to a per-run record in
+# ./output/runs/<callsign>/<file_time>/<ut>_<stage>.json instead of back into the config file. So several sweeps for the
+# same callsign can run at once without one overwriting the other's config file.
+#
+# A RunSpec is read as a configparser object is, e.g. spec['settings'].getint('r12'), spec.get('settings','tx_grid'),
+# spec.has_option('settings','freqs'), with the UT from --ut in place of the config file ut when it is given.
+
+import os
+import ast
+import json
+import tempfile
+import configparser
+from datetime import datetime
+
+import maidenhead as mh            # locators to lat lon, hence distance and bearing
+from geographiclib.geodesic import Geodesic
+
+base_directory='./'
+records_dir=os.path.join(base_directory,'output','runs')
+
+def parse_ut(ut):
+  """
+  UT as [year, month, day, hour, minute] from a YYYYMMDDHHMM string, or from a list as in the config file.
+  """
+  if isinstance(ut, str):
+    t=datetime.strptime(ut, '%Y%m%d%H%M')
+    return [t.year, t.month, t.day, t.hour, t.minute]
+  return [int(x) for x in ut]
+
+def ut_stamp(ut):
+  """
+  UT list as a YYYYMMDDHHMM string, the form used in the output file names.
+  """
+  return '{:04d}{:02d}{:02d}{:02d}{:02d}'.format(*parse_ut(ut))
+
+def ut_arg(argv):
+  """
+  The value following --ut on a command line, or None if not given.
+  """
+  if '--ut' in argv and argv.index('--ut')+1 < len(argv):
+    return argv[argv.index('--ut')+1]
+  return None
+
+def callsign_of(config_file):
+  # As the scripts have always done: the part of ./config/N8GA_config.ini between the directory and the first underscore
+  return os.path.basename(config_file).split('_')[0]
+
+class SpecSection(object):
+  # Read only view of one config file section, with the getters of a configparser section
+  def __init__(self, section):
+    object.__setattr__(self, '_section', section)
+
+  def __setattr__(self, name, value):
+    raise AttributeError('run specification is read only')
+
+  def get(self, option, fallback=None):
+    return self._section.get(option, fallback=fallback)
+
+  def getint(self, option, fallback=None):
+    return self._section.getint(option, fallback=fallback)
+
+  def getfloat(self, option, fallback=None):
+    return self._section.getfloat(option, fallback=fallback)
+
+  def getboolean(self, option, fallback=None):
+    return self._section.getboolean(option, fallback=fallback)
+
+  def __contains__(self, option):
+    return option in self._section
+
+class RunSpec(object):
+  def __init__(self, config_file, ut=None, file_time=None):
+    """
+    config_file:   path of the *_config.ini file, read once here
+    ut:            UT of this run as YYYYMMDDHHMM or a list, default the ut in the config file
+    file_time:     YYYYMMDDHHMM prefix of the output files, default the UT
+    """
+    parser=configparser.ConfigParser()
+    if len(parser.read(config_file)) == 0:
+      raise FileNotFoundError('config file {} not found'.format(config_file))
+    if ut is None:
+      ut=ast.literal_eval(parser.get('settings','ut'))
+    ut=tuple(parse_ut(ut))
+    sections={name:SpecSection(parser[name]) for name in parser.sections()}
+    values={'config_file':config_file, 'callsign':callsign_of(config_file), 'ut':ut,
+            'file_time':ut_stamp(ut) if file_time is None else file_time, '_sections':sections}
+    for name in values:
+      object.__setattr__(self, name, values[name])
+
+  def __setattr__(self, name, value):
+    raise AttributeError('run specification is read only')
+
+  def __getitem__(self, section):
+    return self._sections[section]
+
+  def has_section(self, section):
+    return section in self._sections
+
+  def has_option(self, section, option):
+    return section in self._sections and option in self._sections[section]
+
+  def get(self, section, option, fallback=None):
+    if not self.has_section(section):
+      return fallback
+    return self._sections[section].get(option, fallback=fallback)
+
+def load(config_file, argv=None, file_time=None):
+  """
+  RunSpec of config_file, with the UT from --ut in argv (usually sys.argv) when given.
+  """
+  return RunSpec(config_file, ut=ut_arg(argv or []), file_time=file_time)
+
+def path_geometry(spec):
+  """
+  Transmitter and receiver positions (centre of their Maidenhead squares) and the WGS84 great circle path between them.
+  Returns a dict with tx_lat, tx_lon, rx_lat, rx_lon, distance (km), bearing and recip_bearing (˚ clockwise from north).
+  """
+  tx_lat,tx_lon=mh.to_location(spec['settings'].get('tx_grid'), center=True)
+  rx_lat,rx_lon=mh.to_location(spec['settings'].get('rx_grid'), center=True)
+  path_object=Geodesic.WGS84.Inverse(tx_lat, tx_lon, rx_lat, rx_lon)
+  recip_path_object=Geodesic.WGS84.Inverse(rx_lat, rx_lon, tx_lat, tx_lon)
+  return {'tx_lat':tx_lat, 'tx_lon':tx_lon, 'rx_lat':rx_lat, 'rx_lon':rx_lon, 'distance':path_object['s12']/1000,
+          'bearing':path_object['azi1'], 'recip_bearing':recip_path_object['azi1']}
+
+def record_file(spec, stage):
+  return os.path.join(records_dir, spec.callsign, spec.file_time, ut_stamp(spec.ut)+'_'+stage+'.json')
+
+def write_json(fname, obj):
+  """
+  Write obj as JSON to fname, replacing the file in one step so a reader never sees it half written.
+  """
+  os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+  fd, tmp_name=tempfile.mkstemp(dir=os.path.dirname(fname) or '.', suffix='.tmp')
+  with os.fdopen(fd, 'w') as out_file:
+    json.dump(obj, out_file, indent=1)
+  os.replace(tmp_name, fname)
+  return fname
+
+def write_record(spec, stage, values):
+  """
+  Write the results of one stage of a run. Returns the file name.
+  """
+  record={'config_file':spec.config_file, 'callsign':spec.callsign, 'file_time':spec.file_time, 'ut':list(spec.ut),
+          'stage':stage}
+  record.update(values)
+  return write_json(record_file(spec, stage), record)
+
+def read_record(spec, stage):
+  """
+  The record written by stage for the same callsign, file_time and UT, or None if there is none.
+  """
+  fname=record_file(spec, stage)
+  if not os.path.exists(fname):
+    return None
+  with open(fname,'r') as in_file:
+    return json.load(in_file)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# Multi-resolution spectrogram store for Grape digital RF data
+# A spectrogram is computed once per station and center frequency and written to disk as tiles:
+# level 0 is full resolution, level 1 averages pairs of level 0 columns (2x decimation in time),
+# level 2 is 4x and so on until a single tile covers the whole span.
+# Plots then ask for a time range and a pixel width and only the tiles of the coarsest level
+# that still gives at least one column per pixel are read, so a month and a zoomed hour cost the same.
+#
+# Layout on disk:
+#   output/pyramid/<station>/<cfreq>MHz/pyramid.json       index: geometry, start time, level sizes
+#   output/pyramid/<station>/<cfreq>MHz/L00/tile_000000.npy  float32 linear PSD, (nfft, tile_columns)
+# Columns that overlap a data gap are NaN.
+#
+# Build from the command line, e.g.
+#   python3 spectrogram_pyramid.py w2naf 2024-4-8 2024-4-9 5,10,15,20
+
+import os
+import sys
+import glob
+import json
+import shutil
+import datetime
+
+import numpy as np
+from scipy import signal
+
+import matplotlib as mpl
+
+import digital_rf as drf
+
+import load_grape_iq
+import raster_spectrogram
+
+class SpectrogramPyramid(object):
+    def __init__(self,station,cfreq,pyramid_dir=os.path.join('output','pyramid'),
+            nfft=1024,nperseg=256,noverlap=32,tile_columns=1024):
+        """
+        Tiled, multi-level spectrogram of one center frequency of one station.
+
+        station:        station directory under data/psws_grapeDRF, e.g. 'w2naf'
+        cfreq:          center frequency in MHz
+        pyramid_dir:    root directory of the tile store
+        nfft, nperseg, noverlap: spectrogram geometry, defaults match GrapeDRF.plot_ax
+        tile_columns:   time columns per tile, must be even so each coarser tile is built from two finer ones
+
+        An existing index on disk takes precedence over the geometry arguments.
+        """
+        self.station        = station
+        self.cfreq          = cfreq
+        self.store_dir      = os.path.join(pyramid_dir,station,'{:g}MHz'.format(float(cfreq)))
+        self.index_fpath    = os.path.join(self.store_dir,'pyramid.json')
+        self.index          = {'nfft':nfft,'nperseg':nperseg,'noverlap':noverlap,
+                               'tile_columns':tile_columns,'levels':[]}
+
+        if os.path.exists(self.index_fpath):
+            with open(self.index_fpath,'r') as fl:
+                self.index = json.load(fl)
+
+    def exists(self):
+        return len(self.index['levels']) > 0
+
+    def tile_fpath(self,level,tile_inx):
+        return os.path.join(self.store_dir,'L{:02d}'.format(level),'tile_{:06d}.npy'.format(tile_inx))
+
+    def clear(self):
+        """
+        Remove the index and every level of tiles from disk, keeping the geometry for the next build.
+        """
+        if os.path.exists(self.index_fpath):
+            os.remove(self.index_fpath)
+        for level_dir in glob.glob(os.path.join(self.store_dir,'L[0-9][0-9]')):
+            shutil.rmtree(level_dir)
+        self.index['levels'] = []
+
+    def build(self,sDate,eDate,data_dir=None,channel='ch0',precision='complex64'):
+        """
+        Compute the full resolution spectrogram tile by tile from the digital RF data,
+        then each decimated level from the one below. Only one tile of IQ is in memory at a time.
+        An existing pyramid is cleared first, so no tiles of an earlier span are left beside the new index.
+        """
+        if data_dir is None:
+            data_dir = os.path.join('data','psws_grapeDRF',self.station)
+
+        idx         = self.index
+        nperseg     = idx['nperseg']
+        noverlap    = idx['noverlap']
+        nfft        = idx['nfft']
+        T           = idx['tile_columns']
+        step        = nperseg - noverlap
+
+        do          = drf.DigitalRFReader(data_dir)
+        fs          = float(do.get_properties(channel)['samples_per_second'])
+        sub_channel = cfreq_index(data_dir,channel,self.cfreq)
+
+        s_start     = drf.util.time_to_sample(sDate,fs)
+        s_end       = drf.util.time_to_sample(eDate,fs)
+        n_cols      = int((s_end - s_start - noverlap)//step)
+        n_tiles     = int(np.ceil(n_cols/T))
+
+        print('Building spectrogram pyramid {!s}: {!s} columns in {!s} tiles'.format(self.store_dir,n_cols,n_tiles))
+        self.clear()
+        os.makedirs(os.path.dirname(self.tile_fpath(0,0)),exist_ok=True)
+        work_dtype  = load_grape_iq.compute_dtype(precision)
+        for tile_inx in range(n_tiles):
+            c0      = tile_inx*T
+            nc      = min(T,n_cols-c0)
+            s0      = s_start + c0*step
+            ns      = (nc-1)*step + nperseg
+            iq, valid   = load_grape_iq.read_grape_drf_masked(do,channel,s0,ns,sub_channel,precision)
+            iq          = load_grape_iq.iq_to_complex(iq,work_dtype)
+            f, t_spec, Sxx  = signal.spectrogram(iq,fs=fs,nperseg=nperseg,noverlap=noverlap,
+                                    nfft=nfft,window='hann',return_onesided=False)
+            Sxx             = np.fft.fftshift(Sxx,axes=0).astype(np.float32)
+            seg_ok          = load_grape_iq.window_valid(valid,nperseg,step,Sxx.shape[1])
+            Sxx[:,~seg_ok]  = np.nan
+            np.save(self.tile_fpath(0,tile_inx),Sxx)
+
+        idx['fs']       = fs
+        idx['t0']       = s_start/fs           # epoch seconds of the first sample of column 0
+        idx['dt']       = step/fs              # seconds between level 0 columns
+        idx['levels']   = [{'level':0,'n_columns':n_cols}]
+
+        level   = 0
+        while n_cols > T:
+            n_cols  = self.__decimate_level__(level)
+            level  += 1
+            idx['levels'].append({'level':level,'n_columns':n_cols})
+
+        with open(self.index_fpath,'w') as fl:
+            json.dump(idx,fl,indent=1)
+        print('Pyramid levels: {!s}'.format(len(idx['levels'])))
+
+    def __decimate_level__(self,level):
+        """
+        Build level+1 from level by averaging linear power of adjacent column pairs.
+        Columns in data gaps (NaN) are left out of the average; a pair that is all gap stays NaN.
+        """
+        T           = self.index['tile_columns']
+        n_cols      = self.index['levels'][level]['n_columns']
+        n_tiles     = int(np.ceil(n_cols/T))
+        n_cols_new  = int(np.ceil(n_cols/2))
+        os.makedirs(os.path.dirname(self.tile_fpath(level+1,0)),exist_ok=True)
+        for new_inx in range(int(np.ceil(n_tiles/2))):
+            parts   = [np.load(self.tile_fpath(level,inx)) for inx in (2*new_inx,2*new_inx+1) if inx < n_tiles]
+            Sxx     = np.concatenate(parts,axis=1)
+            if Sxx.shape[1] % 2:
+                Sxx = np.concatenate((Sxx,np.full((Sxx.shape[0],1),np.nan,dtype=Sxx.dtype)),axis=1)
+            pairs   = np.stack((Sxx[:,0::2],Sxx[:,1::2]))
+            count   = np.sum(np.isfinite(pairs),axis=0)
+            total   = np.nansum(pairs,axis=0)
+            Sxx_new = np.where(count > 0,total/np.maximum(count,1),np.nan).astype(np.float32)
+            np.save(self.tile_fpath(level+1,new_inx),Sxx_new)
+        return n_cols_new
+
+    def choose_level(self,sTime,eTime,width_px):
+        """
+        Coarsest level that still has at least one column per pixel across sTime to eTime.
+        """
+        idx     = self.index
+        n_full  = (eTime - sTime).total_seconds()/idx['dt']
+        level   = 0
+        for lvl in idx['levels']:
+            if n_full/2**lvl['level'] >= width_px:
+                level = lvl['level']
+        return level
+
+    def get(self,sTime,eTime,width_px=2000,level=None):
+        """
+        Read the spectrogram between sTime and eTime at the resolution suited to width_px pixels.
+        Only the tiles overlapping the time range are opened, memory mapped.
+
+        Returns dict with keys:
+            't_epoch':  column center times, epoch seconds
+            'f':        Doppler frequency bins (Hz), zero at the center
+            'Sxx':      linear PSD, (len(f),len(t_epoch))
+            'level':    pyramid level used
+        """
+        if not self.exists():
+            raise IOError('No spectrogram pyramid at {!s}, run build() first'.format(self.store_dir))
+
+        idx     = self.index
+        if level is None:
+            level   = self.choose_level(sTime,eTime,width_px)
+        T       = idx['tile_columns']
+        n_cols  = idx['levels'][level]['n_columns']
+        dec     = 2**level
+        dt      = idx['dt']*dec
+        # Center of level column c: start of its first level 0 column plus half the decimated span
+        t_first = idx['t0'] + (idx['nperseg']/2.)/idx['fs'] + idx['dt']*(dec-1)/2.
+
+        ts0     = sTime.replace(tzinfo=datetime.timezone.utc).timestamp() if sTime.tzinfo is None else sTime.timestamp()
+        ts1     = eTime.replace(tzinfo=datetime.timezone.utc).timestamp() if eTime.tzinfo is None else eTime.timestamp()
+        c0      = int(np.clip(np.floor((ts0 - t_first)/dt),0,n_cols))
+        c1      = int(np.clip(np.ceil((ts1 - t_first)/dt)+1,c0,n_cols))
+
+        parts   = []
+        for tile_inx in range(c0//T,int(np.ceil(c1/T))):
+            tile    = np.load(self.tile_fpath(level,tile_inx),mmap_mode='r')
+            t_c0    = tile_inx*T
+            parts.append(np.array(tile[:,max(c0-t_c0,0):c1-t_c0]))
+        nfft    = idx['nfft']
+        if len(parts) > 0:
+            Sxx = np.concatenate(parts,axis=1)
+        else:
+            Sxx = np.zeros((nfft,0),dtype=np.float32)
+
+        result  = {}
+        result['t_epoch']   = t_first + dt*np.arange(c0,c1)
+        result['f']         = np.fft.fftshift(np.fft.fftfreq(nfft,1./idx['fs']))
+        result['Sxx']       = Sxx
+        result['level']     = level
+        return result
+
+    def plot_ax(self,ax,sTime,eTime,width_px=None,cmap=None,vmin=None,vmax=None):
+        """
+        Draw the spectrogram between sTime and eTime on ax as an image, reading only the tiles required.
+        width_px defaults to the pixel width of ax.
+        """
+        if width_px is None:
+            width_px = int(ax.get_window_extent().width)
+        spec    = self.get(sTime,eTime,width_px)
+        with np.errstate(divide='ignore'):
+            Sxx_db  = 10*np.log10(spec['Sxx'])
+        if cmap is None:
+            cmap = mpl.colors.LinearSegmentedColormap.from_list(" ", ["black","darkgreen","green","yellow","red"])
+        t_mpl   = raster_spectrogram.epoch_to_mpl(spec['t_epoch'])
+        mpbl    = raster_spectrogram.imshow_spectrogram(ax,t_mpl,spec['f'],Sxx_db,cmap=cmap,
+                        vmin=vmin,vmax=vmax,width_px=width_px)
+        ax.xaxis_date()
+        ax.set_ylabel('Doppler Shift (Hz)')
+        ax.set_xlabel('UTC')
+        return mpbl
+
+def cfreq_index(data_dir,channel,cfreq):
+    """
+    Subchannel index of center frequency cfreq (MHz) from the channel metadata.
+    """
+    dmr         = drf.DigitalMetadataReader(os.path.join(data_dir,channel,'metadata'))
+    latest_meta = dmr.read_latest()
+    latest_inx  = list(latest_meta.keys())[0]
+    cntr_freqs  = np.array(latest_meta[latest_inx]['center_frequencies'],dtype=float)
+    matches     = np.flatnonzero(np.isclose(cntr_freqs,cfreq))
+    if len(matches) == 0:
+        raise ValueError('{!s} MHz not in center frequencies {!s}'.format(cfreq,cntr_freqs))
+    if len(cntr_freqs) == 1:
+        return None                     # single channel Grape, no subchannel index
+    return int(matches[0])
+
+if __name__ == '__main__':
+    # python3 spectrogram_pyramid.py w2naf 2024-4-8 2024-4-9 5,10,15,20
+    if len(sys.argv) != 5:
+        print("Rerun with station, start date, end date (YYYY-m-d) and comma separated frequencies in MHz")
+        sys.exit()
+
+    station     = sys.argv[1]
+    sDate       = datetime.datetime(*map(int,sys.argv[2].split('-')))
+    eDate       = datetime.datetime(*map(int,sys.argv[3].split('-')))
+    cfreqs      = [float(x) for x in sys.argv[4].split(',')]
+
+    for cfreq in cfreqs:
+        pyr     = SpectrogramPyramid(station,cfreq)
+        pyr.build(sDate,eDate)
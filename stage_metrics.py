@@ -0,0 +1,201 @@
+# Module for stage timing, counters and peak memory of the Doppler and ray tracing scripts
+# A script calls start() once with its name, then marks its stages, either
+#   with stage_metrics.stage('fft'):        around a block, or
+#   stage_metrics.mark('fft')                ending the previous marked stage and starting the next, for top level code
+# and counts what it processed with stage_metrics.count('fft_windows', n). Counts are added to the innermost open stage
+# and to the run total; the standard counters are samples_read, fft_windows, acf_windows, rays_traced and rows_written,
+# others are kept in the JSON record only.
+# The modules the scripts share (load_grape_iq.py, raytrace_backend.py) count too, and when no start() has been
+# called, e.g. in a notebook, every call here does nothing.
+#
+# At exit the run is appended as one JSON line to ./output/profiles/<script>.jsonl and as one row per stage to
+# ./output/profiles/<script>.csv, and a one line summary printed. Peak RSS is that of the process so far at the end of
+# each stage. Set GRAPE_PROFILE=cprofile (or pyinstrument, if installed) to also profile the whole run by function,
+# written next to the JSON as <script>_<start time>.prof (or .html).
+
+import os
+import sys
+import csv
+import json
+import time
+import atexit
+import resource
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+base_directory='./'
+profiles_dir=os.path.join(base_directory,'output','profiles')
+counter_names=('samples_read','fft_windows','acf_windows','rays_traced','rows_written')
+csv_fields=['run_start','script','stage','calls','seconds','peak_rss_mb']+list(counter_names)
+
+_run=None                          # the active run of this process, None until start()
+
+def peak_rss_mb():
+  # Peak resident set size of this process so far, ru_maxrss is kB on Linux and bytes on Mac OS
+  rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss/1048576. if sys.platform == 'darwin' else rss/1024.
+
+class Run(object):
+  def __init__(self, script, argv):
+    self.script=script
+    self.argv=list(argv)
+    self.run_start=datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    self.t0=time.perf_counter()
+    self.stages={}                 # name: {'calls','seconds','peak_rss_mb','counts'}, in the order first entered
+    self.open=[]                   # names of the stages being timed, innermost last
+    self.marked=None               # (name, start time) of the stage opened by mark()
+    self.counts={}
+    self.profiler=None
+
+  def enter(self, name):
+    self.open.append(name)
+    self.stages.setdefault(name, {'calls':0, 'seconds':0., 'peak_rss_mb':0., 'counts':{}})
+    return time.perf_counter()
+
+  def leave(self, name, t_start):
+    entry=self.stages[name]
+    entry['calls']+=1
+    entry['seconds']+=time.perf_counter()-t_start
+    entry['peak_rss_mb']=max(entry['peak_rss_mb'], peak_rss_mb())
+    if name in self.open:
+      self.open.remove(name)
+
+  def count(self, name, n):
+    self.counts[name]=self.counts.get(name,0)+n
+    if self.open:
+      counts=self.stages[self.open[-1]]['counts']
+      counts[name]=counts.get(name,0)+n
+
+  def record(self):
+    return {'script':self.script, 'argv':self.argv, 'run_start':self.run_start, 'pid':os.getpid(),
+            'seconds':round(time.perf_counter()-self.t0,4), 'peak_rss_mb':round(peak_rss_mb(),1),
+            'counts':self.counts, 'stages':self.stages}
+
+def start(script, argv=None):
+  """
+  Start timing this run of script (its name without .py), written out at exit. Returns the run.
+  """
+  global _run
+  if _run is not None:
+    return _run
+  _run=Run(script, sys.argv if argv is None else argv)
+  start_profiler(_run)
+  atexit.register(finish)
+  return _run
+
+@contextmanager
+def stage(name):
+  """
+  Time the block as stage name. Stages may nest, and the same name may be entered many times.
+  """
+  if _run is None:
+    yield
+    return
+  t_start=_run.enter(name)
+  try:
+    yield
+  finally:
+    _run.leave(name, t_start)
+
+def mark(name=None):
+  """
+  End the stage started by the last mark() and, unless name is None, start stage name.
+  """
+  if _run is None:
+    return
+  if _run.marked is not None:
+    _run.leave(*_run.marked)
+    _run.marked=None
+  if name is not None:
+    _run.marked=(name, _run.enter(name))
+
+def count(name, n=1):
+  """
+  Add n to counter name, e.g. count('rays_traced', len(elevs)).
+  """
+  if _run is not None:
+    _run.count(name, int(n))
+
+def start_profiler(run):
+  # Optional function level profile of the whole run, chosen by the GRAPE_PROFILE environment variable
+  kind=os.environ.get('GRAPE_PROFILE','').lower()
+  if kind == 'cprofile':
+    import cProfile
+    run.profiler=('cprofile', cProfile.Profile())
+    run.profiler[1].enable()
+  elif kind == 'pyinstrument':
+    try:
+      from pyinstrument import Profiler
+    except ImportError:
+      print("GRAPE_PROFILE=pyinstrument but pyinstrument is not installed, no function profile")
+      return
+    run.profiler=('pyinstrument', Profiler())
+    run.profiler[1].start()
+  elif kind:
+    print("GRAPE_PROFILE must be cprofile or pyinstrument, not", kind, ", no function profile")
+
+def stop_profiler(run):
+  if run.profiler is None:
+    return None
+  kind, profiler=run.profiler
+  fname=os.path.join(profiles_dir, run.script+'_'+run.run_start)
+  if kind == 'cprofile':
+    profiler.disable()
+    fname=fname+'.prof'             # view with python -m pstats or snakeviz
+    profiler.dump_stats(fname)
+  else:
+    profiler.stop()
+    fname=fname+'.html'
+    with open(fname,'w') as out_file:
+      out_file.write(profiler.output_html())
+  return fname
+
+def write_csv(run, record):
+  fname=os.path.join(profiles_dir, run.script+'.csv')
+  new_file=not os.path.exists(fname)
+  with open(fname,'a', newline='') as out_file:
+    writer=csv.DictWriter(out_file, fieldnames=csv_fields, extrasaction='ignore')
+    if new_file:
+      writer.writeheader()
+    rows=[dict(name=name, **entry) for name, entry in record['stages'].items()]
+    rows.append({'name':'total', 'calls':1, 'seconds':record['seconds'], 'peak_rss_mb':record['peak_rss_mb'],
+                 'counts':record['counts']})
+    for row in rows:
+      out={'run_start':run.run_start, 'script':run.script, 'stage':row['name'], 'calls':row['calls'],
+           'seconds':round(row['seconds'],4), 'peak_rss_mb':round(row['peak_rss_mb'],1)}
+      for name in counter_names:
+        out[name]=row['counts'].get(name,0)
+      writer.writerow(out)
+
+def summary(record):
+  # One line for the console, e.g. pathfinder 12.3 s, peak RSS 210 MB: iono 2.1 s, raytrace 9.8 s | rays_traced 2400
+  stages=', '.join('{} {:.2f} s'.format(name, entry['seconds']) for name, entry in record['stages'].items())
+  counts=', '.join('{} {}'.format(name, n) for name, n in record['counts'].items())
+  return '{} {:.2f} s, peak RSS {:.0f} MB: {}{}'.format(record['script'], record['seconds'], record['peak_rss_mb'],
+                                                       stages, ' | '+counts if counts else '')
+
+def finish():
+  """
+  Close any open stages and write the profile record of the run, called at exit. Returns the record.
+  """
+  global _run
+  if _run is None:
+    return None
+  run=_run
+  _run=None
+  if run.marked is not None:       # the last stage of a script using mark()
+    run.leave(*run.marked)
+    run.marked=None
+  os.makedirs(profiles_dir, exist_ok=True)
+  profile_file=stop_profiler(run)
+  record=run.record()
+  for entry in record['stages'].values():
+    entry['seconds']=round(entry['seconds'],4)
+    entry['peak_rss_mb']=round(entry['peak_rss_mb'],1)
+  if profile_file is not None:
+    record['profile_file']=profile_file
+  with open(os.path.join(profiles_dir, run.script+'.jsonl'),'a') as out_file:
+    out_file.write(json.dumps(record)+'\n')
+  write_csv(run, record)
+  print("Profile:", summary(record))
+  return record
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# Name sweep.py
+#
+# Purpose : Driver for the time sweeps of pathfinder.sh and SS_animate.sh with checkpoint and resume.
+#           Each time step is run as its own python process, as the bash loops did, because PyLap leaks memory and can
+#           crash. The steps completed, as units of (UT, frequency, tx, rx), are kept in a manifest written atomically next
+#           to the csv files, ./output/csv/callsign/timestamp_sweep_manifest.json (./output/csv/SS/callsign for sidescatter).
+#           Rerunning the same sweep resumes with only the missing or failed steps. A step that fails (nonzero exit,
+#           segfault, killed) is retried up to --retries times and then recorded as failed while the sweep goes on
+#           with the next step.
+#           pathfinder.py appends each step to the csv files, so the size of each csv after the last completed step is
+#           kept in the manifest and the files are cut back to it before a step is retried or the sweep resumed;
+#           a step that died halfway leaves no partial rows behind. Rows of a step done on a later run, after steps
+#           that followed it, are put back in time order once every step is done.
+#
+#   python3 sweep.py pathfinder N8GA_config.ini minutes [YYYYMMDDHHMM] [--retries n] [--fresh]
+#   python3 sweep.py sidescatter W2NAF_config.ini minutes interval [YYYYMMDDHHMM] [--retries n] [--fresh]
+#
+#           The start time defaults to ut in the config file. --fresh discards the manifest and the csv files of
+#           the sweep and starts again, as does a change to the [settings] or [3d_sidescatter] sections of the config file.
+#           Exit status is 1 if any step is left failed.
+
+import os
+import sys
+import ast
+import json
+import subprocess
+from datetime import datetime, timedelta
+
+import run_spec                    # module in this directory, read only config and atomic JSON writes
+import pipeline                    # module in this directory, config section hashing and pathfinder csv names
+
+base_directory='./'
+
+def sweep_units(spec, minutes, interval):
+  # One unit per time step: the UT stamp, frequencies traced in the step and the tx and rx names
+  if spec.has_option('settings','freqs'):
+    freqs=[float(f) for f in ast.literal_eval(spec.get('settings','freqs'))]
+  else:
+    freqs=[spec['settings'].getfloat('freq')]
+  start=datetime(*spec.ut)
+  units=[]
+  for i in range(0, minutes//interval):
+    ut=run_spec.ut_stamp((start+timedelta(minutes=i*interval)).timetuple()[0:5])
+    units.append({'ut':ut, 'freqs':freqs, 'tx':spec.get('metadata','tx'), 'rx':spec.get('metadata','rx')})
+  return units
+
+def file_sizes(fnames):
+  return {fname:os.path.getsize(fname) for fname in fnames if os.path.exists(fname)}
+
+def cut_back(sizes, fnames):
+  # Truncate each file to its size after the last completed step, removing files that did not exist then
+  for fname in fnames:
+    if not os.path.exists(fname):
+      continue
+    if fname in sizes:
+      if os.path.getsize(fname) > sizes[fname]:
+        os.truncate(fname, sizes[fname])
+    else:
+      os.remove(fname)
+
+def sort_rows(fname):
+  # Stable sort of the data rows of a pathfinder csv by the Date in the first column, header kept first
+  with open(fname,'r') as in_file:
+    lines=in_file.readlines()
+  rows=sorted(lines[1:], key=lambda line: line.split(',',1)[0])
+  if rows != lines[1:]:
+    with open(fname,'w') as out_file:
+      out_file.writelines(lines[:1]+rows)
+
+def step_command(kind, config_file, file_time, ut, frame):
+  if kind == 'pathfinder':
+    return [[sys.executable,'pathfinder.py',config_file,file_time,'sweep','--ut',ut]]
+  return [[sys.executable,'SS_sidescatter.py',config_file,file_time,'--ut',ut],
+          [sys.executable,'SS_sidescatter_plot.py',config_file,file_time,str(frame),'--ut',ut]]
+
+def run_step(commands):
+  # Each command in a fresh process; returns 0 if all succeed, else the first nonzero exit code
+  for cmd in commands:
+    code=subprocess.run(cmd, cwd=base_directory).returncode
+    if code != 0:
+      return code
+  return 0
+
+def run_sweep(kind, config_name, minutes, interval=5, start=None, retries=1, fresh=False):
+  """
+  Run or resume a sweep. kind is 'pathfinder' or 'sidescatter'. Returns True if every step is done.
+  """
+  config_file=os.path.join(base_directory,'config',config_name)
+  spec=run_spec.RunSpec(config_file, ut=start)
+  file_time=spec.file_time
+  if kind == 'pathfinder':
+    csv_dir=os.path.join(base_directory,'output','csv',spec.callsign)
+    outputs=[os.path.join(csv_dir,p+'_pathfinder.csv') for p in pipeline.file_prefixes(config_file, file_time)]
+  else:
+    csv_dir=os.path.join(base_directory,'output','csv','SS',spec.callsign)
+    outputs=[]                             # every sidescatter step writes files of its own, nothing to cut back
+  os.makedirs(csv_dir, exist_ok=True)
+  manifest_file=os.path.join(csv_dir, file_time+'_sweep_manifest.json')
+  config_hash=pipeline.hash_options(config_file, ['settings','3d_sidescatter'], exclude=('ut','distance','bearing'))
+
+  manifest=None
+  if not fresh and os.path.exists(manifest_file):
+    with open(manifest_file,'r') as in_file:
+      manifest=json.load(in_file)
+    if manifest.get('config_hash') != config_hash or manifest.get('interval') != interval:
+      print("Config file or interval changed since the manifest was written, starting the sweep again")
+      manifest=None
+  if manifest is None:
+    for fname in outputs:                  # as pathfinder.sh did, start with no csv files for this start time
+      if os.path.exists(fname):
+        os.remove(fname)
+    manifest={'kind':kind, 'config_file':config_file, 'file_time':file_time, 'interval':interval,
+              'config_hash':config_hash, 'sizes':{}, 'units':{}}
+
+  units=sweep_units(spec, minutes, interval)
+  cut_back(manifest['sizes'], outputs)     # drop anything a step that died part way through had appended
+  for frame in range(0, len(units)):
+    unit=units[frame]
+    done=manifest['units'].get(unit['ut'], {})
+    if done.get('status') == 'done':
+      continue
+    attempts=done.get('attempts', 0)
+    for attempt in range(0, retries+1):
+      print("Running ", kind, " step at UT ", unit['ut'], " attempt ", attempt+1)
+      code=run_step(step_command(kind, config_file, file_time, unit['ut'], frame))
+      attempts=attempts+1
+      if code == 0:
+        break
+      print("Step at UT ", unit['ut'], " failed with exit code ", code)
+      cut_back(manifest['sizes'], outputs)
+    unit.update({'status':'done' if code == 0 else 'failed', 'attempts':attempts, 'exit_code':code})
+    manifest['units'][unit['ut']]=unit
+    if code == 0:
+      manifest['sizes']=file_sizes(outputs)
+    run_spec.write_json(manifest_file, manifest)
+
+  n_done=sum(1 for u in units if manifest['units'][u['ut']]['status'] == 'done')
+  if n_done == len(units) and len(manifest['sizes']) > 0:
+    for fname in outputs:
+      if os.path.exists(fname):
+        sort_rows(fname)
+  print(n_done, " of ", len(units), " steps done, manifest ", manifest_file)
+  return n_done == len(units)
+
+if __name__ == '__main__':
+  retries=1
+  args=[]
+  argv=sys.argv[1:]
+  while len(argv) > 0:
+    arg=argv.pop(0)
+    if arg == '--retries':
+      retries=int(argv.pop(0))
+    elif arg != '--fresh':
+      args.append(arg)
+  if len(args) < 3 or args[0] not in ('pathfinder','sidescatter'):
+    print ("Rerun with pathfinder or sidescatter, config file name, minutes, for sidescatter the interval in minutes,")
+    print ("optionally the start time as YYYYMMDDHHMM, --retries n and --fresh")
+    sys.exit(1)
+
+  kind=args[0]
+  if kind == 'pathfinder':
+    interval=5                             # PyLap UT+5 min ionosphere for the Doppler shift
+    start=args[3] if len(args) > 3 else None
+  else:
+    interval=int(args[3])
+    start=args[4] if len(args) > 4 else None
+  complete=run_sweep(kind, args[1], int(args[2]), interval, start, retries, '--fresh' in sys.argv)
+  sys.exit(0 if complete else 1)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# Synthetic Grape Digital RF data with known Doppler, for benchmarks and accuracy checks without the real data tree.
+#
+#   python3 synth_grape_drf.py out_dir YYYY-MM-DD days [n_freqs] [--seed n]
+#
+# Writes out_dir/ch0 and out_dir/ch0/metadata in the layout of a PSWS Grape upload (10 samples per second, one
+# subchannel per center frequency, hourly subdirectories of one minute files, complex int16 IQ), with the metadata
+# fields load_metadata2.load_grape_drf_metadata and grapeDRF.load_grape_drf read: callsign, center_frequencies, lat,
+# long, grid_square and receiver_name. out_dir can then be used as the data_dir of those loaders.
+#
+# Each subchannel is the sum of propagation modes, each a carrier with
+#   Doppler (Hz) = (doppler + diurnal*cos(2 pi (local solar hour - 6)/24) + tid*sin(2 pi t/tid_period)) * f/10 MHz
+# so Doppler rises at sunrise, falls at sunset and scales with frequency as a moving reflection height does.
+# A mode with spread > 0 has its carrier multiplied by complex Gaussian noise low pass filtered to a Gaussian
+# spectrum of that rms width (Hz), which gives Rayleigh fading and a Doppler spread; fade_depth blends that with
+# the steady carrier. Complex Gaussian noise is added at snr_db below a unit mode amplitude, and gaps (no samples
+# written) are placed at random, gaps_per_day of them, gap_seconds long.
+#
+# The true Doppler of every mode is written once per second to out_dir/truth.npz, see doppler_tracks().
+# IQ is made a day at a time, each subchannel in one vectorised pass, so a week of 9 frequencies takes well
+# under a minute plus the HDF5 write time. Mode phase is carried over from day to day; the fading process starts
+# afresh each day.
+
+import os
+import sys
+import shutil
+import datetime
+
+import numpy as np
+import digital_rf as drf
+import maidenhead as mh
+
+fs                  = 10                                # samples per second of Grape data
+channel             = 'ch0'
+full_scale          = 8000.                             # int16 counts for a mode of unit amplitude
+grape_frequencies   = [2.5,3.33,5.,7.85,10.,14.67,15.,20.,25.]
+
+# Ground wave, one hop and two hop F modes. Doppler figures are at 10 MHz.
+default_modes   = [
+    {'name':'ground','amplitude':0.3,'doppler':0.,  'diurnal':0., 'tid':0.,  'tid_period':1800.,'spread':0.,  'fade_depth':0.},
+    {'name':'1F',    'amplitude':1.0,'doppler':0.05,'diurnal':0.6,'tid':0.25,'tid_period':1800.,'spread':0.04,'fade_depth':0.5},
+    {'name':'2F',    'amplitude':0.5,'doppler':0.1, 'diurnal':1.0,'tid':0.4, 'tid_period':2700.,'spread':0.1, 'fade_depth':0.8},
+    ]
+
+default_station = {'callsign':'SYNTH','lat':41.335,'long':-75.600,'receiver_name':'Grape synthetic'}
+
+def doppler_tracks(t,freqs,modes=None,lon=default_station['long']):
+    """
+    True Doppler (Hz) of each mode on each subchannel.
+
+    t:      unix times (s)
+    freqs:  center frequencies (MHz)
+    modes:  list of mode dicts as default_modes
+    lon:    station longitude, sets local solar time for the diurnal term
+
+    Returns an array of shape (len(freqs),len(modes),len(t)).
+    """
+    if modes is None:
+        modes   = default_modes
+    t           = np.asarray(t,dtype=np.float64)
+    solar_hour  = (t/3600. + lon/15.) % 24
+    out         = np.empty((len(freqs),len(modes),len(t)))
+    for m_inx,mode in enumerate(modes):
+        fd_10   = (mode['doppler'] + mode['diurnal']*np.cos(2*np.pi*(solar_hour-6.)/24.)
+                    + mode['tid']*np.sin(2*np.pi*t/mode['tid_period']))
+        out[:,m_inx,:]  = np.outer(np.asarray(freqs)/10.,fd_10)
+    return out
+
+def gap_spans(n_samples,gaps_per_day,gap_seconds,rng):
+    """
+    Sorted, non overlapping (start,stop) sample spans left unwritten in one day. gaps_per_day is the expected
+    number in these n_samples, rounded up so that a span shorter than a day still has at least one gap.
+    """
+    n_gap   = int(gap_seconds*fs)
+    if gaps_per_day <= 0 or n_gap <= 0 or n_gap >= n_samples:
+        return []
+    starts  = np.sort(rng.integers(0,n_samples-n_gap,size=int(np.ceil(gaps_per_day))))
+    spans   = []
+    for s0 in starts:
+        if len(spans) > 0 and s0 <= spans[-1][1]:
+            spans[-1]   = (spans[-1][0],max(spans[-1][1],int(s0)+n_gap))
+        else:
+            spans.append((int(s0),int(s0)+n_gap))
+    return spans
+
+def fading(n_samples,spread,rng):
+    """
+    Unit mean power complex Gaussian process with a Gaussian Doppler spectrum of rms width spread (Hz).
+    """
+    noise   = (rng.standard_normal(n_samples) + 1j*rng.standard_normal(n_samples)).astype(np.complex64)
+    f       = np.fft.fftfreq(n_samples,1./fs)
+    shape   = np.exp(-0.5*(f/spread)**2).astype(np.float32)
+    out     = np.fft.ifft(np.fft.fft(noise)*shape)
+    return (out/np.sqrt(np.mean(np.abs(out)**2))).astype(np.complex64)
+
+def synth_day(t0,n_samples,freqs,modes,lon,snr_db,rng,phase):
+    """
+    IQ of one day as complex64 of shape (n_samples,len(freqs)).
+    phase (len(freqs),len(modes)) is the carrier phase at t0 and is advanced to the end of the day in place.
+    """
+    t       = t0 + np.arange(n_samples)/fs
+    fd_10   = doppler_tracks(t,[10.],modes,lon)[0]          # Doppler scales with frequency, so sum once at 10 MHz
+    # phase at sample k is 2 pi times the Doppler summed over the samples before k
+    cum_10  = np.cumsum(fd_10,axis=1)*(2*np.pi/fs)
+    ph_10   = np.concatenate((np.zeros((len(modes),1)),cum_10[:,:-1]),axis=1)
+    sigma   = 10**(-snr_db/20.)/np.sqrt(2)
+    iq      = np.empty((n_samples,len(freqs)),dtype=np.complex64)
+    for f_inx,f in enumerate(freqs):
+        sig = (sigma*(rng.standard_normal(n_samples) + 1j*rng.standard_normal(n_samples))).astype(np.complex64)
+        for m_inx,mode in enumerate(modes):
+            ph      = phase[f_inx,m_inx] + ph_10[m_inx]*(f/10.)
+            phase[f_inx,m_inx]  = (phase[f_inx,m_inx] + cum_10[m_inx,-1]*(f/10.)) % (2*np.pi)
+            carrier = np.exp(1j*ph).astype(np.complex64)
+            if mode['spread'] > 0 and mode['fade_depth'] > 0:
+                d       = mode['fade_depth']
+                carrier *= np.float32(np.sqrt(1-d)) + np.float32(np.sqrt(d))*fading(n_samples,mode['spread'],rng)
+            sig += np.float32(mode['amplitude'])*carrier
+        iq[:,f_inx] = sig
+    return iq
+
+def to_int16_pairs(iq):
+    """
+    complex64 IQ to the structured complex int16 layout of Grape data, clipped to the int16 range.
+    """
+    out         = np.empty(iq.shape,dtype=np.dtype([('r','<i2'),('i','<i2')]))
+    out['r']    = np.clip(np.round(iq.real*full_scale),-32768,32767)
+    out['i']    = np.clip(np.round(iq.imag*full_scale),-32768,32767)
+    return out
+
+def write_metadata(meta_dir,s_start,freqs,station):
+    os.makedirs(meta_dir,exist_ok=True)
+    dmw     = drf.DigitalMetadataWriter(meta_dir,3600,60,fs,1,'metadata')
+    dmw.write(s_start,{
+        'callsign':         station['callsign'],
+        'center_frequencies': np.asarray(freqs,dtype=np.float64),
+        'lat':              np.float64(station['lat']),
+        'long':             np.float64(station['long']),
+        'grid_square':      mh.to_maiden(station['lat'],station['long']),
+        'receiver_name':    station['receiver_name'],
+        })
+
+def make_dataset(out_dir,sDate,days=1,freqs=None,modes=None,station=None,snr_db=20.,
+        gaps_per_day=4,gap_seconds=120,seed=0,overwrite=True):
+    """
+    Write a synthetic Grape Digital RF station directory.
+
+    out_dir:        station directory, ch0 is made inside it
+    sDate:          start as datetime.datetime (UTC) or 'YYYY-MM-DD'
+    days:           number of days, may be fractional (e.g. 1/24 for one hour)
+    freqs:          center frequencies (MHz), default the nine Grape frequencies
+    modes:          list of mode dicts, default default_modes
+    station:        dict with callsign, lat, long and receiver_name, default default_station
+    snr_db:         noise level below a mode of unit amplitude in the 10 Hz bandwidth
+    gaps_per_day:   number of gaps placed at random each day, gap_seconds long
+    seed:           random seed, the same arguments always give the same data
+
+    Returns a dict of the arguments with s0, s1 (sample bounds) and the gap spans written to truth.npz.
+    """
+    if freqs is None:
+        freqs   = grape_frequencies
+    if modes is None:
+        modes   = default_modes
+    if station is None:
+        station = default_station
+    if isinstance(sDate,str):
+        sDate   = datetime.datetime.strptime(sDate,'%Y-%m-%d')
+    if sDate.tzinfo is None:
+        sDate   = sDate.replace(tzinfo=datetime.timezone.utc)
+
+    rf_dir  = os.path.join(out_dir,channel)
+    if os.path.exists(rf_dir):
+        if not overwrite:
+            raise FileExistsError('{!s} already exists'.format(rf_dir))
+        shutil.rmtree(rf_dir)
+    os.makedirs(rf_dir)
+
+    rng         = np.random.default_rng(seed)
+    s_start     = int(sDate.timestamp())*fs
+    n_total     = int(round(days*86400*fs))
+    day_samples = 86400*fs
+    phase       = rng.uniform(0,2*np.pi,size=(len(freqs),len(modes)))
+
+    write_metadata(os.path.join(rf_dir,'metadata'),s_start,freqs,station)
+    dw  = drf.DigitalRFWriter(rf_dir,np.int16,3600,60000,s_start,fs,1,
+            is_complex=True,num_subchannels=len(freqs),is_continuous=False,compression_level=0)
+    gaps    = []
+    try:
+        for d0 in range(0,n_total,day_samples):
+            n_day   = min(day_samples,n_total-d0)
+            iq      = to_int16_pairs(synth_day((s_start+d0)/fs,n_day,freqs,modes,station['long'],snr_db,rng,phase))
+            spans   = gap_spans(n_day,gaps_per_day*n_day/day_samples,gap_seconds,rng)
+            b0      = 0
+            for g0,g1 in spans + [(n_day,n_day)]:
+                if g0 > b0:
+                    dw.rf_write(iq[b0:g0],next_sample=d0+b0)
+                b0  = g1
+            gaps.extend([(s_start+d0+g0,s_start+d0+g1) for g0,g1 in spans])
+    finally:
+        dw.close()
+
+    t_truth = s_start/fs + np.arange(n_total//fs)
+    np.savez(os.path.join(out_dir,'truth.npz'),t=t_truth,freqs=np.asarray(freqs),
+             mode_names=np.array([m['name'] for m in modes]),
+             amplitude=np.array([m['amplitude'] for m in modes]),
+             doppler=doppler_tracks(t_truth,freqs,modes,station['long']).astype(np.float32),
+             gaps=np.array(gaps,dtype=np.int64).reshape(-1,2))
+    print('{!s}: {!s} samples x {!s} subchannels from {!s}, {!s} gaps'.format(
+        out_dir,n_total,len(freqs),sDate.strftime('%Y-%m-%d %H:%M'),len(gaps)))
+    return {'out_dir':out_dir,'s0':s_start,'s1':s_start+n_total,'freqs':list(freqs),'gaps':gaps}
+
+def load_truth(out_dir):
+    """
+    Ground truth written by make_dataset: t, freqs, mode_names, amplitude, doppler (freq,mode,t) and gaps.
+    """
+    with np.load(os.path.join(out_dir,'truth.npz')) as npz:
+        return {key:npz[key] for key in npz.files}
+
+if __name__ == '__main__':
+    args    = sys.argv[1:]
+    seed    = 0
+    if '--seed' in args:
+        seed    = int(args[args.index('--seed')+1])
+        del args[args.index('--seed'):args.index('--seed')+2]
+    if len(args) < 3:
+        print("Rerun with the output directory, start date as YYYY-MM-DD, number of days, optionally the number of")
+        print("frequencies (first n of the Grape nine) and --seed n")
+        sys.exit()
+
+    n_freqs = int(args[3]) if len(args) > 3 else len(grape_frequencies)
+    make_dataset(args[0],args[1],float(args[2]),freqs=grape_frequencies[:n_freqs],seed=seed)
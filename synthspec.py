@@ -15,7 +15,6 @@ import  numpy as np
 import csv
 import sys
 import os
-import configparser
 from datetime import datetime
 import statistics
 import pylab as plt
@@ -23,9 +22,14 @@ import matplotlib.patches as mpatches
 import matplotlib.dates as mdates
 import matplotlib.units as munits
 
+import run_spec                  # module in this directory, read only config and tx rx geometry
+import stage_metrics             # module in this directory, stage timing, counters and peak memory
+
 # Get the command line arguments, first the two mandatory ones
 callsign = sys.argv[1]                     # callsign for subdirectory name
 csv_in_file = sys.argv[2]                  # *modefinder.csv file   
+stage_metrics.start('synthspec')           # stage times and counts to ./output/profiles at exit
+stage_metrics.mark('read')
 
 # Now the optional third, 'DB' if output to database
 try:                                             # use 'try' as it may not be there
@@ -48,11 +52,12 @@ csv_out_name=csv_dir+'/'+csv_in_file+'_synthspec.csv'
 
 config_file=config_dir + '/' + callsign + '_config.ini'
 
-# Read two parameters from the specific config.ini file, then the tx and rx from the metadata section as strings
-config = configparser.ConfigParser()
-config.read(config_file)
+# Read frequency from the specific config.ini file, then the tx and rx from the metadata section as strings
+config = run_spec.load(config_file)
 freq=config['settings'].getfloat('freq')
-distance=config['settings'].getfloat('distance')
+if csv_in_file.endswith('MHz'):               # file from pathfinder.py multi-frequency mode, e.g. 202407260000_10.0MHz
+  freq=float(csv_in_file.split('_')[-1][:-3])
+distance=run_spec.path_geometry(config)['distance']   # tx to rx great circle distance, km, as in pathfinder.py
 tx=config['metadata'].get('tx')
 rx=config['metadata'].get('rx')
 
@@ -89,6 +94,7 @@ print(header)
 # the sort the data array by p_mode then time
 # sort by p_mode is needed as to calculate doppler we take the difference at successive time intervals for the same mode.
 
+stage_metrics.mark('doppler')
 temp_data=np.array(data)
 
 indices=np.lexsort((temp_data[:,0], temp_data[:,2]))    # lexsort gives indicies in sorted order not sorted array, the first sort variable is second here
@@ -138,6 +144,7 @@ for i in range(1, n_traces):
 # Plot Doppler shifts
 ##################################################
 
+stage_metrics.mark('plot')
 fig, ax = plt.subplots()     
 plt.suptitle("Doppler shift of " + str(freq) + " MHz propagation modes between  " + tx + " and " + callsign, fontsize=12)
 
@@ -170,7 +177,9 @@ plt.legend(handles=[black_patch, blue_patch, green_patch, purple_patch, grey_pat
 
 # save and show the figure
 plt.savefig(plot_dir + "/" + csv_in_file + "_synth_doppler.png", dpi=600)
+stage_metrics.mark(None)                   # the time the plot window is open is not counted
 plt.show()
+stage_metrics.mark('plot')
 print("Doppler plot generated and saved")
 
 ##################################################
@@ -198,10 +207,12 @@ plt.legend(handles=[black_patch, blue_patch, green_patch, purple_patch, grey_pat
 
 # save and show the figure
 plt.savefig(plot_dir + "/" + csv_in_file + "_synth_delay.png", dpi=600)
+stage_metrics.mark(None)
 plt.show()
 print("Delay plot generated and saved")
 
 # output the original data plus doppler  into file *_modefinder.csv in ./output/csv/callsign dir
+stage_metrics.mark('write')
 with open(csv_out_name, 'w', encoding='UTF8',) as out_file:     # open a csv file for write
   writer=csv.writer(out_file)
   writer.writerow(["Date,Hops,p_mode,color,Init_elev,one_hop_virt_ht,one_hop_apogee,2nd_hop_apogee,gnd_range,phase_path,geo_path,pylap_doppler,doppler"])
@@ -209,6 +220,7 @@ with open(csv_out_name, 'w', encoding='UTF8',) as out_file:     # open a csv fil
   for i in range (0,n_traces):
     writer.writerow([sorted_data[i,0],sorted_data[i,1],sorted_data[i,2],sorted_data[i,3],sorted_data[i,4],sorted_data[i,5],\
        sorted_data[i,6],sorted_data[i,7],sorted_data[i,8],sorted_data[i,9],sorted_data[i,10], sorted_data[i,11],doppler[i], delay[i]])
+  stage_metrics.count('rows_written',n_traces)
 
 print("csv file * modefinder written")
 
@@ -225,6 +237,7 @@ if db_flag == 'DB':
   ###########################################################
   # Connect to and write into the database from the csv file
   ###########################################################
+  stage_metrics.mark('database')
   # initially set the connection flag to be None
   conn=None
   connected="Not connected"